@@ -0,0 +1,131 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Admission: Concurrency limits, a bounded priority wait queue and load shedding for incoming requests
+"""
+import bisect
+import itertools
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Raised instead of admitting a request. status is 429 if the wait queue was full, 503 if the wait timed out."""
+    def __init__(self, status, retry_after, reason):
+        super(Overloaded, self).__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    WAITING = 'waiting'
+    ADMITTED = 'admitted'
+    EVICTED = 'evicted'
+
+    def __init__(self, route, priority, seq):
+        self.route = route
+        self.key = (priority, seq)
+        self.state = self.WAITING
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class AdmissionGate:
+    """Lets at most capacity requests work at once, and at most route_limits[route] of them for any one route.
+
+    Requests that cannot start right away wait in a queue of at most max_queue, ordered by priority (lower first)
+    and then arrival. A request that finds the queue full is refused with a 429, unless it outranks the lowest
+    priority waiter, which is refused in its place. A request that waits longer than max_wait is refused with a 503.
+    Refusals carry a Retry-After estimated from the queue length and recent service times, so clients back off
+    instead of piling more work onto the worker."""
+    HIGH = 0
+    NORMAL = 1
+
+    def __init__(self, capacity=8, route_limits=None, max_queue=32, max_wait=2.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.route_limits = route_limits or {}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.active = 0
+        self.rejected = 0
+        self.service_time = 0.1
+        self._route_active = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def admit(self, route, priority=NORMAL):
+        """Wait for a slot. Returns the time admission was granted, to be passed to release."""
+        with self._cond:
+            # waiters are dispatched whenever a slot frees up, so none of them can use a slot that is free now
+            if self._has_room(route):
+                return self._start(route)
+
+            if len(self._waiters) >= self.max_queue:
+                worst = self._waiters[-1] if self._waiters else None
+                if worst is None or worst.key[0] <= priority:
+                    self.rejected += 1
+                    raise Overloaded(429, self._retry_after(), 'wait queue full')
+                self._waiters.pop()
+                worst.state = _Waiter.EVICTED
+                self._cond.notify_all()
+
+            waiter = _Waiter(route, priority, next(self._seq))
+            bisect.insort(self._waiters, waiter)
+
+            deadline = self.clock() + self.max_wait
+            while waiter.state == _Waiter.WAITING:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    self.rejected += 1
+                    raise Overloaded(503, self._retry_after(), 'timed out waiting for capacity')
+                self._cond.wait(remaining)
+
+            if waiter.state == _Waiter.EVICTED:
+                self.rejected += 1
+                raise Overloaded(429, self._retry_after(), 'displaced by a higher priority request')
+            return self.clock()
+
+    def release(self, route, started):
+        with self._cond:
+            self.active -= 1
+            self._route_active[route] -= 1
+            # moving average of how long a request holds its slot
+            self.service_time = 0.9 * self.service_time + 0.1 * (self.clock() - started)
+            self._dispatch()
+
+    def status(self):
+        with self._cond:
+            return {'active': self.active, 'capacity': self.capacity, 'queued': len(self._waiters),
+                    'routes': dict(self._route_active), 'rejected': self.rejected,
+                    'service_ms': round(self.service_time * 1000, 1)}
+
+    def _has_room(self, route):
+        limit = self.route_limits.get(route, self.capacity)
+        return self.active < self.capacity and self._route_active.get(route, 0) < limit
+
+    def _start(self, route):
+        self.active += 1
+        self._route_active[route] = self._route_active.get(route, 0) + 1
+        return self.clock()
+
+    def _dispatch(self):
+        """Admit waiters in priority order while there is room. Waiters whose route is at its limit are skipped."""
+        admitted = False
+        for waiter in list(self._waiters):
+            if self.active >= self.capacity:
+                break
+            if self._has_room(waiter.route):
+                self._waiters.remove(waiter)
+                waiter.state = _Waiter.ADMITTED
+                self._start(waiter.route)
+                admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def _retry_after(self):
+        return max(1, min(60, int(math.ceil((len(self._waiters) + 1) * self.service_time / self.capacity))))
@@ -0,0 +1,276 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    EmailArchive: Append only, compressed archive of every package email, indexed by Message-ID, date and package id
+
+    usage: python EmailArchive.py ARCHIVE_DIR show --message-id <id> | --package <id>
+           python EmailArchive.py ARCHIVE_DIR reparse [--unparsed] [--since 2026-10-01]
+"""
+import argparse
+import base64
+import bisect
+import datetime
+import email
+import email.utils
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from EmailParser import EmailParser
+
+RECORD_HEADER = struct.Struct('>I')
+
+
+class ArchiveEntry:
+    """Index entry for one archived email. segment, offset and length locate its compressed bytes."""
+    def __init__(self, segment, offset, length, message_id=None, date=None, tenant=None, title=None, packages=(),
+                 raw=True, archived=None):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.message_id = message_id
+        self.date = date
+        self.tenant = tenant
+        self.title = title
+        self.packages = list(packages)
+        self.raw = raw
+        self.archived = archived
+
+    def __str__(self):
+        return '(ArchiveEntry %s, date %s, tenant %s, packages %s)' % (self.message_id, self.date, self.tenant,
+                                                                       self.packages)
+
+    def __repr__(self):
+        return str(self)
+
+    def to_json(self):
+        return json.dumps({'seg': self.segment, 'off': self.offset, 'len': self.length, 'id': self.message_id,
+                           'date': self.date, 'tenant': self.tenant, 'title': self.title, 'pkgs': self.packages,
+                           'raw': self.raw, 't': self.archived}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, line):
+        data = json.loads(line)
+        return cls(data['seg'], data['off'], data['len'], data.get('id'), data.get('date'), data.get('tenant'),
+                   data.get('title'), data.get('pkgs', []), data.get('raw', True), data.get('t'))
+
+
+class EmailArchive:
+    """Directory of segment files holding zlib compressed emails back to back, each with a json lines index.
+
+    Every process appends to its own segments (named after its pid), so gunicorn workers never write to the same
+    file, and starts a new one once a segment reaches max_segment_bytes. The indexes of all segments are loaded on
+    the first lookup; reads then go straight to the record through a memory map of its segment."""
+    def __init__(self, path, max_segment_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        self._segment = None
+        self._index_file = None
+        self._pid = None
+        self._sequence = 0
+        self._entries = None
+        self._by_id = {}
+        self._by_package = {}
+        self._by_date = []
+        self._maps = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, raw: bytes, message_id=None, date=None, tenant=None, title=None, packages=(), is_raw=True):
+        """Store an email. raw is the full RFC 822 message, or just the body text if is_raw is False."""
+        data = zlib.compress(raw, 9)
+        with self._lock:
+            self._open_segment(len(data))
+            offset = self._segment.tell() + RECORD_HEADER.size
+            self._segment.write(RECORD_HEADER.pack(len(data)) + data)
+            self._segment.flush()
+
+            entry = ArchiveEntry(os.path.basename(self._segment.name), offset, len(data), message_id,
+                                 self.normalize_date(date), tenant, title, packages, is_raw, time.time())
+            self._index_file.write(entry.to_json() + '\n')
+            self._index_file.flush()
+            if self._entries is not None:
+                self._index(entry)
+        return entry
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+            for m in self._maps.values():
+                m.close()
+            self._maps = {}
+
+    def entries(self):
+        """Every archived email in the order they were archived"""
+        with self._lock:
+            self._load()
+            return list(self._entries)
+
+    def by_message_id(self, message_id):
+        with self._lock:
+            self._load()
+            return list(self._by_id.get(message_id, []))
+
+    def by_package(self, package_id):
+        with self._lock:
+            self._load()
+            return list(self._by_package.get(package_id, []))
+
+    def between(self, start=None, end=None):
+        """Emails dated within [start, end), given as ISO 8601 strings or datetimes, oldest first"""
+        start = self.normalize_date(start) if start is not None else ''
+        end = self.normalize_date(end) if end is not None else None
+        with self._lock:
+            self._load()
+            first = bisect.bisect_left(self._by_date, (start, ))
+            last = len(self._by_date) if end is None else bisect.bisect_left(self._by_date, (end, ))
+            return [self._entries[i] for date, i in self._by_date[first:last]]
+
+    def unparsed(self):
+        """Emails in which no package was found"""
+        return [e for e in self.entries() if not e.packages]
+
+    def read(self, entry: ArchiveEntry):
+        """Return the archived bytes of an email"""
+        with self._lock:
+            m = self._maps.get(entry.segment)
+            if m is None or len(m) < entry.offset + entry.length:
+                # the segment has grown since it was mapped
+                if m is not None:
+                    m.close()
+                with open(os.path.join(self.path, entry.segment), 'rb') as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[entry.segment] = m
+            return zlib.decompress(m[entry.offset:entry.offset + entry.length])
+
+    def read_body(self, entry: ArchiveEntry):
+        """Return the text body of an archived email, the same text EmailParser is given"""
+        data = self.read(entry)
+        if not entry.raw:
+            return data.decode('utf-8')
+        return self.body_of(email.message_from_bytes(data))
+
+    @staticmethod
+    def body_of(message):
+        """First text part of a message, like easyimap's MailObj.body"""
+        for part in message.walk():
+            if part.get_content_maintype() == 'text' and not part.get_filename():
+                payload = part.get_payload(decode=True) or b''
+                return payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+        return ''
+
+    @staticmethod
+    def normalize_date(date):
+        """Turn an email Date header, ISO string or datetime into a sortable UTC ISO string, or None"""
+        if date is None or date == '':
+            return None
+        if not isinstance(date, datetime.datetime):
+            try:
+                date = email.utils.parsedate_to_datetime(date)
+            except (TypeError, ValueError):
+                try:
+                    date = datetime.datetime.strptime(date[:19], '%Y-%m-%dT%H:%M:%S' if 'T' in date else '%Y-%m-%d')
+                except ValueError:
+                    return None
+        if date.tzinfo is not None:
+            date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        entries = []
+        for index in glob.glob(os.path.join(self.path, '*.idx')):
+            with open(index) as f:
+                # a line without a newline is a write that was cut short
+                entries.extend(ArchiveEntry.from_json(line) for line in f if line.endswith('\n'))
+        entries.sort(key=lambda e: (e.archived or 0, e.segment, e.offset))
+
+        self._entries = []
+        self._by_id = {}
+        self._by_package = {}
+        self._by_date = []
+        for entry in entries:
+            self._index(entry)
+
+    def _index(self, entry: ArchiveEntry):
+        self._entries.append(entry)
+        if entry.message_id is not None:
+            self._by_id.setdefault(entry.message_id, []).append(entry)
+        for package_id in entry.packages:
+            self._by_package.setdefault(package_id, []).append(entry)
+        if entry.date is not None:
+            bisect.insort(self._by_date, (entry.date, len(self._entries) - 1))
+
+    def _open_segment(self, size):
+        if self._pid != os.getpid():
+            # files inherited across a fork belong to the parent
+            self._segment = None
+            self._index_file = None
+            self._pid = os.getpid()
+        if self._segment is not None and self._segment.tell() + size > self.max_segment_bytes:
+            self._close_segment()
+        if self._segment is None:
+            self._sequence += 1
+            name = os.path.join(self.path, 'emails-{}-{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), os.getpid(),
+                                                                    self._sequence))
+            self._segment = open(name + '.seg', 'ab')
+            self._index_file = open(name + '.idx', 'a')
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index_file.close()
+            self._segment = None
+            self._index_file = None
+
+
+def encode_raw(raw: bytes):
+    """Encode raw email bytes for the json posted to /email"""
+    return base64.b64encode(raw).decode('ascii')
+
+
+def decode_raw(text: str):
+    return base64.b64decode(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up and re-parse archived package emails')
+    parser.add_argument('archive')
+    commands = parser.add_subparsers(dest='command')
+    show = commands.add_parser('show', help='print archived emails')
+    show.add_argument('--message-id')
+    show.add_argument('--package', type=int)
+    reparse = commands.add_parser('reparse', help='run the current EmailParser over archived emails')
+    reparse.add_argument('--unparsed', action='store_true', help='only emails in which no package was found')
+    reparse.add_argument('--since', help='only emails dated on or after this day')
+    args = parser.parse_args()
+
+    archive = EmailArchive(args.archive)
+    if args.command == 'show':
+        entries = archive.by_message_id(args.message_id) if args.message_id else archive.by_package(args.package)
+        for entry in entries:
+            print(entry)
+            print(archive.read(entry).decode('utf-8', errors='replace'))
+    elif args.command == 'reparse':
+        entries = archive.unparsed() if args.unparsed else archive.entries()
+        if args.since:
+            since = archive.normalize_date(args.since)
+            entries = [e for e in entries if e.date is not None and e.date >= since]
+        email_parser = EmailParser()
+        found = 0
+        for entry in entries:
+            parsed = email_parser.parse(archive.read_body(entry))
+            found += bool(parsed)
+            print('{} {} {}'.format(entry.message_id, entry.packages, parsed))
+        print('{} of {} emails have a package code'.format(found, len(entries)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    EmailParser: Extracts pickup codes from package notification emails using a registry of carrier templates
+"""
+import html
+import re
+
+
+class ParsedPackage:
+    """A single package found in an email. recipients are the names or units the email was addressed to."""
+    def __init__(self, code: int, template: str, recipients=None):
+        self.code = code
+        self.template = template
+        self.recipients = recipients or []
+
+    def __str__(self):
+        return '(Parsed package, code %d, template %s, recipients %s)' % (self.code, self.template, self.recipients)
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParsedPackage):
+            return False
+
+        return self.code == other.code and self.template == other.template and self.recipients == other.recipients
+
+
+class EmailTemplate:
+    """Compiled pattern for one carrier or mailroom system.
+
+    marker is a pattern for the phrase that appears next to the codes in that system's emails. It is used both to decide
+    whether the template applies and to find the region of the body worth parsing, so large html emails only have a
+    few hundred characters stripped and searched instead of the whole thing. In html, every \\s of the marker also
+    matches tags and non-breaking space entities, so markers split by markup are still found.
+
+    Markers are matched against the lowercased body. A marker written in lowercase is matched case sensitively, which
+    is many times faster than a case insensitive pattern; any other marker is still matched ignoring case.
+
+    keyword is a lowercase word that every marker match contains, e.g. 'code'. If given, the parser finds it with a
+    plain string search first, and the marker pattern only runs within keyword_window characters of it."""
+    HTML_SPACE = '(?:\\s|<[^>]*>|&(?:nbsp|#160|#x[aA]0);)'
+
+    def __init__(self, name: str, marker: str, code_pattern: str, region_before=200, region_after=400, keyword=None,
+                 keyword_window=200):
+        self.name = name
+        self.marker = marker
+        self.keyword = keyword
+        self.keyword_window = keyword_window
+        flags = 0 if marker == marker.lower() else re.IGNORECASE
+        self.marker_re = re.compile(marker, flags)
+        self.html_marker_re = re.compile(marker.replace('\\s', self.HTML_SPACE), flags)
+        self.code_re = re.compile(code_pattern, re.IGNORECASE)
+        self.region_before = region_before
+        self.region_after = region_after
+
+    def __str__(self):
+        return '(EmailTemplate %s)' % self.name
+
+    def __repr__(self):
+        return str(self)
+
+    def find_region(self, lowered: str, is_html=False, hits=None):
+        """Return the (start, end) slice of the body that contains every marker, or None if the marker is not present.
+        lowered is the body as returned by EmailParser.lower. hits are the positions of keyword in it, if known; the
+        marker is then only searched for around them."""
+        marker_re = self.html_marker_re if is_html else self.marker_re
+        if hits is None:
+            first = marker_re.search(lowered)
+            if first is None:
+                return None
+
+            last = first
+            for last in marker_re.finditer(lowered, first.end()):
+                pass
+            start, end = first.start(), last.end()
+        else:
+            start = end = None
+            for hit in hits:
+                window_end = hit + len(self.keyword) + self.keyword_window
+                for match in marker_re.finditer(lowered, max(0, hit - self.keyword_window), window_end):
+                    start = match.start() if start is None else min(start, match.start())
+                    end = match.end() if end is None else max(end, match.end())
+            if start is None:
+                return None
+
+        return max(0, start - self.region_before), min(len(lowered), end + self.region_after)
+
+    def extract(self, text: str):
+        """Return the codes found in text, in order, without duplicates"""
+        codes = []
+        for match in self.code_re.finditer(text):
+            code = int(match.group('code'))
+            if code not in codes:
+                codes.append(code)
+        return codes
+
+
+class EmailParser:
+    """Try each registered template in order and return the packages found by the first one that matches"""
+    HTML_HINT_RE = re.compile('<(?:html|body|div|table|td|p|br|span)\\b', re.IGNORECASE)
+    HTML_DROP_RE = re.compile('<(script|style|head)\\b.*?</\\1\\s*>', re.IGNORECASE | re.DOTALL)
+    HTML_BREAK_RE = re.compile('<(?:br|/p|/div|/tr|/td|/th|/li|/h[1-6])\\b[^>]*>', re.IGNORECASE)
+    HTML_TAG_RE = re.compile('<[^>]*>')
+
+    # Fields that name who a package is for. Matched against the same text as the codes, lowercased, since case
+    # insensitive alternations are several times slower to scan for; the names are taken from the original text.
+    # Each pattern is only run if one of its words is in the text.
+    RECIPIENT_RES = [
+        (re.compile('(?:recipient|resident|addressee|ship\\s+to|deliver\\s+to)\\s*:\\s*([^\\n,;:]{2,40}?)\\s*(?:$|[\\n,;])',
+                    re.MULTILINE),
+         (':', )),
+        (re.compile('^\\s*(?:dear|hello|hi)\\s+([a-z][a-z .\'-]{1,38}?)\\s*[,!:]', re.MULTILINE),
+         ('dear', 'hello', 'hi')),
+        (re.compile('\\b((?:unit|apt\\.?|apartment|suite)\\s*#?\\s*[0-9]+[a-z]?)\\b'),
+         ('unit', 'apt', 'apartment', 'suite')),
+    ]
+    GENERIC_RECIPIENTS = {'resident', 'residents', 'tenant', 'customer', 'there', 'neighbor'}
+
+    DEFAULT_TEMPLATES = [
+        # Mailroom notices ("Pickup Code 1234") and Amazon Hub style lockers ("Your pickup code is 123456")
+        EmailTemplate('pickup_code', 'pickup\\s+code', 'pickup\\s+code(?:\\s+is)?\\s*[:#]?\\s*(?P<code>[0-9]+)',
+                      keyword='code'),
+        # Luxer One / Package Concierge lockers
+        EmailTemplate('access_code', 'access\\s+code', 'access\\s+code(?:\\s+is)?\\s*[:#]?\\s*(?P<code>[0-9]+)',
+                      keyword='code'),
+        # Parcel Pending style lockers
+        EmailTemplate('locker_code', 'locker\\s+code', 'locker\\s+code(?:\\s+is)?\\s*[:#]?\\s*(?P<code>[0-9]+)',
+                      keyword='code'),
+        # Smart lockers that send a release / retrieval code
+        EmailTemplate('release_code', '(?:release|retrieval)\\s+code',
+                      '(?:release|retrieval)\\s+code(?:\\s+is)?\\s*[:#]?\\s*(?P<code>[0-9]+)', keyword='code'),
+    ]
+
+    def __init__(self, templates=None):
+        self.templates = list(self.DEFAULT_TEMPLATES if templates is None else templates)
+
+    def register(self, template: EmailTemplate, first=False):
+        """Add a template to the registry. Templates registered first take priority."""
+        if first:
+            self.templates.insert(0, template)
+        else:
+            self.templates.append(template)
+
+    def parse(self, body: str):
+        """Return a list of ParsedPackages found in the email body. The list is empty if no template matched."""
+        if not body:
+            return []
+
+        is_html = self.HTML_HINT_RE.search(body) is not None
+        # one pass of str.find per keyword tells which templates can match at all and where, which is far cheaper
+        # than running each marker pattern over a large html body
+        lowered = self.lower(body)
+        keyword_hits = {}
+        for template in self.templates:
+            hits = None
+            if template.keyword is not None:
+                hits = keyword_hits.get(template.keyword)
+                if hits is None:
+                    hits = keyword_hits[template.keyword] = self.find_all(lowered, template.keyword)
+                if not hits:
+                    continue
+
+            region = template.find_region(lowered, is_html, hits)
+            if region is None:
+                continue
+
+            text = body[region[0]:region[1]]
+            if is_html:
+                text = self.html_to_text(text)
+
+            codes = template.extract(text)
+            if codes:
+                recipients = self.find_recipients(body if not is_html else text)
+                return [ParsedPackage(code, template.name, recipients) for code in codes]
+
+        return []
+
+    @staticmethod
+    def find_all(text: str, word: str):
+        """Positions of every occurrence of word in text"""
+        positions = []
+        position = text.find(word)
+        while position != -1:
+            positions.append(position)
+            position = text.find(word, position + len(word))
+        return positions
+
+    @staticmethod
+    def lower(text: str):
+        """text.lower(), keeping every character at its position. The few characters that lower to two are kept."""
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            return lowered
+        return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+    @classmethod
+    def find_recipients(cls, text: str):
+        """Return the names and units that text says the packages are for, in order, without duplicates"""
+        recipients = []
+        lowered = cls.lower(text)
+        for recipient_re, words in cls.RECIPIENT_RES:
+            if not any(word in lowered for word in words):
+                continue
+            for match in recipient_re.finditer(lowered):
+                recipient = ' '.join(text[match.start(1):match.end(1)].split())
+                if recipient.lower() not in cls.GENERIC_RECIPIENTS and recipient not in recipients:
+                    recipients.append(recipient)
+        return recipients
+
+    @classmethod
+    def html_to_text(cls, markup: str):
+        """Strip tags and entities from an html fragment, keeping line breaks between block elements"""
+        text = cls.HTML_DROP_RE.sub(' ', markup)
+        text = cls.HTML_BREAK_RE.sub('\n', text)
+        text = cls.HTML_TAG_RE.sub(' ', text)
+        return html.unescape(text)
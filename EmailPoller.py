@@ -0,0 +1,192 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    EmailPoller: Polls the mailroom inboxes from exactly one process, chosen by a leader lock
+"""
+import fcntl
+import os
+import threading
+import time
+import traceback
+import zlib
+
+import psycopg2
+
+from PNBDatabase import PNBDatabase, connect_args
+
+
+class LeaderLock():
+    """Lock held by whichever process is currently allowed to poll. Released automatically if that process dies."""
+    def acquire(self):
+        """Try to take the lock without blocking. Returns True if this process now holds it."""
+        raise NotImplementedError("This is an abstract class!")
+
+    def is_held(self):
+        """Return True if this process still holds the lock"""
+        raise NotImplementedError("This is an abstract class!")
+
+    def release(self):
+        raise NotImplementedError("This is an abstract class!")
+
+
+class AdvisoryLock(LeaderLock):
+    """Postgres session level advisory lock, so one poller runs across every dyno sharing the database.
+    The lock lives on its own connection and is dropped by the server as soon as that connection dies."""
+    def __init__(self, db_config: PNBDatabase.Config, name='pnb-email-poller'):
+        self.db_config = db_config
+        self.key = zlib.crc32(name.encode())
+        self.conn = None
+
+    def acquire(self):
+        try:
+            if self.conn is None or self.conn.closed:
+                args, kwargs = connect_args(self.db_config)
+                self.conn = psycopg2.connect(*args, **kwargs)
+                self.conn.autocommit = True
+
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key, ))
+                return cur.fetchone()[0]
+        except psycopg2.Error:
+            traceback.print_exc()
+            self._disconnect()
+            return False
+
+    def is_held(self):
+        if self.conn is None or self.conn.closed:
+            return False
+
+        try:
+            # the lock is held for as long as the session that took it is alive
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            traceback.print_exc()
+            self._disconnect()
+            return False
+
+    def release(self):
+        if self.conn is not None and not self.conn.closed:
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.key, ))
+            except psycopg2.Error:
+                traceback.print_exc()
+        self._disconnect()
+
+    def _disconnect(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class FileLock(LeaderLock):
+    """flock on a local file, for running several workers on one machine without a shared database lock"""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        if self.fd is not None:
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        return True
+
+    def is_held(self):
+        return self.fd is not None
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class EmailPoller():
+    """Background thread that checks every mailbox each poll_period seconds while it holds the leader lock.
+
+    Every worker runs one, and the others wait to take over the lock. A leader that cannot read any mailbox
+    max_failures times in a row steps down so another worker can try."""
+    def __init__(self, mailboxes, lock: LeaderLock, poll_period=20, max_failures=5):
+        self.mailboxes = mailboxes
+        self.lock = lock
+        self.poll_period = poll_period
+        self.max_failures = max_failures
+
+        self.is_leader = False
+        self.last_poll = None
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pnb-email-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling, release the lock and close the mailboxes"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def poll(self):
+        """Check every mailbox once. Returns True if at least one could be read."""
+        results = [mailbox.check_for_email() for mailbox in self.mailboxes]
+        if any(results):
+            self.last_poll = time.time()
+            self.failures = 0
+            return True
+
+        self.failures += 1
+        return False
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._step()
+                except:
+                    traceback.print_exc()
+                self._stop.wait(self.poll_period)
+        finally:
+            self._step_down()
+            for mailbox in self.mailboxes:
+                mailbox.close()
+
+    def _step(self):
+        if self.is_leader and not self.lock.is_held():
+            print('Email poller lost leadership')
+            self.is_leader = False
+
+        if not self.is_leader:
+            self.is_leader = self.lock.acquire()
+            if not self.is_leader:
+                return
+            print('Email poller {} is now polling'.format(os.getpid()))
+
+        if not self.poll() and self.failures >= self.max_failures:
+            print('Email poller failed {} times, handing over'.format(self.failures))
+            self._step_down()
+            # give another worker a chance to take the lock before trying again
+            self._stop.wait(self.poll_period)
+
+    def _step_down(self):
+        if self.is_leader:
+            self.lock.release()
+        self.is_leader = False
+        self.failures = 0
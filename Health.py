@@ -0,0 +1,111 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Health: Liveness and readiness checks for the load balancer
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import requests
+
+import Resilience
+
+# Errors that mean a dependency is failing, so they count against a worker's health. Anything else, e.g. a user's
+# typo reaching an unexpected code path, is a bug worth a traceback but says nothing about whether to send traffic here.
+DEPENDENCY_ERRORS = (Resilience.CircuitOpen, psycopg2.OperationalError, requests.RequestException)
+
+
+class RateWindow:
+    """Counts events and errors over the last span seconds in one second buckets"""
+    def __init__(self, span=60, clock=time.time):
+        self.span = span
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, error=False):
+        now = int(self.clock())
+        with self._lock:
+            events, errors = self._buckets.get(now, (0, 0))
+            self._buckets[now] = (events + 1, errors + int(bool(error)))
+            if len(self._buckets) > self.span:
+                self._expire(now)
+
+    def counts(self):
+        """(events, errors) seen during the window"""
+        with self._lock:
+            self._expire(int(self.clock()))
+            return sum(b[0] for b in self._buckets.values()), sum(b[1] for b in self._buckets.values())
+
+    def error_rate(self):
+        events, errors = self.counts()
+        return errors / events if events else 0.0
+
+    def _expire(self, now):
+        for second in [s for s in self._buckets if s <= now - self.span]:
+            del self._buckets[second]
+
+
+class HealthCheck:
+    """Decides whether a worker should get traffic.
+
+    A worker is unready if it cannot get a database connection and run a query within ping_timeout (the server is
+    down or every pooled connection stayed in use), its change listener or email poller thread has died, or more than
+    max_error_rate of at least min_events recent requests failed with one of DEPENDENCY_ERRORS. A poller that has not
+    read the inboxes for a while is only reported, since another worker may be the leader or the mail server may be
+    down for everyone."""
+    class Config():
+        def __init__(self, ping_timeout=1, max_error_rate=0.5, min_events=10):
+            self.ping_timeout = ping_timeout
+            self.max_error_rate = max_error_rate
+            self.min_events = min_events
+
+    def __init__(self, config: Config = None):
+        self.config = config or HealthCheck.Config()
+        self.requests = RateWindow()
+        self.started = time.time()
+
+    def liveness(self):
+        return {'status': 'ok', 'pid': os.getpid(), 'uptime': round(time.time() - self.started, 1)}
+
+    def readiness(self, tenants, poller, gate=None):
+        """Return (ready, report) for a TenantRouter, EmailPoller and optionally the AdmissionGate"""
+        problems = []
+
+        pool = tenants.db.pool
+        db_ok = tenants.db.ping(self.config.ping_timeout)
+        saturation = pool.saturation()
+        if not db_ok:
+            problems.append('no database connection within {}s'.format(self.config.ping_timeout))
+
+        listener_ok = tenants.listener.is_running()
+        if not listener_ok:
+            problems.append('change listener stopped')
+
+        poller_ok = poller.is_running()
+        if not poller_ok:
+            problems.append('email poller stopped')
+
+        events, errors = self.requests.counts()
+        error_rate = errors / events if events else 0.0
+        if events >= self.config.min_events and error_rate > self.config.max_error_rate:
+            problems.append('error rate {:.0%}'.format(error_rate))
+
+        last_poll = poller.last_poll
+        report = {
+            'status': 'degraded' if problems else 'ok',
+            'problems': problems,
+            'db': {'ok': db_ok, 'in_use': pool.in_use, 'max_connections': pool.max_connections,
+                   'saturation': round(saturation, 2)},
+            'listener': {'running': listener_ok},
+            'poller': {'running': poller_ok, 'leader': poller.is_leader, 'last_poll': last_poll,
+                       'last_poll_age': None if last_poll is None else round(time.time() - last_poll, 1),
+                       'failures': poller.failures},
+            'queue_depth': tenants.queue_depth(),
+            'breakers': {name: breaker.status() for name, breaker in list(Resilience.breakers.items())},
+            'requests': {'events': events, 'errors': errors, 'error_rate': round(error_rate, 3)},
+        }
+        if gate is not None:
+            report['admission'] = gate.status()
+        return not problems, report
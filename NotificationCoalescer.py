@@ -0,0 +1,47 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    NotificationCoalescer: Batches packages that arrive close together so users get one message for all of them
+"""
+import threading
+import traceback
+
+from Tracing import tracer
+
+
+class NotificationCoalescer:
+    """Collects packages for window seconds after the first one arrives, then passes them all to flush_fn at once.
+    With a window of 0 every batch is passed on immediately."""
+    def __init__(self, flush_fn, window=0):
+        self.flush_fn = flush_fn
+        self.window = window
+        self.pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, packages):
+        if self.window <= 0:
+            self.flush_fn(list(packages))
+            return
+
+        with self._lock:
+            self.pending.extend(packages)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send everything that is waiting now"""
+        with self._lock:
+            packages = self.pending
+            self.pending = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if packages:
+            try:
+                with tracer.trace('coalesced_notification', packages=len(packages)):
+                    self.flush_fn(packages)
+            except:
+                traceback.print_exc()
@@ -2,10 +2,26 @@
     created by Jordan Gassaway, 9/23/2020
     PNBDatabase: Facilitates connection to the database of users and packages
 """
+import contextlib
 import enum
+import json
+import os
+import re
+import select
+import threading
+import time
+import traceback
+import zlib
 from datetime import date
 
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2 import sql
+
+from Resilience import get_breaker
+from Tracing import tracer
 
 
 class User:
@@ -50,6 +66,8 @@ class User:
 
 class Package:
     next_id = 0
+    # requests handled on several threads add packages at once
+    _id_lock = threading.Lock()
 
     def __init__(self, id:int, code: int, date_received: date, collected: bool):
         self.id = id
@@ -74,13 +92,293 @@ class Package:
 
     @classmethod
     def set_next_id(cls, next_id):
-        cls.next_id = next_id
+        with cls._id_lock:
+            cls.next_id = next_id
+
+    @classmethod
+    def advance_next_id(cls, next_id):
+        """Move next_id up to next_id, never backwards"""
+        with cls._id_lock:
+            cls.next_id = max(cls.next_id, next_id)
+
+    @classmethod
+    def take_id(cls):
+        with cls._id_lock:
+            id = cls.next_id
+            cls.next_id += 1
+            return id
 
     @classmethod
     def newPackage(cls, code: int, date_received: date):
-        id = cls.next_id
-        cls.next_id += 1
-        return cls(id=id, code=code, date_received=date_received, collected=False)
+        return cls(id=cls.take_id(), code=code, date_received=date_received, collected=False)
+
+
+class PoolTimeout(Exception):
+    """Raised when every pooled connection stays in use for longer than the caller is willing to wait"""
+
+
+def connect_args(config, connect_timeout=5, statement_timeout=10):
+    """psycopg2.connect arguments for config that give up connecting after connect_timeout seconds and have the
+    server cancel statements after statement_timeout seconds"""
+    args, kwargs = config.get_connect_args()
+    return args, dict(kwargs, connect_timeout=connect_timeout,
+                      options='-c statement_timeout={:d}'.format(int(statement_timeout * 1000)))
+
+
+class ConnectionPool:
+    """Thread safe pool of database connections, shared by every PNBDatabase (and so every tenant) in the process.
+
+    Connections are only made when first borrowed. A pool inherited across a fork is abandoned rather than used, so
+    parent and child never share a socket.
+
+    Nothing waits on Postgres forever: connecting gives up after connect_timeout seconds, statements are cancelled by
+    the server after statement_timeout seconds, and borrowing a connection gives up after wait_timeout seconds. The
+    first two count against the circuit breaker called name; running out of connections only means this worker is
+    busy, which says nothing about Postgres."""
+    def __init__(self, config, max_connections=5, connect_timeout=5, statement_timeout=10, wait_timeout=10,
+                 name='postgres'):
+        self.config = config
+        self.name = name
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout
+        self.wait_timeout = wait_timeout
+        self.breaker = get_breaker(name, failures=(psycopg2.OperationalError, psycopg2.InterfaceError))
+        self.in_use = 0
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def open(self):
+        """Set up the pool. Safe to call more than once and does not connect to the database."""
+        with self._lock:
+            self._check_fork()
+            if self._pool is None:
+                args, kwargs = connect_args(self.config, self.connect_timeout, self.statement_timeout)
+                self._pool = psycopg2.pool.ThreadedConnectionPool(0, self.max_connections, *args, **kwargs)
+                self._pid = os.getpid()
+
+    def close(self):
+        with self._lock:
+            self._check_fork()
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def saturation(self):
+        """Fraction of the pool's connections that are borrowed right now"""
+        return self.in_use / self.max_connections
+
+    def warm_up(self, count=1):
+        """Connect count connections now so that requests do not pay for it"""
+        with contextlib.ExitStack() as stack:
+            for _ in range(min(count, self.max_connections)):
+                stack.enter_context(self.connection())
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection, waiting up to timeout seconds (wait_timeout if None) for one to free up"""
+        self.open()
+        slots = self._slots
+        timeout = self.wait_timeout if timeout is None else timeout
+        if not slots.acquire(timeout=-1 if timeout is None else timeout):
+            raise PoolTimeout("No database connection free after {}s".format(timeout))
+        pool = self._pool
+        conn = None
+        try:
+            conn = pool.getconn()
+            with self._lock:
+                self.in_use += 1
+            yield conn
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self.in_use -= 1
+                pool.putconn(conn, close=bool(conn.closed))
+            slots.release()
+
+    def _check_fork(self):
+        if self._pool is not None and self._pid != os.getpid():
+            # closing would terminate the parent's sessions, so just forget the inherited connections
+            self._pool = None
+            self.in_use = 0
+            self._slots = threading.BoundedSemaphore(self.max_connections)
+
+
+class ReplicaSet:
+    """Connection pools for read replicas of the primary database, shared by every tenant like ConnectionPool.
+
+    Reads are spread round robin over the replicas whose circuit breaker is closed. Replicas lag the primary, so a
+    user who just wrote something keeps reading from the primary for sticky_window seconds. Writes made without a
+    user, e.g. new packages from an email, make every read sticky for that long."""
+    ANYONE = object()
+
+    def __init__(self, configs, max_connections=5, sticky_window=5, clock=time.time):
+        self.pools = [ConnectionPool(config, max_connections, name='postgres-replica-{}'.format(i))
+                      for i, config in enumerate(configs)]
+        self.sticky_window = sticky_window
+        self.clock = clock
+        self._last_write = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pools)
+
+    def open(self):
+        for pool in self.pools:
+            pool.open()
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+    def warm_up(self, count=1):
+        for pool in self.pools:
+            try:
+                pool.warm_up(count)
+            except (PoolTimeout, psycopg2.Error):
+                traceback.print_exc()
+
+    def noteWrite(self, actor=None):
+        """Record a write by actor (a PFID), or by no one in particular if actor is None"""
+        now = self.clock()
+        with self._lock:
+            self._last_write[self.ANYONE if actor is None else actor] = now
+            # forget writes that no longer make anyone sticky
+            if len(self._last_write) > 1000:
+                self._last_write = {a: t for a, t in self._last_write.items() if now - t < self.sticky_window}
+
+    def isSticky(self, actor=None):
+        """True if actor's reads must go to the primary to see recent writes"""
+        now = self.clock()
+        with self._lock:
+            for key in (self.ANYONE, actor):
+                if key is not None and now - self._last_write.get(key, -self.sticky_window) < self.sticky_window:
+                    return True
+        return False
+
+    def pick(self):
+        """Return the pool of the next healthy replica, or None if every replica is down"""
+        with self._lock:
+            for _ in range(len(self.pools)):
+                pool = self.pools[self._next % len(self.pools)]
+                self._next += 1
+                if not pool.breaker.is_open():
+                    return pool
+        return None
+
+
+class ChangeEvent:
+    """A write made by some PNBDatabase, possibly in another process. key is a user's PFID or a package's id."""
+    RESET = 'reset'
+
+    def __init__(self, tenant, table, op, key=None):
+        self.tenant = tenant
+        self.table = table
+        self.op = op
+        self.key = key
+
+    def __str__(self):
+        return '(ChangeEvent %s %s %s, tenant %s)' % (self.op, self.table, self.key, self.tenant)
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, ChangeEvent):
+            return False
+
+        return self.tenant == other.tenant and self.table == other.table and self.op == other.op and \
+            self.key == other.key
+
+    @classmethod
+    def reset(cls):
+        """Event telling subscribers that changes may have been missed and all cached state should be dropped"""
+        return cls(None, None, cls.RESET)
+
+    def to_payload(self):
+        return json.dumps({'tenant': self.tenant, 'table': self.table, 'op': self.op, 'key': self.key})
+
+    @classmethod
+    def from_payload(cls, payload):
+        data = json.loads(payload)
+        return cls(data['tenant'], data['table'], data['op'], data['key'])
+
+
+class ChangeListener:
+    """Background thread that LISTENs for the change events published by PNBDatabase writes, so that every worker
+    can keep its in-memory state in sync with writes made by the others"""
+    CHANNEL = 'pnb_changes'
+
+    def __init__(self, config, poll_timeout=5, retry_delay=5):
+        self.config = config
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.callbacks = []
+        self._running = False
+        self._thread = None
+
+    def subscribe(self, callback):
+        """callback(ChangeEvent) is called from the listener thread for every change"""
+        self.callbacks.append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='pnb-change-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(self.poll_timeout + 1)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def dispatch(self, event: ChangeEvent):
+        for callback in self.callbacks:
+            try:
+                callback(event)
+            except:
+                traceback.print_exc()
+
+    def _run(self):
+        while self._running:
+            conn = None
+            try:
+                args, kwargs = connect_args(self.config)
+                conn = psycopg2.connect(*args, **kwargs)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.CHANNEL)))
+
+                # anything could have changed while we were not listening
+                self.dispatch(ChangeEvent.reset())
+
+                while self._running:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(ChangeEvent.from_payload(conn.notifies.pop(0).payload))
+            except:
+                traceback.print_exc()
+                time.sleep(self.retry_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+# PFID of the user whose message the current thread is handling, see PNBDatabase.actingAs
+_actor = threading.local()
 
 
 class PNBDatabase:
@@ -107,96 +405,377 @@ class PNBDatabase:
                                                                                 self.password)
             return (conn_str, ), {}
 
-    def __init__(self, config: Config):
+    TABLES = ['users', 'packages', 'aliases', 'reminders']
+    CREATE_TABLES_LOCK = zlib.crc32(b'pnb-create-tables')
+
+    def __init__(self, config: Config, schema=None, pool: ConnectionPool = None, replicas: ReplicaSet = None):
+        """schema selects the tenant whose users and packages tables are used. None uses the default search path.
+        Reads that can be slightly stale go to replicas if given; everything else goes to the primary in config."""
         self.config = config
+        self.schema = schema
+        self._owns_pool = pool is None
+        self.pool = ConnectionPool(config) if pool is None else pool
+        self.replicas = replicas
+        self._queries = {}
+
+        # users found by getUser are only cached while a ChangeListener keeps them up to date. Misses are not cached;
+        # PackageNotifier keeps its own negative cache of senders who are not users.
+        self.cache_users = False
+        self._users = {}
+        # bumped whenever cached users are dropped, so a lookup that raced a change does not cache what it read
+        self._users_generation = 0
+        self._users_lock = threading.Lock()
+        self._subscribers = []
+
+    def forTenant(self, schema):
+        """Return a PNBDatabase for another tenant's tables that shares this database's connection pools"""
+        return PNBDatabase(self.config, schema, self.pool, self.replicas)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def actingAs(PFID):
+        """Attribute writes made by this thread inside the block to a user, so that user reads their own writes"""
+        previous = getattr(_actor, 'PFID', None)
+        _actor.PFID = PFID
+        try:
+            yield
+        finally:
+            _actor.PFID = previous
+
+    def attachListener(self, listener: ChangeListener):
+        """Keep this database's caches in sync with writes made by other processes, and turn caching on"""
+        self._forgetUser()
+        self.cache_users = True
+        listener.subscribe(self.onChange)
+
+    def subscribe(self, callback):
+        """callback(ChangeEvent) is called for every change to this tenant's tables, including resets"""
+        self._subscribers.append(callback)
+
+    def onChange(self, event: ChangeEvent):
+        # package ids are shared by all tenants, so every tenant's inserts move next_id
+        if event.table == 'packages' and event.op == 'insert':
+            Package.advance_next_id(event.key + 1)
+
+        if event.op != ChangeEvent.RESET and event.tenant != self.schema:
+            return
+
+        if event.op == ChangeEvent.RESET:
+            self._forgetUser()
+            Package.advance_next_id(self._get_max_package_id() + 1)
+        elif event.table == 'users':
+            self._forgetUser(event.key)
+
+        # writes by other workers have to reach the replicas too
+        if self.replicas is not None and event.op != ChangeEvent.RESET:
+            self.replicas.noteWrite(event.key if event.table == 'users' else None)
+
+        for callback in self._subscribers:
+            callback(event)
 
     def login(self):
-        args, kwargs = self.config.get_connect_args()
-        self.conn = psycopg2.connect(*args, **kwargs)
-        self.cur = self.conn.cursor()
-
-        # This is necessary because resetting the server will reset next_id to 0, leading to duplicate package ids
-        Package.set_next_id(self._get_max_package_id() + 1)
+        self.pool.open()
+        if self.replicas is not None:
+            self.replicas.open()
+
+        # tables added since the database was first set up, and new tenants' schemas, are created on the next start.
+        # Nothing is created while every table exists, so a role that may only read and write data can log in.
+        missing = self.missingTables()
+        if missing:
+            try:
+                self.createTables()
+            except psycopg2.errors.InsufficientPrivilege:
+                traceback.print_exc()
+                print('Tables {} of tenant {} are missing and this role cannot create them. Run createTables as the '
+                      'database owner, e.g. with replay_traffic.py --init-db.'.format(missing, self.schema))
+
+        # This is necessary because resetting the server will reset next_id to 0, leading to duplicate package ids.
+        # Package ids are unique across tenants, so never move next_id backwards.
+        Package.advance_next_id(self._get_max_package_id() + 1)
+
+    def warmUp(self, connections=1):
+        """Connect ahead of the first request and fill the user cache if it is turned on"""
+        self.pool.warm_up(connections)
+        if self.replicas is not None:
+            self.replicas.warm_up(connections)
+        if self.cache_users:
+            generation = self._users_generation
+            users = self.getAllUsers()
+            with self._users_lock:
+                if generation == self._users_generation:
+                    for user in users:
+                        self._users.setdefault(user.PFID, user)
+
+    def ping(self, timeout=1):
+        """Return True if a connection can be borrowed within timeout seconds and the server answers"""
+        try:
+            with self.pool.connection(timeout) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            return True
+        except (PoolTimeout, psycopg2.Error):
+            return False
 
     def close(self):
-        self.cur.close()
-        self.conn.close()
+        if self._owns_pool:
+            self.pool.close()
+            if self.replicas is not None:
+                self.replicas.close()
+
+    def missingTables(self):
+        """Names of the tenant's tables that do not exist yet"""
+        with self._cursor('missingTables') as cur:
+            names = [self._table(table).as_string(cur) for table in self.TABLES]
+            cur.execute("SELECT " + ', '.join(['to_regclass(%s)'] * len(names)), names)
+            found = cur.fetchone()
+        return [table for table, oid in zip(self.TABLES, found) if oid is None]
+
+    def createTables(self):
+        """Create the tenant's schema and tables if they do not exist yet"""
+        with self._cursor('createTables') as cur:
+            # every worker does this when it starts, and concurrent CREATE ... IF NOT EXISTS can still collide
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (self.CREATE_TABLES_LOCK, ))
+            if self.schema:
+                cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(self.schema)))
+            cur.execute(self._query("CREATE TABLE IF NOT EXISTS {users} (pfid varchar(20) PRIMARY KEY, "
+                                    "name varchar(40) NOT NULL, ugroup varchar(10) NOT NULL)"))
+            cur.execute(self._query("CREATE TABLE IF NOT EXISTS {packages} (id integer PRIMARY KEY, "
+                                    "code integer NOT NULL, date_received date NOT NULL, collected bool)"))
+            # the primary key doubles as the index for looking users up by alias
+            cur.execute(self._query("CREATE TABLE IF NOT EXISTS {aliases} (alias varchar(40) NOT NULL, "
+                                    "pfid varchar(20) NOT NULL REFERENCES {users} ON DELETE CASCADE, "
+                                    "PRIMARY KEY (alias, pfid))"))
+            # number of reminders sent about each uncollected package
+            cur.execute(self._query("CREATE TABLE IF NOT EXISTS {reminders} (package_id integer PRIMARY KEY "
+                                    "REFERENCES {packages} ON DELETE CASCADE, sent smallint NOT NULL)"))
 
     def addUser(self, user: User):
-        self.cur.execute("INSERT INTO users (pfid, name, ugroup) VALUES (%s, %s, %s)", (user.PFID, user.name,
-                                                                                        user.group.value))
-        self.conn.commit()
+        with self._cursor('addUser') as cur:
+            cur.execute(self._query("INSERT INTO {users} (pfid, name, ugroup) VALUES (%s, %s, %s)"),
+                        (user.PFID, user.name, user.group.value))
+            self._publish(cur, 'users', 'insert', user.PFID)
+        self._forgetUser(user.PFID)
 
     def getUser(self, PFID: int):
-        self.cur.execute("SELECT * FROM users WHERE pfid = %s", (PFID, ))
-        user = self.cur.fetchone()
+        if self.cache_users:
+            user = self._users.get(PFID)
+            if user is not None:
+                return user
+
+        # a stale user would stay in the cache, so cached lookups always read the primary
+        generation = self._users_generation
+        with self._cursor('getUser', replica=not self.cache_users) as cur:
+            cur.execute(self._query("SELECT * FROM {users} WHERE pfid = %s"), (PFID, ))
+            user = cur.fetchone()
         if user is None:
             return None
-        else:
-            return User(user[0], user[1], User.Group(user[2]))
 
-    def getAllUsers(self):
-        self.cur.execute("SELECT * FROM users")
-        user = self.cur.fetchone()
-        users = []
-        while user is not None:
-            users.append(User(user[0], user[1], User.Group(user[2])))
-            user = self.cur.fetchone()
+        user = User(user[0], user[1], User.Group(user[2]))
+        if self.cache_users:
+            with self._users_lock:
+                if generation == self._users_generation:
+                    self._users[PFID] = user
+        return user
+
+    def _forgetUser(self, PFID=None):
+        """Drop a user, or every user, from the cache"""
+        with self._users_lock:
+            self._users_generation += 1
+            if PFID is None:
+                self._users.clear()
+            else:
+                self._users.pop(PFID, None)
+
+    def getCachedUser(self, PFID):
+        """Return the user if getUser has cached them, without querying the database"""
+        return self._users.get(PFID) if self.cache_users else None
 
-        return users
+    def getAllUsers(self):
+        with self._cursor('getAllUsers', replica=True) as cur:
+            cur.execute(self._query("SELECT * FROM {users}"))
+            return [User(user[0], user[1], User.Group(user[2])) for user in cur]
 
     def getAllAdmins(self):
-        self.cur.execute("SELECT * FROM users WHERE ugroup=%s", (User.Group.ADMIN.value, ))
-        user = self.cur.fetchone()
-        users = []
-        while user is not None:
-            users.append(User(user[0], user[1], User.Group(user[2])))
-            user = self.cur.fetchone()
+        with self._cursor('getAllAdmins', replica=True) as cur:
+            cur.execute(self._query("SELECT * FROM {users} WHERE ugroup=%s"), (User.Group.ADMIN.value, ))
+            return [User(user[0], user[1], User.Group(user[2])) for user in cur]
+
+    def iterPFIDs(self, admins_only=False, chunk_size=500):
+        """Yield the PFIDs of every user, or every admin, in lists of up to chunk_size. Rows are fetched from a server
+        side cursor as the lists are consumed, so the roster is never loaded all at once. The connection is held until
+        the generator is exhausted or closed."""
+        if admins_only:
+            query, args = "SELECT pfid FROM {users} WHERE ugroup=%s", (User.Group.ADMIN.value, )
+        else:
+            query, args = "SELECT pfid FROM {users}", None
 
-        return users
+        with self._cursor('iterPFIDs', replica=True, name='pnb_pfids') as cur:
+            cur.itersize = chunk_size
+            cur.execute(self._query(query), args)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield [row[0] for row in rows]
 
     def getUserByName(self, name: str):
-        self.cur.execute("SELECT * FROM users WHERE LOWER(name) = LOWER(%s)", (name, ))
-        user = self.cur.fetchone()
+        with self._cursor('getUserByName', replica=True) as cur:
+            cur.execute(self._query("SELECT * FROM {users} WHERE LOWER(name) = LOWER(%s)"), (name, ))
+            user = cur.fetchone()
         if user is None:
             return None
         else:
             return User(user[0], user[1], User.Group(user[2]))
 
     def removeUser(self, user: User):
-        self.cur.execute("DELETE FROM users WHERE pfid = %s", (user.PFID, ))
-        self.conn.commit()
-
-    def addPackage(self, package:Package):
-        self.cur.execute("INSERT INTO packages (id, code, date_received, collected) VALUES (%s, %s, %s, %s)", (package.id, package.code, package.date_received, package.collected))
-        self.conn.commit()
+        with self._cursor('removeUser') as cur:
+            cur.execute(self._query("DELETE FROM {users} WHERE pfid = %s"), (user.PFID, ))
+            self._publish(cur, 'users', 'delete', user.PFID)
+        self._forgetUser(user.PFID)
+
+    @staticmethod
+    def normalizeAlias(alias: str):
+        """Lower case, drop punctuation and unit prefixes so 'Apt. #4B' and '4b' are the same alias"""
+        words = re.sub('[^a-z0-9 ]', ' ', alias.lower()).split()
+        if len(words) > 1 and words[0] in ('unit', 'apt', 'apartment', 'suite', 'ste', 'room'):
+            words = words[1:]
+        return ' '.join(words)
+
+    def addAlias(self, user: User, alias: str):
+        """Register a name or unit that package emails might use for the user"""
+        with self._cursor('addAlias') as cur:
+            cur.execute(self._query("INSERT INTO {aliases} (alias, pfid) VALUES (%s, %s) ON CONFLICT DO NOTHING"),
+                        (self.normalizeAlias(alias), user.PFID))
+        self._noteWrite()
+
+    def removeAlias(self, user: User, alias: str):
+        with self._cursor('removeAlias') as cur:
+            cur.execute(self._query("DELETE FROM {aliases} WHERE alias = %s AND pfid = %s"),
+                        (self.normalizeAlias(alias), user.PFID))
+        self._noteWrite()
+
+    def getAliases(self, user: User):
+        with self._cursor('getAliases', replica=True) as cur:
+            cur.execute(self._query("SELECT alias FROM {aliases} WHERE pfid = %s ORDER BY alias"), (user.PFID, ))
+            return [row[0] for row in cur]
+
+    def getPFIDsByAlias(self, aliases):
+        """Return the PFIDs of every user registered under any of the aliases"""
+        aliases = [self.normalizeAlias(a) for a in aliases]
+        aliases = [a for a in aliases if a]
+        if not aliases:
+            return []
+
+        with self._cursor('getPFIDsByAlias', replica=True) as cur:
+            cur.execute(self._query("SELECT DISTINCT pfid FROM {aliases} WHERE alias = ANY(%s)"), (aliases, ))
+            return [row[0] for row in cur]
+
+    def addPackage(self, package:Package, attempts=5):
+        """Insert a new package. Another worker may have given out its id moments ago, before the change event saying
+        so arrived; then the package gets the next free id instead."""
+        for attempt in range(attempts):
+            try:
+                with self._cursor('addPackage') as cur:
+                    cur.execute(self._query("INSERT INTO {packages} (id, code, date_received, collected) "
+                                            "VALUES (%s, %s, %s, %s)"),
+                                (package.id, package.code, package.date_received, package.collected))
+                    self._publish(cur, 'packages', 'insert', package.id)
+                return
+            except psycopg2.errors.UniqueViolation:
+                if attempt == attempts - 1:
+                    raise
+                print('Package id {} was taken by another worker'.format(package.id))
+                Package.advance_next_id(self._get_max_package_id() + 1)
+                package.id = Package.take_id()
 
     def getPackage(self, id):
-        self.cur.execute("SELECT * FROM packages WHERE id = %s", (id,))
-        package = self.cur.fetchone()
+        with self._cursor('getPackage', replica=True) as cur:
+            cur.execute(self._query("SELECT * FROM {packages} WHERE id = %s"), (id,))
+            package = cur.fetchone()
         if package is None:
             return None
         else:
             return Package(package[0], package[1], package[2], package[3])
 
     def getUncollectedPackages(self):
-        self.cur.execute("SELECT * FROM packages WHERE collected=False")
-        package = self.cur.fetchone()
-        packages = []
-        while package is not None:
-            packages.append(Package(package[0], package[1], package[2], package[3]))
-            package = self.cur.fetchone()
-
-        return packages
+        with self._cursor('getUncollectedPackages', replica=True) as cur:
+            cur.execute(self._query("SELECT * FROM {packages} WHERE collected=False"))
+            return [Package(package[0], package[1], package[2], package[3]) for package in cur]
 
     def claimPackage(self, package: Package):
-        self.cur.execute("UPDATE packages SET collected=True WHERE id=%s", (package.id,))
-        self.conn.commit()
+        with self._cursor('claimPackage') as cur:
+            cur.execute(self._query("UPDATE {packages} SET collected=True WHERE id=%s"), (package.id,))
+            self._publish(cur, 'packages', 'claim', package.id)
+
+    def getPendingReminders(self):
+        """Every uncollected package with the number of reminders sent about it so far"""
+        with self._cursor('getPendingReminders', replica=True) as cur:
+            cur.execute(self._query("SELECT p.id, p.code, p.date_received, p.collected, COALESCE(r.sent, 0) "
+                                    "FROM {packages} p LEFT JOIN {reminders} r ON r.package_id = p.id "
+                                    "WHERE p.collected=False"))
+            return [(Package(row[0], row[1], row[2], row[3]), row[4]) for row in cur]
+
+    def markReminded(self, package: Package, sent: int):
+        """Record that sent reminders have gone out about an uncollected package. Returns False if the package was
+        collected or another worker already recorded them, so every reminder is only sent once."""
+        with self._cursor('markReminded') as cur:
+            cur.execute(self._query("INSERT INTO {reminders} AS r (package_id, sent) "
+                                    "SELECT id, %s FROM {packages} WHERE id=%s AND collected=False "
+                                    "ON CONFLICT (package_id) DO UPDATE SET sent=EXCLUDED.sent "
+                                    "WHERE r.sent < EXCLUDED.sent"), (sent, package.id))
+            return cur.rowcount == 1
 
     def _get_max_package_id(self):
-        """Return the largest package id in the database"""
-        self.cur.execute("SELECT MAX(id) FROM packages")
-        return int(self.cur.fetchone()[0])
+        """Return the largest package id in the database, or -1 if there are no packages"""
+        with self._cursor('_get_max_package_id') as cur:
+            cur.execute(self._query("SELECT COALESCE(MAX(id), -1) FROM {packages}"))
+            return int(cur.fetchone()[0])
+
+    def _publish(self, cur, table, op, key):
+        """Notify every ChangeListener of a write. Sent when the write's transaction commits."""
+        cur.execute("SELECT pg_notify(%s, %s)", (ChangeListener.CHANNEL,
+                                                 ChangeEvent(self.schema, table, op, key).to_payload()))
+        self._noteWrite()
+
+    def _noteWrite(self):
+        if self.replicas is not None:
+            self.replicas.noteWrite(getattr(_actor, 'PFID', None))
+
+    @contextlib.contextmanager
+    def _cursor(self, operation, replica=False, name=None):
+        """Cursor on a pooled connection. The transaction is committed when the block exits cleanly.
+        The whole block, including waiting for a connection, is timed as a span named after the operation.
+        With replica=True a read replica is used unless the acting user has written recently or none are healthy.
+        Giving a name makes it a server side cursor.
+        Raises CircuitOpen without touching the pool while Postgres is known to be down."""
+        with tracer.span('db', operation, tenant=self.schema) as span:
+            pool = self._readPool() if replica else self.pool
+            if pool is not self.pool:
+                span.tags['replica'] = pool.name
+            with pool.breaker.guard(), pool.connection() as conn:
+                span.tags['pool_wait_ms'] = round(span.elapsed() * 1000, 1)
+                with conn.cursor(name) as cur:
+                    yield cur
+                conn.commit()
+
+    def _readPool(self):
+        if self.replicas is None or self.replicas.isSticky(getattr(_actor, 'PFID', None)):
+            return self.pool
+        return self.replicas.pick() or self.pool
+
+    def _query(self, query: str):
+        """Fill the {users}, {packages}, {aliases} and {reminders} table names in for this tenant.
+        Composed queries are cached."""
+        composed = self._queries.get(query)
+        if composed is None:
+            composed = sql.SQL(query).format(users=self._table('users'), packages=self._table('packages'),
+                                             aliases=self._table('aliases'), reminders=self._table('reminders'))
+            self._queries[query] = composed
+        return composed
+
+    def _table(self, name):
+        return sql.Identifier(self.schema, name) if self.schema else sql.Identifier(name)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    PackageIndex: In memory index of a tenant's uncollected packages
+"""
+import bisect
+import threading
+
+from PNBDatabase import ChangeEvent, Package, PNBDatabase
+
+
+class PackageIndex:
+    """Uncollected packages keyed by id and ordered by date received, loaded from the database on first use.
+
+    The owner keeps it current by calling add and remove after its own writes. Claims made by other workers arrive
+    as change events and are removed; packages added by other workers, and listener resets, drop the whole index so
+    it is loaded again on next use."""
+    def __init__(self, db: PNBDatabase):
+        self.db = db
+        self._packages = None
+        self._order = []
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._load())
+
+    def uncollected(self):
+        """Uncollected packages, oldest first"""
+        packages = self._load()
+        with self._lock:
+            if packages is self._packages:
+                return [packages[id] for date_received, id in self._order]
+        return sorted(packages.values(), key=lambda p: (p.date_received, p.id))
+
+    def get(self, id):
+        """Return the package if it is uncollected, otherwise None"""
+        return self._load().get(id)
+
+    def add(self, package: Package):
+        with self._lock:
+            self._generation += 1
+            if self._packages is not None and not package.collected and package.id not in self._packages:
+                self._packages[package.id] = package
+                bisect.insort(self._order, (package.date_received, package.id))
+
+    def remove(self, id):
+        with self._lock:
+            self._generation += 1
+            if self._packages is not None and id in self._packages:
+                package = self._packages.pop(id)
+                del self._order[bisect.bisect_left(self._order, (package.date_received, id))]
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._packages = None
+            self._order = []
+
+    def onChange(self, event: ChangeEvent):
+        if event.op == ChangeEvent.RESET:
+            self.invalidate()
+        elif event.table == 'packages' and event.op == 'claim':
+            self.remove(event.key)
+        elif event.table == 'packages' and event.op == 'insert':
+            with self._lock:
+                known = self._packages is None or event.key in self._packages
+            if not known:
+                self.invalidate()
+
+    def _load(self):
+        with self._lock:
+            if self._packages is not None:
+                return self._packages
+            generation = self._generation
+
+        packages = {p.id: p for p in self.db.getUncollectedPackages()}
+        with self._lock:
+            # a write during the query may be missing from the result, so only keep it if nothing changed
+            if generation == self._generation:
+                self._packages = packages
+                self._order = sorted((p.date_received, p.id) for p in packages.values())
+        return packages
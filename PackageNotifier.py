@@ -3,17 +3,44 @@
     PackageNotifier: Top Level class for business logic portion of package notifier app
 """
 import datetime
-import re
 
 import requests
 from pymessenger.bot import Bot
 
-from PNBDatabase import PNBDatabase, User, Package
+from EmailParser import EmailParser
+from NotificationCoalescer import NotificationCoalescer
+from PackageIndex import PackageIndex
+from PreparedMessage import PreparedMessage
+from ReminderScheduler import ReminderScheduler
+from RecipientStream import RecipientStream
+from PNBDatabase import ChangeEvent, PNBDatabase, User, Package
+from Resilience import GuardedProxy, get_breaker
+from Throttle import NegativeCache, SenderThrottle
+from Tracing import TracedProxy, tracer
 
 
 class PackageNotifier:
     class Config():
-        def __init__(self, auth_token, db_config: PNBDatabase.Config, user_passphrase, admin_passphrase):
+        def __init__(self, auth_token, db_config: PNBDatabase.Config, user_passphrase, admin_passphrase, tenant=None,
+                     page_id=None, coalesce_window=0, graph_url=None, http_timeout=10, reminder_days=None,
+                     reminder_hour=9, passphrase_attempts=10, passphrase_window=600):
+            """tenant is the database schema holding this building's users and packages, page_id is the id of its
+            Facebook page. Both are only needed when one process serves several buildings.
+            Packages that arrive within coalesce_window seconds of each other are announced in one message.
+            graph_url replaces the Facebook Graph API, e.g. with a local stand in for load tests.
+            Graph API calls give up after http_timeout seconds.
+            Users are reminded about uncollected packages the given numbers of reminder_days after they arrive, at
+            reminder_hour o'clock; the last reminder goes to the admins instead. Empty or None turns reminders off.
+            Senders who are not users get passphrase_attempts messages answered every passphrase_window seconds."""
+            self.passphrase_window = passphrase_window
+            self.passphrase_attempts = passphrase_attempts
+            self.reminder_hour = reminder_hour
+            self.reminder_days = list(reminder_days or [])
+            self.http_timeout = http_timeout
+            self.graph_url = graph_url
+            self.coalesce_window = coalesce_window
+            self.page_id = page_id
+            self.tenant = tenant
             self.admin_passphrase = admin_passphrase
             self.user_passphrase = user_passphrase
             self.db_config = db_config
@@ -23,6 +50,9 @@ class PackageNotifier:
     * list packages - list all uncollected packages
     * help - show this help menu
     * claim package [id] - mark the specified package as collected
+    * add alias [name or unit] - only get notified about packages addressed to you (e.g. add alias 4B)
+    * remove alias [name or unit] - stop using a name or unit
+    * list aliases - list the names and units you are notified for
     * unsubscribe - stop receiving package notifications and remove yourself from the system"""
     HELP_TEXT_ADMIN = HELP_TEXT + """
     * remove user [name] - remove a user from the service
@@ -33,23 +63,82 @@ class PackageNotifier:
     NEW_PACKAGE_NOTIFICATION_TEXT = """New package received (Package #{:d}) 
 Pickup code {} 
 Respond with 'claim package {:d}' to mark as collected"""
+    NEW_PACKAGES_DIGEST_TEXT = """{:d} new packages received
+{}
+Respond with 'claim package [id]' to mark one as collected"""
+    DIGEST_LINE_TEXT = """Package #{:d}: pickup code {}"""
+    REMINDER_TEXT = """Reminder: these packages have been waiting for {:d} days
+{}
+Respond with 'claim package [id]' to mark one as collected"""
+    ADMIN_REMINDER_TEXT = """These packages have not been collected after {:d} days
+{}"""
 
     FB_PROFILE_INFO_URL = "https://graph.facebook.com/{}?fields={}&access_token={}"
+    JSON_HEADERS = {'Content-Type': 'application/json'}
 
-    PACKAGE_CODE_RE = re.compile('([pP]ickup [cC]ode)\\s*([0-9]+)')
-
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, db: PNBDatabase = None):
+        """db is a database shared with other tenants' PackageNotifiers. If not given a new connection is made."""
         self.config = config
-        self.db = PNBDatabase(config.db_config)
+        self.db = PNBDatabase(config.db_config) if db is None else db.forTenant(config.tenant)
         self.db.login()
 
-        self.bot = Bot(config.auth_token)
+        bot = Bot(config.auth_token)
+        self.profile_info_url = self.FB_PROFILE_INFO_URL
+        if config.graph_url is not None:
+            bot.graph_url = config.graph_url.rstrip('/')
+            self.profile_info_url = bot.graph_url + "/{}?fields={}&access_token={}"
+        # pymessenger posts without a timeout or keep-alive, so send through our own session
+        self.session = requests.Session()
+        self._message_request = None
+        bot.send_raw = lambda payload: self._send_raw(bot, payload)
+        # every tenant talks to the same Graph API, so they share one breaker
+        self.graph_breaker = get_breaker('graph')
+        self.bot = TracedProxy(GuardedProxy(bot, self.graph_breaker), 'http', 'messenger.')
+        self.parser = EmailParser()
+        self.packages = PackageIndex(self.db)
+        self.db.subscribe(self.packages.onChange)
+        self.coalescer = NotificationCoalescer(self.notify_new_packages, config.coalesce_window)
+        # senders who are not users, and their passphrase guesses
+        self.unverified = NegativeCache(config.passphrase_window)
+        self.guesses = SenderThrottle(config.passphrase_attempts / config.passphrase_window, config.passphrase_attempts)
+        self.db.subscribe(self.onChange)
+        self.reminders = None
+        if config.reminder_days:
+            self.reminders = ReminderScheduler(self.db, config.reminder_days, self.send_reminders,
+                                               config.reminder_hour)
+            self.db.subscribe(self.reminders.onChange)
+
+    def start(self):
+        """Start sending reminders, if they are turned on"""
+        if self.reminders is not None:
+            self.reminders.start()
+
+    def close(self):
+        """Send any notifications still waiting to be coalesced"""
+        self.coalescer.flush()
+        if self.reminders is not None:
+            self.reminders.stop(5)
+        self.session.close()
+
+    def queue_depth(self):
+        """Number of packages waiting to be sent in a coalesced notification"""
+        return len(self.coalescer.pending)
 
     def handle_message(self, message):
         """Handle a new message sent from messenger"""
         # Facebook Messenger ID for user so we know where to send response back to
         sender_pfid = message['sender']['id']
-        user = self.db.getUser(sender_pfid)
+        with self.db.actingAs(sender_pfid):
+            self._handle_message(sender_pfid, message)
+
+    def _handle_message(self, sender_pfid, message):
+        # senders known not to be users need no lookup
+        user = None if sender_pfid in self.unverified else self.db.getUser(sender_pfid)
+        if user is None:
+            if not self.guesses.allow(sender_pfid):
+                # out of passphrase guesses, so not worth a reply
+                return
+            self.unverified.add(sender_pfid)
 
         text = message['message'].get('text')
         # print("New message {} {!r}".format(text, text))
@@ -59,6 +148,7 @@ Respond with 'claim package {:d}' to mark as collected"""
             # process menu command
             if text == self.config.user_passphrase and user is None:
                 # add user to database
+                self.unverified.discard(sender_pfid)
                 sender_name = self.get_user_name(sender_pfid)
                 self.db.addUser(User.newUser(sender_pfid, sender_name))
 
@@ -67,6 +157,7 @@ Respond with 'claim package {:d}' to mark as collected"""
 
             elif text == self.config.admin_passphrase and user is None:
                 # add admin to database
+                self.unverified.discard(sender_pfid)
                 sender_name = self.get_user_name(sender_pfid)
                 self.db.addUser(User.newAdmin(sender_pfid, sender_name))
 
@@ -83,12 +174,19 @@ Respond with 'claim package {:d}' to mark as collected"""
             # Don't care?
             self.bot.send_text_message(sender_pfid, self.UNKNOWN_CMD_TEXT)
 
+    def onChange(self, event: ChangeEvent):
+        """Users added by other workers are no longer unverified"""
+        if event.op == ChangeEvent.RESET:
+            self.unverified.clear()
+        elif event.table == 'users':
+            self.unverified.discard(event.key)
+
     def handle_cmd(self, cmd: str, sender: User):
         if cmd == 'help':
             self.bot.send_text_message(sender.PFID, self.HELP_TEXT_ADMIN if sender.isAdmin() else self.HELP_TEXT)
 
         elif cmd == 'list packages':
-            packages = self.db.getUncollectedPackages()
+            packages = self.packages.uncollected()
             if len(packages) == 0:
                 self.bot.send_text_message(sender.PFID, "There are no unclaimed packages")
                 return
@@ -97,16 +195,45 @@ Respond with 'claim package {:d}' to mark as collected"""
                 self.bot.send_text_message(sender.PFID, str(package))
 
         elif cmd.startswith('claim package'):
-            package_id = int(cmd.split(' ')[2])
-            package = self.db.getPackage(package_id)
+            package_id = cmd[13:].strip()
+            if not package_id.isdigit():
+                self.bot.send_text_message(sender.PFID, "No package found with ID: {}".format(package_id))
+                return
+
+            package_id = int(package_id)
+            package = self.packages.get(package_id)
+            if package is None:
+                # collected already, or added by another worker moments ago
+                package = self.db.getPackage(package_id)
 
             if package is None:
                 self.bot.send_text_message(sender.PFID, "No package found with ID: {}".format(package_id))
                 return
 
             self.db.claimPackage(package)
+            self.packages.remove(package.id)
+            if self.reminders is not None:
+                self.reminders.remove(package.id)
             self.bot.send_text_message(sender.PFID, "Package marked as collected")
 
+        elif cmd.startswith('add alias '):
+            alias = cmd[10:].strip()
+            self.db.addAlias(sender, alias)
+            self.bot.send_text_message(sender.PFID, "You will be notified about packages for {}".format(alias))
+
+        elif cmd.startswith('remove alias '):
+            alias = cmd[13:].strip()
+            self.db.removeAlias(sender, alias)
+            self.bot.send_text_message(sender.PFID, "Removed alias {}".format(alias))
+
+        elif cmd == 'list aliases':
+            aliases = self.db.getAliases(sender)
+            if len(aliases) == 0:
+                self.bot.send_text_message(sender.PFID, "You have no aliases, so you are notified about every package")
+                return
+
+            self.bot.send_text_message(sender.PFID, 'Aliases:\n' + '\n'.join(aliases))
+
         elif cmd == 'unsubscribe':
             self.db.removeUser(sender)
             self.bot.send_text_message(sender.PFID, 'You have been unsubscribed from this service')
@@ -133,31 +260,98 @@ Respond with 'claim package {:d}' to mark as collected"""
             self.bot.send_text_message(sender.PFID, self.UNKNOWN_CMD_TEXT)
 
     def handle_email(self, email):
-        """Handle a new email fetched from the server"""
-        # get code from email
-        match = self.PACKAGE_CODE_RE.search(email.body)
-        if not match:
-            msg = "Error: No pickup code found for email {}".format(email.body)
+        """Handle a new email fetched from the server. Returns the packages that were added."""
+        # get codes from email
+        parsed = self.parser.parse(email.body)
+        if not parsed:
+            msg = PreparedMessage("Error: No pickup code found for email {}".format(email.body))
             print(msg)
-            admins = self.db.getAllAdmins()
-            for admin in admins:
-                self.bot.send_text_message(admin.PFID, msg)
+            for pfid in RecipientStream(self.db.iterPFIDs(admins_only=True)):
+                self.bot.send_text_message(pfid, msg)
+            return []
+
+        # add packages to db
+        arrivals = []
+        for item in parsed:
+            package = Package.newPackage(item.code, datetime.date.today())
+            self.db.addPackage(package)
+            self.packages.add(package)
+            if self.reminders is not None:
+                self.reminders.add(package)
+            arrivals.append((package, item.recipients))
+
+        # notify users, possibly together with other packages that arrive soon
+        self.coalescer.add(arrivals)
+        return [package for package, recipients in arrivals]
+
+    def notify_new_packages(self, arrivals):
+        """Send each user one message about their packages. arrivals is a list of (package, recipients) pairs.
+        Packages whose recipients match users' aliases only go to those users; the rest go to everyone."""
+        packages_by_pfid = {}
+        unmatched = []
+        for package, recipients in arrivals:
+            pfids = self.db.getPFIDsByAlias(recipients) if recipients else []
+            if not pfids:
+                unmatched.append(package)
+            for pfid in pfids:
+                packages_by_pfid.setdefault(pfid, []).append(package)
+
+        if unmatched:
+            # everyone gets the unmatched packages, so the roster is streamed instead of loaded
+            broadcast = PreparedMessage(self.new_packages_message(unmatched))
+            for pfid in RecipientStream(self.db.iterPFIDs()):
+                targeted = packages_by_pfid.pop(pfid, None)
+                msg = broadcast if targeted is None else self.new_packages_message(targeted + unmatched)
+                self.bot.send_text_message(pfid, msg)
+
+        for pfid, packages in packages_by_pfid.items():
+            self.bot.send_text_message(pfid, self.new_packages_message(packages))
+
+    def send_reminders(self, stage, packages):
+        """Send reminder number stage about packages, to every user or, for the last reminder, to the admins"""
+        # other workers are reminding about the same packages, and only the first to record a reminder sends it
+        packages = [package for package in packages if self.db.markReminded(package, stage + 1)]
+        if not packages:
             return
 
-        code = int(match.group(2))
+        last = stage == len(self.config.reminder_days) - 1
+        lines = '\n'.join([self.DIGEST_LINE_TEXT.format(p.id, p.code) for p in sorted(packages, key=lambda p: p.id)])
+        msg = PreparedMessage((self.ADMIN_REMINDER_TEXT if last else self.REMINDER_TEXT).format(
+            self.config.reminder_days[stage], lines))
+        for pfid in RecipientStream(self.db.iterPFIDs(admins_only=last)):
+            self.bot.send_text_message(pfid, msg)
 
-        # add package to db
-        package = Package.newPackage(code, datetime.date.today())
-        self.db.addPackage(package)
+    def new_packages_message(self, packages):
+        if len(packages) == 1:
+            return self.NEW_PACKAGE_NOTIFICATION_TEXT.format(packages[0].id, packages[0].code, packages[0].id)
 
-        # notify users
-        users = self.db.getAllUsers()
-        msg = self.NEW_PACKAGE_NOTIFICATION_TEXT.format(package.id, package.code, package.id)
-
-        for user in users:
-            self.bot.send_text_message(user.PFID, msg)
+        lines = '\n'.join([self.DIGEST_LINE_TEXT.format(p.id, p.code) for p in sorted(packages, key=lambda p: p.id)])
+        return self.NEW_PACKAGES_DIGEST_TEXT.format(len(packages), lines)
 
     def get_user_name(self, pfid):
-        data = requests.get(self.FB_PROFILE_INFO_URL.format(pfid, 'first_name,last_name', self.config.auth_token)).json()
+        with tracer.span('http', 'get_user_name'), self.graph_breaker.guard():
+            data = requests.get(self.profile_info_url.format(pfid, 'first_name,last_name', self.config.auth_token),
+                                timeout=self.config.http_timeout).json()
         return data['first_name'] + ' ' + data['last_name']
 
+    def _send_raw(self, bot, payload):
+        url = '{0}/me/messages'.format(bot.graph_url)
+        text = payload.get('message', {}).get('text')
+        if isinstance(text, PreparedMessage):
+            response = self._send_prepared(url, bot.auth_args, payload['recipient']['id'], text)
+        else:
+            response = self.session.post(url, params=bot.auth_args, json=payload, timeout=self.config.http_timeout)
+        return response.json()
+
+    def _send_prepared(self, url, auth_args, recipient_id, text: PreparedMessage):
+        """Post a prepared message. The url, query and headers are prepared once and only the body is replaced."""
+        if self._message_request is None:
+            request = requests.Request('POST', url, params=auth_args, headers=self.JSON_HEADERS, data=b'')
+            settings = self.session.merge_environment_settings(url, {}, None, None, None)
+            self._message_request = (self.session.prepare_request(request), settings)
+
+        template, settings = self._message_request
+        prepared = template.copy()
+        prepared.prepare_body(text.payload(recipient_id), None)
+        return self.session.send(prepared, timeout=self.config.http_timeout, **settings)
+
@@ -0,0 +1,27 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    PreparedMessage: Message text serialized once into a Send API payload, for messages sent to many recipients
+"""
+import json
+
+_PREFIX = b'{"recipient":{"id":'
+
+
+class PreparedMessage(str):
+    """Text of a message that is about to be sent to many users, e.g. a new package broadcast.
+
+    It is a str, so it can be passed to Bot.send_text_message like any text. The json of the request body is made
+    once, when the message is created; PackageNotifier's sender recognises it and only splices the recipient into
+    the bytes for each user, instead of encoding the whole body again."""
+    def __new__(cls, text):
+        message = super(PreparedMessage, cls).__new__(cls, text)
+        message._suffix = b'},"message":' + json.dumps({'text': str(text)}, separators=(',', ':')).encode('utf-8') \
+            + b'}'
+        return message
+
+    def payload(self, recipient_id):
+        """Request body of the message to recipient_id, the same json send_text_message would post"""
+        if isinstance(recipient_id, str) and recipient_id.isdigit():
+            # PFIDs never need escaping
+            return b''.join((_PREFIX, b'"', recipient_id.encode('ascii'), b'"', self._suffix))
+        return b''.join((_PREFIX, json.dumps(recipient_id).encode('utf-8'), self._suffix))
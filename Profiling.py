@@ -0,0 +1,142 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Profiling: On demand sampling profiler with collapsed stack output, and call counts for database and http calls
+"""
+import collections
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+from Tracing import Span, tracer
+
+
+class CallCounter:
+    """Counts the spans finished while profiling, e.g. every PNBDatabase query and Messenger call, with their time"""
+    def __init__(self):
+        self.calls = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        key = '{}.{}'.format(span.kind, span.name)
+        with self._lock:
+            stats = self.calls.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += span.duration
+            stats[2] = max(stats[2], span.duration)
+
+    def report(self):
+        with self._lock:
+            return {key: {'calls': n, 'total_ms': round(total * 1000, 1), 'mean_ms': round(total / n * 1000, 2),
+                          'max_ms': round(slowest * 1000, 1)}
+                    for key, (n, total, slowest) in sorted(self.calls.items(), key=lambda item: -item[1][1])}
+
+
+class SamplingProfiler:
+    """Samples the stacks of running threads every interval seconds from a background thread.
+
+    A session either samples every thread for a number of seconds, or (with a request rate) only the threads
+    handling a random fraction of requests, until the session's duration runs out or it is stopped. Samples are
+    kept as collapsed stacks, the input format of flamegraph.pl and speedscope. While no session is running the
+    only cost to a request is checking a flag."""
+    def __init__(self, interval=0.005, tracer=tracer):
+        self.interval = interval
+        self.tracer = tracer
+        self.active = False
+        self.request_rate = None
+        self.started = None
+        self.deadline = None
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self.calls = CallCounter()
+        self._threads = set()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, duration=30, request_rate=None):
+        """Start a session of duration seconds. With request_rate (0 to 1) only that share of requests is sampled.
+        Returns False if a session is already running."""
+        with self._lock:
+            if self.active:
+                return False
+            self.stacks = collections.Counter()
+            self.calls = CallCounter()
+            self.samples = 0
+            self.request_rate = request_rate
+            self.started = time.time()
+            self.deadline = time.monotonic() + duration
+            self._threads = set()
+            self._stop.clear()
+            self.active = True
+            self.tracer.observer = self.calls.record
+            self._thread = threading.Thread(target=self._run, name='pnb-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @contextlib.contextmanager
+    def sample_request(self):
+        """Mark the current thread for sampling while it handles a request, if the request is picked"""
+        if not self.active or self.request_rate is None or random.random() >= self.request_rate:
+            yield
+            return
+
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads.add(ident)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads.discard(ident)
+
+    def status(self):
+        return {'active': self.active, 'pid': os.getpid(), 'started': self.started, 'samples': self.samples,
+                'request_rate': self.request_rate, 'interval_ms': self.interval * 1000,
+                'remaining': round(max(0, self.deadline - time.monotonic()), 1) if self.active else 0}
+
+    def collapsed(self):
+        """Samples as collapsed stacks: one 'outermost;...;innermost count' line per distinct stack"""
+        with self._lock:
+            return '\n'.join('{} {}'.format(stack, n) for stack, n in self.stacks.most_common())
+
+    def _run(self):
+        me = threading.get_ident()
+        try:
+            while not self._stop.is_set() and time.monotonic() < self.deadline:
+                with self._lock:
+                    targets = None if self.request_rate is None else set(self._threads)
+                frames = sys._current_frames()
+                stacks = [self._collapse(frame) for ident, frame in frames.items()
+                          if ident != me and (targets is None or ident in targets)]
+                with self._lock:
+                    for stack in stacks:
+                        self.stacks[stack] += 1
+                    self.samples += 1
+                self._stop.wait(self.interval)
+        finally:
+            with self._lock:
+                self.active = False
+                if self.tracer.observer == self.calls.record:
+                    self.tracer.observer = None
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(os.path.basename(code.co_filename).rsplit('.', 1)[0], code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+# Process wide profiler, controlled through app.py's /debug/profile routes
+profiler = SamplingProfiler()
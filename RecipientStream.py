@@ -0,0 +1,68 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    RecipientStream: Streams notification recipients from the database to the sender through a bounded queue
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+class RecipientStream:
+    """Iterates over the PFIDs in chunks produced by a generator such as PNBDatabase.iterPFIDs.
+
+    The chunks are fetched on a background thread while the caller sends messages, at most depth chunks ahead, so
+    memory stays flat however large the roster is and the first message goes out as soon as the first chunk arrives.
+    If the caller stops early the producer is told to stop and its generator is closed, which returns its database
+    connection to the pool."""
+    def __init__(self, chunks, depth=4):
+        self.chunks = chunks
+        self.depth = depth
+
+    def __iter__(self):
+        pending = queue.Queue(self.depth)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(pending, stop), name='pnb-recipients', daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                chunk = pending.get()
+                if chunk is _DONE:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                for pfid in chunk:
+                    yield pfid
+        finally:
+            stop.set()
+            # unblock the producer if it is waiting for room in the queue
+            while producer.is_alive():
+                try:
+                    pending.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def _produce(self, pending, stop):
+        chunks = iter(self.chunks)
+        try:
+            for chunk in chunks:
+                if not self._put(pending, stop, chunk):
+                    return
+            self._put(pending, stop, _DONE)
+        except Exception as e:
+            # raised again in the consuming thread
+            self._put(pending, stop, e)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    @staticmethod
+    def _put(pending, stop, item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
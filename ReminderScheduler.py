@@ -0,0 +1,175 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    ReminderScheduler: Reminds users, and eventually admins, about packages left uncollected
+"""
+import datetime
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from PNBDatabase import ChangeEvent, Package, PNBDatabase
+from Tracing import tracer
+
+
+class ReminderScheduler:
+    """Sends reminder number n about a package days[n] days after it was received, at hour o'clock.
+
+    Due reminders are kept in a heap, loaded from the database when the scheduler starts and kept current by the
+    owner calling add and remove, and by change events for packages added or claimed by other workers. The
+    scheduler thread sleeps until the earliest one is due, so a large backlog costs nothing between reminders.
+    remind_fn(stage, packages) is called with every package due for the same reminder at once; if it raises, those
+    reminders are tried again after retry_delay seconds."""
+    def __init__(self, db: PNBDatabase, days, remind_fn, hour=9, retry_delay=300, clock=time.time):
+        self.db = db
+        self.days = list(days)
+        self.remind_fn = remind_fn
+        self.hour = hour
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        # stage each package's entry in the heap is for. Entries that do not match are stale and skipped.
+        self._stages = None
+        self._stop = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._stages or {})
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name='pnb-reminders', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            thread = self._thread
+            self._stop = True
+            self._thread = None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def load(self, pending=None):
+        """Schedule every uncollected package. pending is a list of (package, reminders already sent) pairs, read
+        from the database if not given."""
+        if pending is None:
+            pending = self.db.getPendingReminders()
+        with self._cond:
+            self._heap = []
+            self._stages = {}
+            for package, stage in pending:
+                if not package.collected and stage < len(self.days):
+                    self._stages[package.id] = stage
+                    self._heap.append(self._entry(self.due_time(package.date_received, stage), package, stage))
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+
+    def add(self, package: Package, stage=0):
+        with self._cond:
+            if self._stages is None or package.id in self._stages or package.collected:
+                return
+            self._push(package, stage)
+
+    def remove(self, id):
+        with self._cond:
+            if self._stages is not None:
+                self._stages.pop(id, None)
+
+    def due_time(self, date_received, stage):
+        """Time reminder number stage about a package received on date_received is due"""
+        day = date_received + datetime.timedelta(days=self.days[stage])
+        return time.mktime(datetime.datetime(day.year, day.month, day.day, self.hour).timetuple())
+
+    def run_due(self):
+        """Send every reminder that is due now. Returns the number of packages reminded about."""
+        now = self.clock()
+        due = {}
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                when, seq, stage, package = heapq.heappop(self._heap)
+                if self._stages is not None and self._stages.get(package.id) == stage:
+                    # after downtime, or for old packages when reminders are turned on, only the latest is sent
+                    while stage + 1 < len(self.days) and self.due_time(package.date_received, stage + 1) <= now:
+                        stage += 1
+                    self._stages[package.id] = stage
+                    due.setdefault(stage, []).append(package)
+
+        sent = 0
+        for stage, packages in sorted(due.items()):
+            try:
+                with tracer.trace('reminders', stage=stage, packages=len(packages)):
+                    self.remind_fn(stage, packages)
+                sent += len(packages)
+            except Exception:
+                traceback.print_exc()
+                with self._cond:
+                    for package in packages:
+                        if self._stages is not None and self._stages.get(package.id) == stage:
+                            heapq.heappush(self._heap, self._entry(now + self.retry_delay, package, stage))
+                continue
+
+            with self._cond:
+                for package in packages:
+                    if self._stages is not None and self._stages.get(package.id) == stage:
+                        self._push(package, stage + 1)
+        return sent
+
+    def onChange(self, event: ChangeEvent):
+        if event.op == ChangeEvent.RESET:
+            # events may have been missed, so read everything again on the scheduler thread
+            with self._cond:
+                self._stages = None
+                self._cond.notify_all()
+        elif event.table == 'packages' and event.op == 'claim':
+            self.remove(event.key)
+        elif event.table == 'packages' and event.op == 'insert':
+            with self._cond:
+                known = self._stages is None or event.key in self._stages
+            if not known:
+                package = self.db.getPackage(event.key)
+                if package is not None:
+                    self.add(package)
+
+    def _push(self, package, stage):
+        """Schedule the package's next reminder, or forget it once every reminder has been sent"""
+        if stage >= len(self.days):
+            self._stages.pop(package.id, None)
+            return
+        self._stages[package.id] = stage
+        heapq.heappush(self._heap, self._entry(self.due_time(package.date_received, stage), package, stage))
+        self._cond.notify_all()
+
+    def _entry(self, when, package, stage):
+        # the sequence number keeps packages from ever being compared
+        return when, next(self._seq), stage, package
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                loaded = self._stages is not None
+            if not loaded:
+                try:
+                    self.load()
+                except Exception:
+                    traceback.print_exc()
+                    with self._cond:
+                        self._cond.wait(self.retry_delay)
+                    continue
+
+            self.run_due()
+            with self._cond:
+                if self._stop or self._stages is None:
+                    continue
+                wait = self._heap[0][0] - self.clock() if self._heap else self.retry_delay
+                # wake up regularly anyway in case the clock jumps
+                self._cond.wait(max(0, min(wait, 3600)))
@@ -0,0 +1,119 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Resilience: Circuit breakers that fail fast while Postgres, the Graph API or a mail server is down
+"""
+import contextlib
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold failures in a row. While open every call fails immediately with CircuitOpen.
+    After reset_timeout seconds one probe call is let through (half open): if it succeeds the breaker closes again,
+    if it fails the breaker stays open for another reset_timeout.
+
+    Only exceptions listed in failures count against the dependency. Anything else, e.g. a unique key violation,
+    means the dependency answered and counts as a success."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, failures=(Exception,), clock=time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Run the block if the breaker allows it, recording whether the dependency failed"""
+        self._before_call()
+        try:
+            yield
+        except self.failures:
+            self._on_failure()
+            raise
+        except:
+            self._on_success()
+            raise
+        self._on_success()
+
+    def call(self, fn, *args, **kwargs):
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    def is_open(self):
+        """True while calls are being refused, i.e. the breaker is open and not yet due for a probe"""
+        with self._lock:
+            return self.state == self.OPEN and self.clock() - self.opened_at < self.reset_timeout
+
+    def status(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.consecutive_failures}
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpen("{} is unavailable, not calling it for up to {}s".format(self.name, self.reset_timeout))
+
+    def _on_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print('Circuit breaker {} closed'.format(self.name))
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def _on_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state == self.CLOSED:
+                    print('Circuit breaker {} opened after {} failures'.format(self.name, self.consecutive_failures))
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+            self._probing = False
+
+
+class GuardedProxy:
+    """Wraps a client object so every call to one of its public methods goes through a circuit breaker"""
+    def __init__(self, target, breaker: CircuitBreaker):
+        self._target = target
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def guarded_call(*args, **kwargs):
+            return self._breaker.call(attr, *args, **kwargs)
+        return guarded_call
+
+
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Return the process wide breaker for a dependency, creating it with kwargs the first time"""
+    with _breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name, **kwargs)
+        return breakers[name]
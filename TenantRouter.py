@@ -0,0 +1,67 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TenantRouter: Runs a PackageNotifier for every building served by the process and routes events to them
+"""
+from PackageNotifier import PackageNotifier
+from PNBDatabase import PNBDatabase, ChangeListener, ReplicaSet
+
+
+class TenantRouter:
+    """Owns one PackageNotifier per tenant. All of them share a single database connection pool, and the read replica
+    pools if replica_configs are given.
+
+    In single tenant mode there is one PackageNotifier with no tenant or page id, and every event goes to it."""
+    def __init__(self, db_config: PNBDatabase.Config, configs, replica_configs=None):
+        self.db = PNBDatabase(db_config, replicas=ReplicaSet(replica_configs) if replica_configs else None)
+        self.listener = ChangeListener(db_config)
+        self.notifiers = {}
+        self.pages = {}
+
+        for config in configs:
+            if config.tenant in self.notifiers:
+                raise RuntimeError("Error, tenant {} is configured twice!".format(config.tenant))
+
+            notifier = PackageNotifier(config, self.db)
+            self.notifiers[config.tenant] = notifier
+            if config.page_id is not None:
+                self.pages[str(config.page_id)] = notifier
+
+    def __iter__(self):
+        return iter(self.notifiers.values())
+
+    def __len__(self):
+        return len(self.notifiers)
+
+    def for_page(self, page_id):
+        """Return the PackageNotifier for the Facebook page an event was sent to, or None if the page is unknown"""
+        notifier = self.pages.get(str(page_id))
+        if notifier is None:
+            return self.notifiers.get(None)
+        return notifier
+
+    def for_tenant(self, tenant):
+        """Return the PackageNotifier for a tenant, or None if the tenant is unknown"""
+        return self.notifiers.get(tenant)
+
+    def start(self):
+        """Start following writes made by other workers, and sending reminders. Until then nothing is cached."""
+        for notifier in self:
+            notifier.db.attachListener(self.listener)
+        self.listener.start()
+        for notifier in self:
+            notifier.start()
+
+    def queue_depth(self):
+        """Packages waiting to be sent by all tenants"""
+        return sum(notifier.queue_depth() for notifier in self)
+
+    def warm_up(self, connections=1):
+        """Connect to the database and fill every tenant's caches before the first request"""
+        for notifier in self:
+            notifier.db.warmUp(connections)
+
+    def close(self):
+        for notifier in self:
+            notifier.close()
+        self.listener.stop()
+        self.db.close()
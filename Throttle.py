@@ -0,0 +1,141 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Throttle: Per sender token buckets, optionally shared by every worker on a machine, and a negative cache
+"""
+import collections
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+class BucketStore():
+    """Token buckets keyed by sender"""
+    def take(self, key, rate, burst, now):
+        """Refill key's bucket at rate tokens a second up to burst, then take a token if there is one.
+        Returns True if a token was taken."""
+        raise NotImplementedError("This is an abstract class!")
+
+
+class MemoryBucketStore(BucketStore):
+    """Buckets of this process only. The least recently used are forgotten beyond max_keys, which is the same as
+    finding them full."""
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens, last = bucket if bucket is not None else (burst, now)
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class FileBucketStore(BucketStore):
+    """Buckets in a memory mapped file, so every worker on a machine draws from the same bucket for a sender.
+
+    Senders are hashed into a fixed number of slots, each locked with lockf while it is updated. A slot remembers
+    which sender it holds, and a sender that finds another in its slot starts over with a full bucket, so a
+    collision can only let a flooder through, never block a resident."""
+    SLOT = struct.Struct('<Qdd')
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # lockf locks belong to the process, so threads of one worker also need a lock of their own
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        fingerprint = int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'little') or 1
+        offset = (fingerprint % self.slots) * self.SLOT.size
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset, os.SEEK_SET)
+            try:
+                owner, tokens, last = self.SLOT.unpack_from(self._map, offset)
+                if owner != fingerprint:
+                    tokens, last = burst, now
+                tokens = min(burst, tokens + max(0, now - last) * rate)
+                allowed = tokens >= 1
+                self.SLOT.pack_into(self._map, offset, fingerprint, tokens - 1 if allowed else tokens, now)
+                return allowed
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset, os.SEEK_SET)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class SenderThrottle:
+    """Lets each sender send burst messages at once and then rate messages a second. Meant to be checked before
+    any other work is done for a message, so a flooding sender costs a dictionary lookup per message."""
+    def __init__(self, rate=0.5, burst=10, store: BucketStore = None, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.store = MemoryBucketStore() if store is None else store
+        self.clock = clock
+        self.allowed = 0
+        self.dropped = 0
+
+    def allow(self, sender):
+        if self.store.take(sender, self.rate, self.burst, self.clock()):
+            self.allowed += 1
+            return True
+        self.dropped += 1
+        return False
+
+    def status(self):
+        return {'allowed': self.allowed, 'dropped': self.dropped, 'rate': self.rate, 'burst': self.burst,
+                'shared': isinstance(self.store, FileBucketStore)}
+
+
+class NegativeCache:
+    """Keys known not to exist, e.g. senders who are not users, remembered for ttl seconds and at most max_size"""
+    def __init__(self, ttl=600, max_size=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._expires = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is None:
+                return False
+            if expires <= self.clock():
+                del self._expires[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._expires)
+
+    def add(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+            self._expires[key] = self.clock() + self.ttl
+            if len(self._expires) > self.max_size:
+                self._expires.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
@@ -0,0 +1,198 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    Tracing: Per request trace ids, timed spans for database and http calls, and a slow operation log
+"""
+import contextlib
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+import requests
+
+
+class Span:
+    """One timed operation. kind is 'request', 'db', 'http' or 'imap'."""
+    def __init__(self, trace_id, parent_id, kind, name, tags=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.tags = tags or {}
+        self.timestamp = time.time()
+        self.duration = None
+        self._start = time.perf_counter()
+
+    def __str__(self):
+        return '(Span %s %s, %.1fms, trace %s)' % (self.kind, self.name, (self.duration or 0) * 1000, self.trace_id)
+
+    def __repr__(self):
+        return str(self)
+
+    def elapsed(self):
+        """Seconds since the span started"""
+        return time.perf_counter() - self._start
+
+    def finish(self):
+        self.duration = self.elapsed()
+
+    def to_zipkin(self, service):
+        """Span in Zipkin v2 json format"""
+        span = {'traceId': self.trace_id, 'id': self.span_id, 'name': '{}.{}'.format(self.kind, self.name),
+                'timestamp': int(self.timestamp * 1e6), 'duration': int(self.duration * 1e6),
+                'localEndpoint': {'serviceName': service}, 'tags': {k: str(v) for k, v in self.tags.items()}}
+        if self.parent_id is not None:
+            span['parentId'] = self.parent_id
+        if self.kind == 'request':
+            span['kind'] = 'SERVER'
+        elif self.kind in ('db', 'http', 'imap'):
+            span['kind'] = 'CLIENT'
+        return span
+
+
+class ZipkinExporter:
+    """Sends finished traces to a Zipkin compatible collector (or appends them to a file) from a background thread,
+    so exporting never slows down a request. Traces are dropped if the queue is full."""
+    def __init__(self, url=None, path=None, service='package-notifier', max_queue=1000):
+        self.url = url
+        self.path = path
+        self.service = service
+        self.queue = queue.Queue(max_queue)
+        self._thread = None
+
+    def export(self, spans):
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            return
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='pnb-trace-exporter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            while not self.queue.empty() and len(batch) < 500:
+                batch = batch + self.queue.get_nowait()
+
+            payload = [span.to_zipkin(self.service) for span in batch]
+            try:
+                if self.url is not None:
+                    requests.post(self.url, json=payload, timeout=5)
+                if self.path is not None:
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(payload) + '\n')
+            except:
+                traceback.print_exc()
+
+
+class Tracer:
+    """Keeps the current trace in a thread local, so every span started while handling a request is tagged with the
+    request's trace id without passing it through every call.
+
+    thresholds maps a span kind to the duration in seconds above which the span is written to the slow operation log.
+    When a whole request is slow, the log line includes a breakdown of its spans. If an observer is set it is called
+    with every finished span, e.g. by the profiler to count calls."""
+    DEFAULT_THRESHOLDS = {'request': 1.0, 'db': 0.1, 'http': 0.5, 'imap': 2.0}
+
+    def __init__(self, thresholds=None, exporter: ZipkinExporter = None, log=print):
+        self.thresholds = dict(self.DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.exporter = exporter
+        self.log = log
+        self.observer = None
+        self._local = threading.local()
+
+    def configure(self, thresholds=None, exporter: ZipkinExporter = None):
+        self.thresholds.update(thresholds or {})
+        self.exporter = exporter
+
+    def current_trace_id(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[0].trace_id if stack else None
+
+    @contextlib.contextmanager
+    def trace(self, name, trace_id=None, **tags):
+        """Start a new trace for a request or background job. Yields the trace id."""
+        if getattr(self._local, 'stack', None):
+            # already inside a trace, e.g. an in process call from another request
+            with self.span('request', name, **tags) as span:
+                yield span.trace_id
+            return
+
+        root = Span(trace_id or uuid.uuid4().hex, None, 'request', name, tags)
+        self._local.stack = [root]
+        self._local.spans = [root]
+        try:
+            yield root.trace_id
+        finally:
+            root.finish()
+            spans = self._local.spans
+            self._local.stack = []
+            self._local.spans = []
+
+            observer = self.observer
+            if observer is not None:
+                observer(root)
+
+            if root.duration >= self.thresholds.get('request', float('inf')):
+                self._log_slow(root, breakdown=spans[1:])
+            if self.exporter is not None:
+                self.exporter.export(spans)
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **tags):
+        """Time an operation. Recorded on the current trace if there is one and logged if it is slow."""
+        stack = getattr(self._local, 'stack', None)
+        parent = stack[-1] if stack else None
+        span = Span(parent.trace_id if parent else None, parent.span_id if parent else None, kind, name, tags)
+        if parent is not None:
+            stack.append(span)
+            self._local.spans.append(span)
+        try:
+            yield span
+        finally:
+            span.finish()
+            if parent is not None:
+                stack.pop()
+            observer = self.observer
+            if observer is not None:
+                observer(span)
+            if kind != 'request' and span.duration >= self.thresholds.get(kind, float('inf')):
+                self._log_slow(span)
+
+    def _log_slow(self, span: Span, breakdown=None):
+        entry = {'slow_op': span.name, 'kind': span.kind, 'duration_ms': round(span.duration * 1000, 1),
+                 'trace_id': span.trace_id}
+        entry.update(span.tags)
+        if breakdown is not None:
+            entry['spans'] = [[s.kind, s.name, round(s.duration * 1000, 1)] for s in breakdown]
+        self.log(json.dumps(entry, default=str))
+
+
+class TracedProxy:
+    """Wraps a client object so every call to one of its public methods is recorded as a span"""
+    def __init__(self, target, kind, prefix, tracer: Tracer = None):
+        self._target = target
+        self._kind = kind
+        self._prefix = prefix
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def traced_call(*args, **kwargs):
+            with (self._tracer or tracer).span(self._kind, self._prefix + name):
+                return attr(*args, **kwargs)
+        return traced_call
+
+
+# Process wide tracer, configured by app.py
+tracer = Tracer()
@@ -0,0 +1,75 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TrafficRecorder: Captures incoming webhook and /email requests to a compact file for replaying in load tests
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+
+class TrafficRecorder:
+    """Appends one gzipped json line per request: seconds since recording started, the route and the body.
+
+    PFIDs are replaced with stable pseudonyms (the same PFID always maps to the same fake id within a recording, so
+    conversations still make sense on replay) and messages that are exactly one of the secrets, e.g. the passphrases,
+    are replaced with a placeholder naming the secret."""
+    def __init__(self, path, secrets=None, salt=None):
+        """secrets maps placeholder names to secret values, e.g. {'USER_PASSPHRASE': 'hunter2'}"""
+        self.path = path
+        self.secrets = {value: '<{}>'.format(name) for name, value in (secrets or {}).items() if value}
+        self.salt = salt if salt is not None else os.urandom(16)
+        self.start = time.time()
+        self._file = gzip.open(path, 'at')
+        self._lock = threading.Lock()
+
+    def record(self, route, body):
+        line = json.dumps({'t': round(time.time() - self.start, 3), 'route': route, 'body': self.anonymize(body)},
+                          separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def pseudonym(self, pfid):
+        digest = hmac.new(self.salt, str(pfid).encode(), hashlib.sha256).hexdigest()
+        return str(int(digest[:13], 16)).zfill(16)
+
+    def anonymize(self, body):
+        """Return a copy of a request body with PFIDs and secrets replaced. Raw emails are dropped, since they carry
+        the residents' addresses and the parsed title and body are all a replay needs."""
+        if isinstance(body, dict) and 'raw' in body:
+            return {key: value for key, value in body.items() if key != 'raw'}
+        if not isinstance(body, dict) or 'entry' not in body:
+            return body
+
+        entries = []
+        for event in body['entry']:
+            event = dict(event)
+            messages = []
+            for message in event.get('messaging', []):
+                message = dict(message)
+                # recipient is the page id, which is needed to route the replayed message
+                if 'sender' in message:
+                    message['sender'] = {'id': self.pseudonym(message['sender']['id'])}
+                if 'message' in message and message['message'].get('text') in self.secrets:
+                    message['message'] = dict(message['message'], text=self.secrets[message['message']['text']])
+                messages.append(message)
+            event['messaging'] = messages
+            entries.append(event)
+
+        return dict(body, entry=entries)
+
+    @staticmethod
+    def load(path):
+        """Yield (seconds since start, route, body) for every request in a recording"""
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    yield data['t'], data['route'], data['body']
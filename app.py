@@ -1,34 +1,85 @@
 #Python libraries that we need to import for our bot
+import atexit
+import functools
+import hmac
 import json
 import traceback
 
-from flask import Flask, request
+from flask import Blueprint, Flask, abort, current_app, jsonify, request
 import os
 import threading
 
+from Admission import AdmissionGate, Overloaded
+from EmailArchive import EmailArchive, decode_raw
+from EmailPoller import EmailPoller, AdvisoryLock, FileLock
+from Health import DEPENDENCY_ERRORS, HealthCheck
 from PackageNotifier import PackageNotifier
 from PNBDatabase import PNBDatabase
+from Profiling import profiler
+from Throttle import FileBucketStore, SenderThrottle
+from TenantRouter import TenantRouter
+from TrafficRecorder import TrafficRecorder
+from Tracing import Tracer, ZipkinExporter, tracer
 
-from check_email import poll_emails_periodically
+from check_email import LocalSink, load_mailboxes
 
 DEV_MODE = False
 
 
+def int_list(value):
+    """Read a list of ints given as a json list or a comma separated string, e.g. REMINDER_DAYS=2,5,10"""
+    if isinstance(value, str):
+        value = [item for item in value.split(',') if item.strip()]
+    return [int(item) for item in value]
+
+
 class AppConfig():
-    def __init__(self, auth_token, verify_token, db_config: PNBDatabase.Config, user_passphrase, admin_passphrase):
+    # Optional PackageNotifier.Config settings, read from variables with these names. Every tenant uses the app wide
+    # value unless its entry in the tenants file has its own.
+    NOTIFIER_OPTIONS = {
+        'COALESCE_WINDOW': ('coalesce_window', float),
+        'GRAPH_API_URL': ('graph_url', str),
+        'HTTP_TIMEOUT': ('http_timeout', float),
+        'REMINDER_DAYS': ('reminder_days', int_list),
+        'REMINDER_HOUR': ('reminder_hour', int),
+    }
+
+    def __init__(self, auth_token, verify_token, db_config: PNBDatabase.Config, user_passphrase, admin_passphrase,
+                 tenants=None, notifier_options=None, replica_configs=None):
+        self.replica_configs = replica_configs or []
+        self.notifier_options = notifier_options or {}
         self.admin_passphrase = admin_passphrase
         self.user_passphrase = user_passphrase
         self.db_config = db_config
         self.verify_token = verify_token
         self.auth_token = auth_token
+        self.tenants = tenants
 
     def to_pn_config(self):
-        return PackageNotifier.Config(self.auth_token, self.db_config, self.user_passphrase, self.admin_passphrase)
+        return PackageNotifier.Config(self.auth_token, self.db_config, self.user_passphrase, self.admin_passphrase,
+                                      **self.notifier_options)
+
+    def to_pn_configs(self):
+        """Return a PackageNotifier.Config for every building this process serves"""
+        if self.tenants:
+            return self.tenants
+        return [self.to_pn_config()]
+
+    def secrets(self):
+        """Passphrases of every tenant, named for TrafficRecorder"""
+        secrets = {}
+        for pn_config in self.to_pn_configs():
+            suffix = '' if pn_config.tenant is None else ':' + pn_config.tenant
+            secrets['USER_PASSPHRASE' + suffix] = pn_config.user_passphrase
+            secrets['ADMIN_PASSPHRASE' + suffix] = pn_config.admin_passphrase
+        return secrets
 
     @classmethod
     def from_env_variables(cls):
-        for var in ['AUTH_TOKEN', 'USER_PASSPHRASE', 'ADMIN_PASSPHRASE',
-                    'EMAIL_HOST', 'EMAIL_USER', 'EMAIL_PASSWORD']:
+        required = ['TENANTS_FILE'] if 'TENANTS_FILE' in os.environ else ['AUTH_TOKEN', 'USER_PASSPHRASE',
+                                                                         'ADMIN_PASSPHRASE', 'EMAIL_HOST',
+                                                                         'EMAIL_USER', 'EMAIL_PASSWORD']
+        for var in required:
             if var not in os.environ:
                 raise RuntimeError("Error, environment variable {} not set!".format(var))
 
@@ -40,28 +91,339 @@ class AppConfig():
         else:
             raise RuntimeError('ERROR! No database variables are set!')
 
+        # read replicas are optional, given as a comma separated list of database urls
+        replica_configs = [PNBDatabase.URLConfig(url.strip())
+                           for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+        options = cls.read_notifier_options(os.environ)
+        tenants = None
+        if 'TENANTS_FILE' in os.environ:
+            tenants = cls.tenants_from_file(os.environ.get('TENANTS_FILE'), db_config, options)
+
         return AppConfig(os.environ.get('AUTH_TOKEN'), os.environ.get('VERIFY_TOKEN'), db_config,
-                         os.environ.get('USER_PASSPHRASE'), os.environ.get('ADMIN_PASSPHRASE'))
+                         os.environ.get('USER_PASSPHRASE'), os.environ.get('ADMIN_PASSPHRASE'), tenants, options,
+                         replica_configs)
 
     @classmethod
     def from_file(cls, file):
         data = json.load(open(file))
         db_config = PNBDatabase.CredentialsConfig(data['DB_NAME'], data['DB_USER'], data['DB_PASSWORD'])
-        return AppConfig(data['AUTH_TOKEN'], data['VERIFY_TOKEN'], db_config, data['USER_PASSPHRASE'],
-                         data['ADMIN_PASSPHRASE'])
+        replica_configs = [PNBDatabase.URLConfig(url) for url in data.get('DATABASE_REPLICA_URLS', [])]
+        options = cls.read_notifier_options(data)
+        tenants = cls.tenants_from_file(data['TENANTS_FILE'], db_config, options) if 'TENANTS_FILE' in data else None
+        return AppConfig(data.get('AUTH_TOKEN'), data['VERIFY_TOKEN'], db_config, data.get('USER_PASSPHRASE'),
+                         data.get('ADMIN_PASSPHRASE'), tenants, options, replica_configs)
+
+    @classmethod
+    def read_notifier_options(cls, source, defaults=None):
+        options = dict(defaults or {})
+        for var, (option, convert) in cls.NOTIFIER_OPTIONS.items():
+            if var in source:
+                options[option] = convert(source[var])
+        return options
+
+    @classmethod
+    def tenants_from_file(cls, file, db_config: PNBDatabase.Config, options=None):
+        """Load the buildings served by this process. The file holds a list of objects with TENANT, PAGE_ID,
+        AUTH_TOKEN, USER_PASSPHRASE and ADMIN_PASSPHRASE keys (and the tenant's EMAIL_* keys for check_email).
+        Any of the NOTIFIER_OPTIONS may also be set per tenant."""
+        data = json.load(open(file))
+        return [PackageNotifier.Config(t['AUTH_TOKEN'], db_config, t['USER_PASSPHRASE'], t['ADMIN_PASSPHRASE'],
+                                       tenant=t['TENANT'], page_id=t['PAGE_ID'],
+                                       **cls.read_notifier_options(t, options))
+                for t in data]
+
+
+class Services():
+    """The parts of the app that hold connections or threads. Nothing is created until it is first needed, and
+    everything is recreated after a fork, so it is safe to create the app before gunicorn forks its workers."""
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self._tenants = None
+        self._poller = None
+        self._recorder = None
+        self._archive = None
+        self._throttle = None
+        self._started = False
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self.health = HealthCheck()
+        self.gate = make_gate()
+
+    @property
+    def tenants(self):
+        with self._lock:
+            self._check_fork()
+            if self._tenants is None:
+                self._tenants = TenantRouter(self.config.db_config, self.config.to_pn_configs(),
+                                             self.config.replica_configs)
+            return self._tenants
+
+    @property
+    def poller(self):
+        with self._lock:
+            self._check_fork()
+            if self._poller is None:
+                # Every worker runs a poller but only the one holding the lock reads the inboxes
+                lock = FileLock(os.environ['POLLER_LOCK_FILE']) if 'POLLER_LOCK_FILE' in os.environ else \
+                    AdvisoryLock(self.config.db_config)
+                self._poller = EmailPoller(load_mailboxes(self.email_sink()), lock,
+                                           int(os.environ.get('POLL_PERIOD', 20)))
+            return self._poller
+
+    def email_sink(self):
+        """Where this process's poller delivers emails: straight to deliver_email, or with EMAIL_SINK=http posted to
+        APP_URL like a separate check_email process would"""
+        if os.environ.get('EMAIL_SINK') == 'http':
+            return None
+        return LocalSink(lambda payload: deliver_email(self, payload))
+
+    @property
+    def recorder(self):
+        """TrafficRecorder writing to RECORD_TRAFFIC.<pid>, or None if traffic is not being recorded"""
+        with self._lock:
+            self._check_fork()
+            if self._recorder is None and 'RECORD_TRAFFIC' in os.environ:
+                path = '{}.{}'.format(os.environ['RECORD_TRAFFIC'], os.getpid())
+                self._recorder = TrafficRecorder(path, self.config.secrets())
+            return self._recorder
+
+    @property
+    def archive(self):
+        """EmailArchive in ARCHIVE_DIR, or None if emails are not being archived"""
+        with self._lock:
+            self._check_fork()
+            if self._archive is None and 'ARCHIVE_DIR' in os.environ:
+                self._archive = EmailArchive(os.environ['ARCHIVE_DIR'])
+            return self._archive
+
+    @property
+    def throttle(self):
+        """SenderThrottle allowing each sender THROTTLE_BURST messages at once and THROTTLE_RATE a second after
+        that. With THROTTLE_FILE set every worker on the machine shares the same buckets."""
+        with self._lock:
+            self._check_fork()
+            if self._throttle is None:
+                store = FileBucketStore(os.environ['THROTTLE_FILE']) if 'THROTTLE_FILE' in os.environ else None
+                self._throttle = SenderThrottle(float(os.environ.get('THROTTLE_RATE', 0.5)),
+                                                int(os.environ.get('THROTTLE_BURST', 10)), store)
+            return self._throttle
+
+    def start(self):
+        """Start the background threads. Threads do not survive a fork, so call this in each worker."""
+        with self._lock:
+            self._check_fork()
+            if self._started:
+                return
+            self.tenants.start()
+            self.poller.start()
+            self._started = True
+
+    def warm_up(self):
+        """Connect and fill caches now instead of during the first request"""
+        self.tenants.warm_up()
+
+    def stop(self):
+        with self._lock:
+            if self._poller is not None:
+                self._poller.stop(5)
+            if self._tenants is not None:
+                self._tenants.close()
+            if self._recorder is not None:
+                self._recorder.close()
+            if self._archive is not None:
+                self._archive.close()
+            self._poller = None
+            self._tenants = None
+            self._recorder = None
+            self._archive = None
+            self._started = False
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # objects from the parent hold its sockets and dead threads; drop them without closing anything
+            self._tenants = None
+            self._poller = None
+            self._recorder = None
+            self._archive = None
+            self._throttle = None
+            self._started = False
+            self._pid = os.getpid()
+            self.health = HealthCheck()
+            self.gate = make_gate()
+
+
+def make_gate():
+    """AdmissionGate sized by ADMISSION_CAPACITY, WEBHOOK_CONCURRENCY, EMAIL_CONCURRENCY, ADMISSION_QUEUE and
+    ADMISSION_WAIT (seconds). Capacity is how many requests run at once, about the size of the connection pool.
+    Queued requests wait on a thread of their own, so see worker_threads for how many threads that takes."""
+    return AdmissionGate(admission_capacity(),
+                         {'/': int(os.environ.get('WEBHOOK_CONCURRENCY', 3)),
+                          '/email': int(os.environ.get('EMAIL_CONCURRENCY', 2))},
+                         admission_queue(), float(os.environ.get('ADMISSION_WAIT', 2)))
+
+
+def admission_capacity():
+    return int(os.environ.get('ADMISSION_CAPACITY', 4))
+
+
+def admission_queue():
+    return int(os.environ.get('ADMISSION_QUEUE', 16))
+
+
+def worker_threads():
+    """WEB_THREADS, or by default enough threads for the gate to run ADMISSION_CAPACITY requests and queue
+    ADMISSION_QUEUE more. With fewer, requests past the thread count wait in gunicorn's backlog instead, where they
+    are never prioritized or shed with a 429."""
+    return int(os.environ.get('WEB_THREADS', admission_capacity() + admission_queue()))
+
+
+bp = Blueprint('pnb', __name__)
+
+
+def services() -> Services:
+    return current_app.extensions['pnb']
+
 
+def create_app(config: AppConfig = None):
+    """Application factory. Only reads the config; connections and threads are made by Services when needed."""
+    if config is None:
+        config = AppConfig.from_file('passwords.json') if DEV_MODE else AppConfig.from_env_variables()
 
-if DEV_MODE:
-    config = AppConfig.from_file('passwords.json')
-else:   # PROD MODE
-    config = AppConfig.from_env_variables()
+    configure_tracing()
+    app = Flask(__name__)
+    app.extensions['pnb'] = Services(config)
+    app.register_blueprint(bp)
+    atexit.register(app.extensions['pnb'].stop)
+    return app
 
-app = Flask(__name__)
-packageNotifier = PackageNotifier(config.to_pn_config())
+
+def configure_tracing():
+    """Slow operation thresholds come from SLOW_<KIND>_MS variables. Traces are exported in Zipkin format if
+    TRACE_EXPORT_URL or TRACE_EXPORT_FILE is set."""
+    thresholds = {}
+    for kind in Tracer.DEFAULT_THRESHOLDS:
+        var = 'SLOW_{}_MS'.format(kind.upper())
+        if var in os.environ:
+            thresholds[kind] = float(os.environ[var]) / 1000
+
+    exporter = None
+    if 'TRACE_EXPORT_URL' in os.environ or 'TRACE_EXPORT_FILE' in os.environ:
+        exporter = ZipkinExporter(os.environ.get('TRACE_EXPORT_URL'), os.environ.get('TRACE_EXPORT_FILE'))
+
+    tracer.configure(thresholds, exporter)
+
+
+def traced(view):
+    """Run a view inside a new trace, continuing the caller's trace if it sent an X-Trace-Id header"""
+    @functools.wraps(view)
+    def traced_view(*args, **kwargs):
+        with tracer.trace(view.__name__, trace_id=request.headers.get('X-Trace-Id')) as trace_id, \
+                profiler.sample_request():
+            response = current_app.make_response(view(*args, **kwargs))
+        response.headers['X-Trace-Id'] = trace_id
+        return response
+    return traced_view
+
+
+def admitted(route, priority=None):
+    """Only run a POST to a view once the admission gate lets it in, and shed it with a 429 or 503 and a Retry-After
+    header if it does not. priority() returns the request's AdmissionGate priority; without it requests are NORMAL."""
+    def decorator(view):
+        @functools.wraps(view)
+        def admitted_view(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+
+            gate = services().gate
+            try:
+                started = gate.admit(route, gate.NORMAL if priority is None else priority())
+            except Overloaded as e:
+                print('Shedding {} request: {}'.format(route, e.reason))
+                return 'Over capacity, retry later', e.status, {'Retry-After': str(e.retry_after)}
+
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.release(route, started)
+        return admitted_view
+    return decorator
+
+
+def webhook_priority():
+    """Messages from admins go ahead of other users. Only users already cached are looked at, so deciding costs
+    nothing; an admin who is not cached yet waits like everyone else."""
+    output = request.get_json(silent=True) or {}
+    for event in output.get('entry', []):
+        notifier = services().tenants.for_page(event.get('id'))
+        for message in event.get('messaging', []):
+            user = notifier.db.getCachedUser(message.get('sender', {}).get('id')) if notifier else None
+            if user is not None and user.isAdmin():
+                return AdmissionGate.HIGH
+    return AdmissionGate.NORMAL
+
+
+@bp.before_app_request
+def start_services():
+    # no-op once gunicorn_config.py's post_worker_init has started the worker. Liveness must not depend on the
+    # database, so /healthz does not start anything. Neither do the profiling routes, which must work on a stuck worker.
+    if request.endpoint not in ('pnb.healthz', 'pnb.profile', 'pnb.profile_calls'):
+        services().start()
+
+
+@bp.route("/healthz")
+def healthz():
+    """Liveness: the worker is up and answering requests"""
+    return jsonify(services().health.liveness())
+
+
+@bp.route("/readyz")
+def readyz():
+    """Readiness: 503 while the worker cannot do its job, so the load balancer sends traffic elsewhere"""
+    ready, report = services().health.readiness(services().tenants, services().poller, services().gate)
+    return jsonify(report), 200 if ready else 503
+
+
+def profiling_admin(view):
+    """Profiling is off unless PROFILING_TOKEN is set, and then only for requests with that bearer token"""
+    @functools.wraps(view)
+    def admin_view(*args, **kwargs):
+        token = os.environ.get('PROFILING_TOKEN')
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+            abort(403)
+        return view(*args, **kwargs)
+    return admin_view
+
+
+@bp.route("/debug/profile", methods=['GET', 'POST', 'DELETE'])
+@profiling_admin
+def profile():
+    """POST ?seconds=30 samples every thread of this worker, POST ?seconds=300&rate=0.1 samples a tenth of its
+    requests. GET returns collapsed stacks for flamegraph.pl or speedscope, DELETE stops the session early."""
+    if request.method == 'POST':
+        rate = request.args.get('rate', type=float)
+        if not profiler.start(request.args.get('seconds', 30, type=float), rate):
+            return jsonify(profiler.status()), 409
+        return jsonify(profiler.status())
+    if request.method == 'DELETE':
+        profiler.stop()
+        return jsonify(profiler.status())
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8', 'X-Profiler-Pid': str(os.getpid())}
+
+
+@bp.route("/debug/profile/calls")
+@profiling_admin
+def profile_calls():
+    """Number and duration of database, Graph API and IMAP calls made during the last profiling session"""
+    return jsonify(dict(profiler.status(), calls=profiler.calls.report()))
 
 
 # We will receive messages that Facebook sends our bot at this endpoint
-@app.route("/", methods=['GET', 'POST'])
+@bp.route("/", methods=['GET', 'POST'])
+@traced
+@admitted('/', webhook_priority)
 def receive_message():
     if request.method == 'GET':
         """Before allowing people to message your bot, Facebook has implemented a verify token
@@ -72,15 +434,33 @@ def receive_message():
     else:
         # get whatever message a user sent the bot
         output = request.get_json()
+        if services().recorder is not None:
+            services().recorder.record(request.path, output)
+
         for event in output['entry']:
+            # entry id is the id of the page the message was sent to, which tells us the building
+            packageNotifier = services().tenants.for_page(event.get('id'))
+            if packageNotifier is None:
+                print('Message for unknown page {}'.format(event.get('id')))
+                continue
+
             messaging = event['messaging']
             for message in messaging:
+                # flooding senders are dropped before they cost a log line, a query or a reply. Only messages are
+                # charged; deliveries, reads and postbacks must not use up a resident's bucket.
+                if message.get('message') and not services().throttle.allow(message.get('sender', {}).get('id')):
+                    continue
                 print(message)
                 if message.get('message'):
                     try:
                         packageNotifier.handle_message(message)
+                        services().health.requests.record()
+                    except DEPENDENCY_ERRORS:
+                        traceback.print_exc()
+                        services().health.requests.record(error=True)
                     except:
                         traceback.print_exc()
+                        services().health.requests.record()
 
     return "Message Processed"
 
@@ -90,28 +470,79 @@ class Email():
         self.title = title
 
 
-@app.route("/email", methods=['POST'])
+@bp.route("/email", methods=['POST'])
+@traced
+@admitted('/email', lambda: AdmissionGate.HIGH)
 def receive_email():
     output = request.get_json()
+    # check_email's HttpSink posts several emails at once as a list
+    emails = output if isinstance(output, list) else [output]
+    failed = []
+    for i, email in enumerate(emails):
+        try:
+            deliver_email(services(), email)
+        except:
+            traceback.print_exc()
+            failed.append(i)
+
+    if failed:
+        # HttpSink only has the emails at these indexes read again, so the others are not handled twice
+        return jsonify({'error': '{} of {} emails failed'.format(len(failed), len(emails)), 'failed': failed}), 500
+    return "Message Processed"
+
+
+def deliver_email(pnb: Services, output):
+    """Handle one email object, whether posted to /email or handed over by a poller in this process"""
+    if pnb.recorder is not None:
+        pnb.recorder.record('/email', output)
+
     if 'title' not in output or 'body' not in output:
         print('Bad email object {}'.format(output))
-        return "Message Processed"
+        return
 
-    packageNotifier.handle_email(Email(output['title'], output['body']))
+    packageNotifier = pnb.tenants.for_tenant(output.get('tenant'))
+    if packageNotifier is None:
+        print('Email for unknown tenant {}'.format(output.get('tenant')))
+        return
 
-    return "Message Processed"
+    packages = []
+    try:
+        packages = packageNotifier.handle_email(Email(output['title'], output['body']))
+    except DEPENDENCY_ERRORS:
+        pnb.health.requests.record(error=True)
+        raise
+    except:
+        pnb.health.requests.record()
+        raise
+    finally:
+        archive_email(pnb, output, packages)
+    pnb.health.requests.record()
+
+
+def archive_email(pnb: Services, output, packages):
+    """Keep the email, and which packages were found in it, so it can be audited or parsed again later"""
+    archive = pnb.archive
+    if archive is None:
+        return
+    try:
+        if 'raw' in output:
+            raw, is_raw = decode_raw(output['raw']), True
+        else:
+            # sent by an older check_email, which only forwards the body
+            raw, is_raw = output['body'].encode('utf-8'), False
+        archive.append(raw, output.get('message_id'), output.get('date'), output.get('tenant'), output['title'],
+                       [package.id for package in packages], is_raw)
+    except:
+        traceback.print_exc()
 
 
 def verify_fb_token(token_sent):
     # take token sent by facebook and verify it matches the verify token you sent
     # if they match, allow the request, else return an error
-    if token_sent == config.verify_token:
+    if token_sent == services().config.verify_token:
         return request.args.get("hub.challenge")
     return 'Invalid verification token'
 
 
 if __name__ == "__main__":
-    imap_thread = threading.Thread(target=poll_emails_periodically, args=[20])
-    imap_thread.start()
-
-    app.run()
+    create_app().run()
@@ -0,0 +1,125 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    bench_broadcast: measure the per recipient cost of sending a broadcast through pymessenger and as a PreparedMessage
+    usage: python benchmark/bench_broadcast.py [recipients] [--http]
+
+    Without --http nothing is sent: each path only builds the requests.PreparedRequest it would send. With --http
+    both paths also post to a local server, pymessenger with requests.post and a new connection per message, the
+    prepared path over one keep-alive session like PackageNotifier.
+"""
+import datetime
+import http.server
+import os
+import socketserver
+import sys
+import threading
+import time
+
+import requests
+from pymessenger.bot import Bot
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PNBDatabase import Package
+from PackageNotifier import PackageNotifier
+from PreparedMessage import PreparedMessage
+
+GRAPH_URL = 'https://graph.facebook.com/v2.6/me/messages'
+AUTH_ARGS = {'access_token': 'x' * 180}
+
+
+def digest(count):
+    """A digest of count packages, rendered the way PackageNotifier.new_packages_message does"""
+    packages = [Package(i, 100000 + i, datetime.date.today(), False) for i in range(count)]
+    lines = '\n'.join([PackageNotifier.DIGEST_LINE_TEXT.format(p.id, p.code) for p in packages])
+    return PackageNotifier.NEW_PACKAGES_DIGEST_TEXT.format(len(packages), lines)
+
+
+def legacy_sender(url, send):
+    """pymessenger's path: send_text_message builds the payload dict, requests encodes it"""
+    bot = Bot('x' * 180)
+    bot.send_raw = lambda payload: send(requests.Request('POST', url, params=AUTH_ARGS, json=payload))
+
+    def send_text(pfid, text):
+        bot.send_text_message(pfid, text)
+    return send_text
+
+
+def prepared_sender(url, send):
+    """PackageNotifier's path for a PreparedMessage: the request is prepared once, and its body is spliced from
+    pre-serialized bytes for each recipient"""
+    template = requests.Request('POST', url, params=AUTH_ARGS, headers=PackageNotifier.JSON_HEADERS,
+                                data=b'').prepare()
+
+    def send_text(pfid, text):
+        prepared = template.copy()
+        prepared.prepare_body(text.payload(pfid), None)
+        send(prepared)
+    return send_text
+
+
+def post_once(request):
+    """What requests.post does: a new session, and so a new connection, for every request"""
+    with requests.Session() as session:
+        return session.send(session.prepare_request(request))
+
+
+def run(send_text, text, pfids):
+    start = time.perf_counter()
+    for pfid in pfids:
+        send_text(pfid, text)
+    return (time.perf_counter() - start) / len(pfids)
+
+
+class GraphServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class GraphStandIn(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would stall every keep-alive response on a delayed ack
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+def main(recipients, post):
+    pfids = [str(1000000000000000 + i) for i in range(recipients)]
+    print('{} recipients{}'.format(recipients, ', posting to a local server' if post else ''))
+
+    if post:
+        server = GraphServer(('127.0.0.1', 0), GraphStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/me/messages'.format(server.server_port)
+        session = requests.Session()
+        senders = [('pymessenger', legacy_sender(url, post_once)),
+                   ('prepared', prepared_sender(url, session.send))]
+    else:
+        senders = [('pymessenger', legacy_sender(GRAPH_URL, lambda r: r.prepare())),
+                   ('prepared', prepared_sender(GRAPH_URL, lambda r: r))]
+
+    for count in [1, 10, 50]:
+        text = digest(count)
+        results = []
+        for name, send_text in senders:
+            message = PreparedMessage(text) if name == 'prepared' else text
+            results.append((name, run(send_text, message, pfids)))
+        line = '  '.join('{} {:>7.1f} us'.format(name, seconds * 1e6) for name, seconds in results)
+        print('{:>2} packages, {:>5} byte message: {}  ({:.1f}x)'.format(count, len(text), line,
+                                                                         results[0][1] / results[1][1]))
+    if post:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--http']
+    main(int(args[0]) if args else 5000, '--http' in sys.argv[1:])
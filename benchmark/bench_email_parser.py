@@ -0,0 +1,69 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    bench_email_parser: measure accuracy and throughput of EmailParser against the original single regex
+    usage: python benchmark/bench_email_parser.py [iterations]
+"""
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from EmailParser import EmailParser
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email_corpus.json')
+
+LEGACY_RE = re.compile('([pP]ickup [cC]ode)\\s*([0-9]+)')
+
+
+def legacy_parse(body):
+    """The parser handle_email used before EmailParser: one code per email, searched over the raw body"""
+    match = LEGACY_RE.search(body)
+    return [int(match.group(2))] if match else []
+
+
+def parser_parse(parser):
+    def parse(body):
+        return [p.code for p in parser.parse(body)]
+    return parse
+
+
+def accuracy(parse, corpus):
+    correct = 0
+    misses = []
+    for sample in corpus:
+        if parse(sample['body']) == sample['codes']:
+            correct += 1
+        else:
+            misses.append(sample['name'])
+    return correct, misses
+
+
+def throughput(parse, corpus, iterations):
+    total_bytes = sum(len(sample['body']) for sample in corpus) * iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for sample in corpus:
+            parse(sample['body'])
+    elapsed = time.perf_counter() - start
+    return len(corpus) * iterations / elapsed, total_bytes / elapsed / 1e6
+
+
+def main(iterations):
+    with open(CORPUS_FILE) as f:
+        corpus = json.load(f)
+
+    print('{} emails, {} bytes, {} iterations'.format(len(corpus), sum(len(s['body']) for s in corpus), iterations))
+    for name, parse in [('legacy regex', legacy_parse), ('EmailParser', parser_parse(EmailParser()))]:
+        correct, misses = accuracy(parse, corpus)
+        emails_per_sec, mb_per_sec = throughput(parse, corpus, iterations)
+        print('{:<14} accuracy {}/{}  {:>10.0f} emails/s  {:>8.1f} MB/s'.format(name, correct, len(corpus),
+                                                                               emails_per_sec, mb_per_sec))
+        if misses:
+            print('               missed: {}'.format(', '.join(misses)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -2,68 +2,300 @@
     created by Jordan Gassaway, 9/26/2020
     check_email: simple script to check email and then pass it on to the web process
 """
+import imaplib
 import json
 import os
+import socket
 import time
 import traceback
 from imaplib import IMAP4
 
-import easyimap
 import requests
+from easyimap.easyimap import Imapper
+
+from EmailArchive import encode_raw
+from Resilience import CircuitOpen, get_breaker
+from Tracing import tracer
 
 
 class EmailConfig():
-    def __init__(self, host, user, password, pnb_url):
+    def __init__(self, host, user, password, pnb_url, tenant=None):
+        self.tenant = tenant
         self.pnb_url = pnb_url
         self.password = password
         self.user = user
         self.host = host
 
     @classmethod
-    def from_env_variables(cls):
-        for var in ['EMAIL_HOST', 'EMAIL_USER', 'EMAIL_PASSWORD', 'APP_URL']:
+    def from_env_variables(cls, url_required=True):
+        """APP_URL is only needed if emails are posted to the web server"""
+        if 'TENANTS_FILE' in os.environ:
+            if url_required and 'APP_URL' not in os.environ:
+                raise RuntimeError("Error, environment variable APP_URL not set!")
+            return cls.tenants_from_file(os.environ.get('TENANTS_FILE'), os.environ.get('APP_URL'))
+
+        for var in ['EMAIL_HOST', 'EMAIL_USER', 'EMAIL_PASSWORD'] + (['APP_URL'] if url_required else []):
             if var not in os.environ:
                 raise RuntimeError("Error, environment variable {} not set!".format(var))
 
-        return EmailConfig(os.environ.get('EMAIL_HOST'), os.environ.get('EMAIL_USER'), os.environ.get('EMAIL_PASSWORD'),
-                           os.environ.get('APP_URL'))
+        return [EmailConfig(os.environ.get('EMAIL_HOST'), os.environ.get('EMAIL_USER'), os.environ.get('EMAIL_PASSWORD'),
+                            os.environ.get('APP_URL'))]
 
     @classmethod
     def from_file(cls, file):
         data = json.load(open(file))
-        return EmailConfig(data['EMAIL_HOST'], data['EMAIL_USER'], data['EMAIL_PASSWORD'], data['APP_URL'])
+        if 'TENANTS_FILE' in data:
+            return cls.tenants_from_file(data['TENANTS_FILE'], data['APP_URL'])
+        return [EmailConfig(data['EMAIL_HOST'], data['EMAIL_USER'], data['EMAIL_PASSWORD'], data['APP_URL'])]
+
+    @classmethod
+    def tenants_from_file(cls, file, pnb_url):
+        """Load the mailbox of every building from the tenants file shared with app.py"""
+        data = json.load(open(file))
+        return [EmailConfig(t['EMAIL_HOST'], t['EMAIL_USER'], t['EMAIL_PASSWORD'], pnb_url, t['TENANT']) for t in data]
+
+
+class DeliveryFailed(Exception):
+    """Raised by a sink with the payloads it could not hand over, so their emails can be read again later"""
+    def __init__(self, payloads, reason):
+        super(DeliveryFailed, self).__init__('{} emails not delivered: {}'.format(len(payloads), reason))
+        self.payloads = payloads
+
+
+class EmailSink():
+    """Where a Mailbox delivers the package emails it reads"""
+    def deliver(self, payloads):
+        """Hand over a list of email payloads, the json objects /email takes. Raises DeliveryFailed with the
+        payloads that should be read again."""
+        raise NotImplementedError("This is an abstract class!")
+
+    def close(self):
+        pass
+
+
+class HttpSink(EmailSink):
+    """Posts emails to the web server's /email route, for a poller running in its own process.
+
+    Every post goes over one keep-alive session, and the emails read in one check are sent batch_size at a time.
+    Posts give up after timeout seconds. A post shed with a 429 or 503, e.g. by the web server's admission gate, is
+    tried again up to retries more times after the Retry-After it asks for, waiting at most max_retry_wait seconds."""
+    RETRY_STATUSES = (429, 503)
+
+    def __init__(self, pnb_url, timeout=30, batch_size=20, retries=3, max_retry_wait=10, sleep=time.sleep):
+        self.url = pnb_url + '/email'
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.retries = retries
+        self.max_retry_wait = max_retry_wait
+        self.sleep = sleep
+        self.session = requests.Session()
+
+    def deliver(self, payloads):
+        failed = []
+        for i in range(0, len(payloads), self.batch_size):
+            batch = payloads[i:i + self.batch_size]
+            try:
+                response = self._post(batch)
+            except requests.RequestException as e:
+                # the web server is unreachable, so the later batches would fail too
+                raise DeliveryFailed(failed + payloads[i:], e) from e
+
+            if not response.ok:
+                print('Web server refused {} emails: {} {}'.format(len(batch), response.status_code, response.text))
+                failed.extend(self._refused(batch, response))
+
+        if failed:
+            raise DeliveryFailed(failed, 'refused by the web server')
+
+    def _post(self, batch):
+        for attempt in range(self.retries + 1):
+            with tracer.trace('forward_email', emails=len(batch)) as trace_id:
+                with tracer.span('http', 'post_email'):
+                    # a single email is sent on its own, which web servers from before batching understand
+                    response = self.session.post(self.url, json=batch if len(batch) > 1 else batch[0],
+                                                 headers={'X-Trace-Id': trace_id}, timeout=self.timeout)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                return response
+            self.sleep(self._retry_wait(response))
+
+    def _retry_wait(self, response):
+        try:
+            wait = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            # an http date, which the web server never sends
+            wait = 1
+        return min(max(wait, 0), self.max_retry_wait)
+
+    @staticmethod
+    def _refused(batch, response):
+        """Payloads of a refused batch that were not handled. /email lists the ones that failed when only some did."""
+        try:
+            return [batch[i] for i in response.json()['failed']]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return batch
+
+    def close(self):
+        self.session.close()
+
+
+class LocalSink(EmailSink):
+    """Calls deliver_fn(payload) for each email, for a poller running inside the web server. The emails are
+    handled on the poller's thread, without a round trip through the router or a web request slot."""
+    def __init__(self, deliver_fn):
+        self.deliver_fn = deliver_fn
+
+    def deliver(self, payloads):
+        for payload in payloads:
+            try:
+                with tracer.trace('forward_email'):
+                    self.deliver_fn(payload)
+            except:
+                # the email is read, so it is only kept by the archive; carry on with the others
+                traceback.print_exc()
+
+
+class TimedIMAP4_SSL(imaplib.IMAP4_SSL):
+    """IMAP4_SSL whose connect, TLS handshake, login and every later read give up after timeout seconds. imaplib on
+    Python 3.6 has no timeout of its own."""
+    def __init__(self, host, port, timeout):
+        # read by _create_socket, which IMAP4_SSL's constructor calls
+        self.connect_timeout = timeout
+        super(TimedIMAP4_SSL, self).__init__(host, port)
+
+    def _create_socket(self, *args):
+        sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        return self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+
+class TimedImapper(Imapper):
+    """easyimap's Imapper over a TimedIMAP4_SSL. easyimap.connect's own connection can hang forever."""
+    def __init__(self, host, user, password, timeout, mailbox='INBOX', port=993):
+        self.timeout = timeout
+        super(TimedImapper, self).__init__(host, user, password, mailbox, timeout, True, port)
+
+    def _get_mailer(self, host, user, password, mailbox, timeout, ssl, port):
+        mailer = TimedIMAP4_SSL(host, port, self.timeout)
+        try:
+            mailer.login(user, password)
+            status, msgs = mailer.select(mailbox, self._read_only)
+            if status != 'OK':
+                raise IMAP4.error('Could not select {}: {}'.format(mailbox, msgs))
+        except:
+            mailer.shutdown()
+            raise
+        return mailer
+
+
+class Mailbox():
+    """IMAP connection to one building's mailroom inbox. Connects on first use.
+
+    Connecting to and reading from the mail server give up after IMAP_TIMEOUT seconds, so a poller stuck on a mail
+    server cannot keep the leader lock. New package emails go to sink, by default posted to the web server after
+    POST_TIMEOUT seconds. While a mail server keeps failing its circuit breaker skips it without connecting."""
+    IMAP_TIMEOUT = 30
+    POST_TIMEOUT = 30
+
+    def __init__(self, config: EmailConfig, sink: EmailSink = None):
+        self.config = config
+        self.sink = HttpSink(config.pnb_url, self.POST_TIMEOUT) if sink is None else sink
+        self.imap = None
+        self.breaker = get_breaker('imap:' + config.host, failure_threshold=3, reset_timeout=60)
+
+    def connect(self):
+        self.imap = TimedImapper(self.config.host, self.config.user, self.config.password, self.IMAP_TIMEOUT)
+
+    def reconnect(self):
+        self.close()
+        self.connect()
+
+    def close(self):
+        if self.imap is not None:
+            try:
+                self.imap.quit()
+            except:
+                traceback.print_exc()
+            self.imap = None
+
+    def mark_unseen(self, uids):
+        """Clear the \\Seen flag of emails, so the next check reads them again"""
+        uids = [str(uid) for uid in uids if uid is not None]
+        if uids:
+            self.imap._mailer.uid('STORE', ','.join(uids), '-FLAGS', '(\\Seen)')
+
+    def check_for_email(self):
+        """Deliver new package emails to the sink. Returns False if the mailbox could not be read."""
+        try:
+            with self.breaker.guard():
+                if self.imap is None:
+                    self.connect()
+                with tracer.span('imap', 'unseen', mailbox=self.config.user):
+                    # what unseen() does, but easyimap 0.6.3's unseen cannot include the raw message
+                    new_mail = self.imap.listup(10, 'UNSEEN', include_raw=True)
+
+            if new_mail:
+                payloads = []
+                uids = {}
+                for email in new_mail:
+                    if 'package to pick up' in email.title:
+                        print(email)
+                        # the raw message and its headers let the web server archive the email
+                        payload = {'title': email.title, 'body': email.body, 'message_id': email.message_id,
+                                   'date': email.date}
+                        if email.raw:
+                            payload['raw'] = encode_raw(email.raw)
+                        if self.config.tenant is not None:
+                            payload['tenant'] = self.config.tenant
+                        payloads.append(payload)
+                        uids[id(payload)] = email.uid
+                try:
+                    self.sink.deliver(payloads)
+                except DeliveryFailed as e:
+                    # reading the emails marked them seen, so unmark the ones the sink did not take
+                    self.mark_unseen([uids[id(payload)] for payload in e.payloads])
+                    raise
+
+            else:
+                print('no new emails')
+            return True
+
+        except CircuitOpen as e:
+            print(e)
+        except DeliveryFailed as e:
+            # the web server did not take the emails; the mailbox itself is fine
+            print(e)
+        except (IMAP4.abort, OSError):
+            # socket error or timeout, close & reopen socket
+            traceback.print_exc()
+            self.close()
+        except:
+            traceback.print_exc()
+        return False
+
 
 DEV_MODE = False
 
-if DEV_MODE:
-    config = EmailConfig.from_file('passwords.json')
-else:   # PROD MODE
-    config = EmailConfig.from_env_variables()
 
-imap = easyimap.connect(config.host, config.user, config.password)
+def load_mailboxes(sink: EmailSink = None):
+    """Mailboxes of every building. Without a sink all of them post to APP_URL over one HttpSink."""
+    if DEV_MODE:
+        configs = EmailConfig.from_file('passwords.json')
+    else:   # PROD MODE
+        configs = EmailConfig.from_env_variables(url_required=sink is None)
+
+    if sink is None and configs:
+        sink = HttpSink(configs[0].pnb_url, Mailbox.POST_TIMEOUT)
+    return [Mailbox(config, sink) for config in configs]
+
+
+mailboxes = None
 
 def check_for_email():
-    global imap, config
-    try:
-        new_mail = imap.unseen()
-
-        if new_mail:
-            for email in new_mail:
-                if 'package to pick up' in email.title:
-                    print(email)
-                    # send a post to the web server
-                    requests.post(config.pnb_url + '/email', json={'title': email.title, 'body': email.body})
-
-        else:
-            print('no new emails')
-
-    except IMAP4.abort:
-        # socket error, close & reopen socket
-        traceback.print_exc()
-        imap.quit()
-        imap = easyimap.connect(config.host, config.user, config.password)
-    except:
-        traceback.print_exc()
+    global mailboxes
+    if mailboxes is None:
+        mailboxes = load_mailboxes()
+
+    for mailbox in mailboxes:
+        mailbox.check_for_email()
 
 
 def poll_emails_periodically(poll_period):
@@ -0,0 +1,31 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    gunicorn_config: worker hooks that start the app's connections and threads after gunicorn forks
+"""
+import os
+import traceback
+
+from app import worker_threads
+
+# several requests per worker share its connection pool, admission gate and caches. The gate decides how many of
+# them run at once, so every request it runs or queues needs a thread; see worker_threads in app.py
+threads = worker_threads()
+
+
+def post_worker_init(worker):
+    # runs in the worker after the app is loaded, so with or without --preload nothing is shared with the master
+    services = worker.wsgi.extensions['pnb']
+    services.start()
+
+    if os.environ.get('WARM_UP', '1') == '1':
+        try:
+            services.warm_up()
+        except:
+            # the first request will connect instead
+            traceback.print_exc()
+
+
+def worker_exit(server, worker):
+    app = getattr(worker, 'wsgi', None)
+    if app is not None:
+        app.extensions['pnb'].stop()
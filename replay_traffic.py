@@ -0,0 +1,188 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    replay_traffic: load test a local instance by replaying traffic captured with RECORD_TRAFFIC
+
+    usage: python replay_traffic.py capture.jsonl.gz [capture2.jsonl.gz ...] --url http://localhost:5000 --speed 10
+               --concurrency 8 --graph-stub 8081 --secret USER_PASSPHRASE=... --init-db
+
+    Run the app with GRAPH_API_URL=http://localhost:8081 to send its Messenger calls to the stand in Graph API
+    started by --graph-stub, and with DB_NAME/DB_USER/DB_PASSWORD pointing at a local Postgres. --init-db creates
+    the tables there before replaying.
+"""
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import os
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from TrafficRecorder import TrafficRecorder
+
+
+class GraphStubHandler(BaseHTTPRequestHandler):
+    """Answers the Graph API calls the app makes: profile lookups and sends to /me/messages"""
+    latency = 0
+    messages = collections.Counter()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        pfid = self.path.strip('/').split('?')[0]
+        self._reply({'first_name': 'Replay', 'last_name': pfid[-6:]})
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        GraphStubHandler.messages[self.path.split('?')[0]] += 1
+        self._reply({'recipient_id': body.get('recipient', {}).get('id'), 'message_id': 'mid.replay'})
+
+    def _reply(self, data):
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_graph_stub(port, latency_ms):
+    GraphStubHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', port), GraphStubHandler)
+    threading.Thread(target=server.serve_forever, name='graph-stub', daemon=True).start()
+    return server
+
+
+def init_db():
+    """Create the tables of every tenant in the database the app is configured to use"""
+    from app import AppConfig
+    from PNBDatabase import PNBDatabase
+
+    config = AppConfig.from_env_variables()
+    db = PNBDatabase(config.db_config)
+    for pn_config in config.to_pn_configs():
+        db.forTenant(pn_config.tenant).createTables()
+    db.close()
+
+
+def load_requests(paths, secrets):
+    """Merge several recordings (e.g. one per worker) into one time ordered list of requests"""
+    recordings = [TrafficRecorder.load(path) for path in paths]
+    merged = []
+    placeholders = {'<{}>'.format(name): value for name, value in secrets.items()}
+    for t, route, body in heapq.merge(*recordings, key=lambda r: r[0]):
+        merged.append((t, route, json.dumps(fill_secrets(body, placeholders)).encode()))
+    return merged
+
+
+def fill_secrets(value, placeholders):
+    """Put the secrets back into a decoded body, so they are escaped like any other text when it is encoded"""
+    if isinstance(value, dict):
+        return {key: fill_secrets(item, placeholders) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_secrets(item, placeholders) for item in value]
+    if isinstance(value, str):
+        return placeholders.get(value, value)
+    return value
+
+
+class Replayer:
+    def __init__(self, url, speed, concurrency):
+        self.url = url.rstrip('/')
+        self.speed = speed
+        self.concurrency = concurrency
+        self.results = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.headers['Content-Type'] = 'application/json'
+        return self._local.session
+
+    def send(self, route, body):
+        start = time.perf_counter()
+        try:
+            status = self.session().post(self.url + route, data=body, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+        result = (route, status, time.perf_counter() - start)
+        with self._lock:
+            self.results.append(result)
+
+    def run(self, recorded):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            for t, route, body in recorded:
+                delay = start + t / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, route, body)
+        return time.perf_counter() - start
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(results, elapsed):
+    print('{} requests in {:.1f}s, {:.1f} req/s'.format(len(results), elapsed, len(results) / elapsed))
+    key = lambda r: r[0]
+    for route, group in itertools.groupby(sorted(results, key=key), key=key):
+        group = list(group)
+        latencies = [r[2] * 1000 for r in group]
+        errors = [r for r in group if r[1] is None or r[1] >= 400]
+        statuses = collections.Counter(r[1] for r in group)
+        print('{:<8} n={:<6} errors={} ({:.1%})  p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms  status {}'.format(
+            route, len(group), len(errors), len(errors) / len(group), percentile(latencies, 50),
+            percentile(latencies, 90), percentile(latencies, 99), max(latencies), dict(statuses)))
+
+    if GraphStubHandler.messages:
+        print('Graph API stand in received {}'.format(dict(GraphStubHandler.messages)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded webhook and /email traffic against an instance')
+    parser.add_argument('recordings', nargs='+')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--speed', type=float, default=1, help='1, 10, 100... times the recorded rate')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--graph-stub', type=int, metavar='PORT', help='run a stand in Graph API on this port')
+    parser.add_argument('--graph-latency', type=float, default=0, metavar='MS')
+    parser.add_argument('--secret', action='append', default=[], metavar='NAME=VALUE',
+                        help='value for a placeholder such as USER_PASSPHRASE (defaults to the variable of that name)')
+    parser.add_argument('--init-db', action='store_true', help='create the tables before replaying')
+    args = parser.parse_args()
+
+    secrets = {name: os.environ[name] for name in ['USER_PASSPHRASE', 'ADMIN_PASSPHRASE'] if name in os.environ}
+    secrets.update(dict(s.split('=', 1) for s in args.secret))
+
+    if args.init_db:
+        init_db()
+    if args.graph_stub:
+        start_graph_stub(args.graph_stub, args.graph_latency)
+
+    recorded = load_requests(args.recordings, secrets)
+    replayer = Replayer(args.url, args.speed, args.concurrency)
+    elapsed = replayer.run(recorded)
+    report(replayer.results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
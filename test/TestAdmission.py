@@ -0,0 +1,90 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestAdmission: unit tests for admission control and load shedding
+"""
+import threading
+import time
+import unittest
+
+from Admission import AdmissionGate, Overloaded
+
+
+class TestAdmission(unittest.TestCase):
+    def waitFor(self, condition, timeout=1):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def start(self, gate, route, priority, results):
+        """admit a request on a new thread and record the order requests get in"""
+        def request():
+            try:
+                started = gate.admit(route, priority)
+                results.append(route)
+                gate.release(route, started)
+            except Overloaded as e:
+                results.append(e.status)
+        thread = threading.Thread(target=request)
+        thread.start()
+        return thread
+
+    def testRouteLimit(self):
+        """a route can not take more than its limit even if the gate has room"""
+        gate = AdmissionGate(capacity=3, route_limits={'/': 1}, max_queue=0, max_wait=0.05)
+        started = gate.admit('/')
+        self.assertRaises(Overloaded, gate.admit, '/')
+        gate.admit('/email')
+        self.assertEqual({'/': 1, '/email': 1}, gate.status()['routes'])
+
+        gate.release('/', started)
+        gate.admit('/')
+
+    def testQueueFull(self):
+        """requests that find the wait queue full are refused with a 429 and a Retry-After"""
+        gate = AdmissionGate(capacity=1, max_queue=0)
+        gate.admit('/')
+        with self.assertRaises(Overloaded) as context:
+            gate.admit('/')
+        self.assertEqual(429, context.exception.status)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        self.assertEqual(1, gate.status()['rejected'])
+
+    def testWaitTimeout(self):
+        """requests that wait longer than max_wait are refused with a 503"""
+        gate = AdmissionGate(capacity=1, max_queue=4, max_wait=0.05)
+        gate.admit('/')
+        with self.assertRaises(Overloaded) as context:
+            gate.admit('/')
+        self.assertEqual(503, context.exception.status)
+        self.assertEqual(0, gate.status()['queued'])
+
+    def testPriority(self):
+        """when a slot frees up high priority waiters go first"""
+        gate = AdmissionGate(capacity=1, max_queue=4, max_wait=2)
+        started = gate.admit('/')
+        results = []
+        threads = [self.start(gate, '/', AdmissionGate.NORMAL, results)]
+        self.waitFor(lambda: gate.status()['queued'] == 1)
+        threads.append(self.start(gate, '/email', AdmissionGate.HIGH, results))
+        self.waitFor(lambda: gate.status()['queued'] == 2)
+
+        gate.release('/', started)
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(['/email', '/'], results)
+
+    def testEviction(self):
+        """a high priority request displaces the newest normal one from a full queue"""
+        gate = AdmissionGate(capacity=1, max_queue=1, max_wait=2)
+        started = gate.admit('/')
+        results = []
+        threads = [self.start(gate, '/', AdmissionGate.NORMAL, results)]
+        self.waitFor(lambda: gate.status()['queued'] == 1)
+        threads.append(self.start(gate, '/email', AdmissionGate.HIGH, results))
+        self.waitFor(lambda: results == [429])
+
+        gate.release('/', started)
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual([429, '/email'], results)
@@ -0,0 +1,127 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestApp: unit tests for the app's routes, through the Flask test client, and for how workers are sized
+"""
+import json
+import os
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+# app pulls in the real PackageNotifier and PNBDatabase, which must not be left in sys.modules for test modules that
+# import them with mocks, e.g. TestPackageNotifier. Everything app shares state with is imported here too.
+with mock.patch.dict('sys.modules'):
+    from app import bp, make_gate, worker_threads
+    from Health import HealthCheck
+    from Profiling import profiler
+    from Throttle import SenderThrottle
+    from test.TestHealth import FakePoller, FakeTenants
+
+
+def response_json(response):
+    return json.loads(response.get_data(as_text=True))
+
+
+class FakeServices():
+    def __init__(self, tenants):
+        self.health = HealthCheck()
+        self.tenants = tenants
+        self.poller = FakePoller()
+        self.gate = make_gate()
+        self.recorder = None
+        self.archive = None
+        self.throttle = SenderThrottle(rate=0, burst=1)
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask('test')
+        self.app.register_blueprint(bp)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        profiler.stop()
+
+    def testHealthz(self):
+        """/healthz answers with json and does not start the worker's services"""
+        services = self.app.extensions['pnb'] = FakeServices(FakeTenants())
+        response = self.client.get('/healthz')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json', response.mimetype)
+        self.assertEqual('ok', response_json(response)['status'])
+        self.assertFalse(services.started, "Liveness started the services!")
+
+    def testReadyz(self):
+        """/readyz is 200 with a json report while ready and 503 while not"""
+        self.app.extensions['pnb'] = FakeServices(FakeTenants())
+        response = self.client.get('/readyz')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('ok', response_json(response)['status'])
+
+        self.app.extensions['pnb'] = FakeServices(FakeTenants(reachable=False))
+        response = self.client.get('/readyz')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, len(response_json(response)['problems']))
+
+    @mock.patch.dict(os.environ, {'PROFILING_TOKEN': 'secret'})
+    def testProfile(self):
+        """profiling sessions are started, reported and stopped with json responses, and only one runs at a time"""
+        self.app.extensions['pnb'] = FakeServices(FakeTenants())
+        auth = {'Authorization': 'Bearer secret'}
+        self.assertEqual(403, self.client.post('/debug/profile?seconds=5').status_code)
+
+        response = self.client.post('/debug/profile?seconds=5', headers=auth)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response_json(response)['active'])
+        self.assertEqual(409, self.client.post('/debug/profile?seconds=5', headers=auth).status_code)
+        self.assertIn('calls', response_json(self.client.get('/debug/profile/calls', headers=auth)))
+
+        response = self.client.delete('/debug/profile', headers=auth)
+        self.assertFalse(response_json(response)['active'])
+
+    @mock.patch.dict(os.environ, {'ADMISSION_CAPACITY': '6', 'ADMISSION_QUEUE': '10'})
+    def testWorkerThreads(self):
+        """by default a worker has a thread for every request the gate runs or queues, so it can shed the rest"""
+        os.environ.pop('WEB_THREADS', None)
+        gate = make_gate()
+        self.assertEqual(gate.capacity + gate.max_queue, worker_threads())
+
+        os.environ['WEB_THREADS'] = '8'
+        self.assertEqual(8, worker_threads())
+
+    def testThrottleOnlyMessages(self):
+        """deliveries and reads do not use up a sender's bucket, but a second message is dropped"""
+        notifier = mock.Mock()
+        notifier.db.getCachedUser.return_value = None
+        tenants = FakeTenants()
+        tenants.for_page = lambda page_id: notifier
+        self.app.extensions['pnb'] = FakeServices(tenants)
+
+        events = [{'sender': {'id': '101'}, 'delivery': {'mids': ['mid.1']}},
+                  {'sender': {'id': '101'}, 'read': {'watermark': 1}},
+                  {'sender': {'id': '101'}, 'message': {'text': 'help'}},
+                  {'sender': {'id': '101'}, 'message': {'text': 'help'}}]
+        with mock.patch('builtins.print'):
+            body = json.dumps({'object': 'page', 'entry': [{'id': '1', 'messaging': events}]})
+            response = self.client.post('/', data=body, content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        notifier.handle_message.assert_called_once_with(events[2])
+
+    def testEmailPartlyFailed(self):
+        """a batch of emails that partly fails is a 500 listing which emails to send again"""
+        notifier = mock.Mock()
+        notifier.handle_email.side_effect = lambda email: 1 / int(email.body)
+        tenants = FakeTenants()
+        tenants.for_tenant = lambda tenant: notifier
+        self.app.extensions['pnb'] = FakeServices(tenants)
+
+        emails = [{'title': 'package to pick up', 'body': body} for body in ['1', '0', '2']]
+        with mock.patch('traceback.print_exc'):
+            response = self.client.post('/email', data=json.dumps(emails), content_type='application/json')
+        self.assertEqual(500, response.status_code)
+        self.assertEqual([1], response_json(response)['failed'])
@@ -0,0 +1,143 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestCheckEmail: unit tests for delivering polled emails to the web server or in process
+"""
+import socket
+import time
+import unittest
+from unittest import mock
+
+from check_email import DeliveryFailed, EmailConfig, HttpSink, LocalSink, Mailbox, TimedIMAP4_SSL
+
+
+class FakeMail():
+    def __init__(self, title, body, message_id='<1@mailroom>', uid=None):
+        self.uid = uid
+        self.title = title
+        self.body = body
+        self.message_id = message_id
+        self.date = 'Mon, 19 Oct 2026 09:00:00 -0000'
+        self.raw = ('Subject: ' + title + '\r\n\r\n' + body).encode()
+
+
+class Imapper063():
+    """The methods of easyimap.Imapper as of easyimap 0.6.3, the version in requirements.txt"""
+    def unseen(self, limit=10):
+        pass
+
+    def listup(self, limit=10, criterion=None, include_raw=False):
+        pass
+
+    def quit(self):
+        pass
+
+
+class FakeResponse():
+    def __init__(self, status_code, headers=None, json=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = ''
+        self._json = json
+
+    def json(self):
+        if self._json is None:
+            raise ValueError('No JSON object could be decoded')
+        return self._json
+
+
+class TestCheckEmail(unittest.TestCase):
+    def testHttpBatches(self):
+        """emails are posted over one session in batches, and a single email on its own"""
+        sink = HttpSink('https://pnb.example.com', batch_size=20)
+        sink.session = mock.Mock()
+        sink.deliver([{'title': str(i)} for i in range(45)])
+
+        self.assertEqual(3, sink.session.post.call_count)
+        batches = [call[1]['json'] for call in sink.session.post.call_args_list]
+        self.assertEqual([20, 20, 5], [len(batch) for batch in batches])
+        self.assertEqual('44', batches[2][-1]['title'])
+        self.assertEqual('https://pnb.example.com/email', sink.session.post.call_args[0][0])
+
+        sink.session.reset_mock()
+        sink.deliver([{'title': 'only'}])
+        self.assertEqual({'title': 'only'}, sink.session.post.call_args[1]['json'])
+
+    def testLocal(self):
+        """emails are handed to the function in this process, and one failing does not stop the others"""
+        delivered = []
+
+        def deliver(payload):
+            if payload['title'] == 'bad':
+                raise ValueError('could not parse')
+            delivered.append(payload['title'])
+
+        LocalSink(deliver).deliver([{'title': 'first'}, {'title': 'bad'}, {'title': 'last'}])
+        self.assertEqual(['first', 'last'], delivered)
+
+    def testMailbox(self):
+        """package emails read in one check are delivered together, with the tenant they were sent to"""
+        sink = mock.Mock()
+        mailbox = Mailbox(EmailConfig('imap.example.com', 'mailroom', 'pwd', None, tenant='maple_court'), sink)
+        # calls that easyimap 0.6.3 would not accept raise a TypeError
+        mailbox.imap = mock.create_autospec(Imapper063, instance=True)
+        mailbox.imap.listup.return_value = [FakeMail('You have a package to pick up', 'Pickup Code 1111'),
+                                            FakeMail('Building newsletter', 'Pool closes early'),
+                                            FakeMail('You have a package to pick up', 'Pickup Code 2222')]
+
+        self.assertTrue(mailbox.check_for_email())
+        payloads = sink.deliver.call_args[0][0]
+        self.assertEqual(['Pickup Code 1111', 'Pickup Code 2222'], [p['body'] for p in payloads])
+        self.assertTrue(all(p['tenant'] == 'maple_court' and 'raw' in p for p in payloads))
+
+    def testHttpRetry(self):
+        """posts shed by the web server are tried again after the Retry-After it asked for"""
+        sleeps = []
+        sink = HttpSink('https://pnb.example.com', retries=3, max_retry_wait=10, sleep=sleeps.append)
+        sink.session = mock.Mock()
+        sink.session.post.side_effect = [FakeResponse(429, {'Retry-After': '2'}),
+                                         FakeResponse(503, {'Retry-After': '60'}), FakeResponse(200)]
+        sink.deliver([{'title': 'only'}])
+        self.assertEqual(3, sink.session.post.call_count)
+        self.assertEqual([2, 10], sleeps)
+
+    def testHttpGivesUp(self):
+        """emails the web server keeps refusing are raised, and only the failed ones of a partly handled batch"""
+        sink = HttpSink('https://pnb.example.com', batch_size=2, retries=2, sleep=lambda seconds: None)
+        sink.session = mock.Mock()
+        sink.session.post.side_effect = [FakeResponse(503)] * 3 + [FakeResponse(500, json={'failed': [1]})]
+        payloads = [{'title': str(i)} for i in range(4)]
+        with self.assertRaises(DeliveryFailed) as context:
+            sink.deliver(payloads)
+        self.assertEqual(4, sink.session.post.call_count)
+        self.assertEqual(['0', '1', '3'], [p['title'] for p in context.exception.payloads])
+
+    def testMailboxUndelivered(self):
+        """emails the sink could not deliver are marked unseen so the next check reads them again"""
+        sink = mock.Mock()
+        mailbox = Mailbox(EmailConfig('imap.example.com', 'mailroom', 'pwd', None), sink)
+        mailbox.imap = mock.create_autospec(Imapper063, instance=True)
+        mailbox.imap._mailer = mock.Mock()
+        mailbox.imap.listup.return_value = [FakeMail('You have a package to pick up', 'Pickup Code 1111', uid=41),
+                                            FakeMail('You have a package to pick up', 'Pickup Code 2222', uid=42)]
+        sink.deliver.side_effect = lambda payloads: self.fail_delivery(payloads[1:])
+
+        self.assertFalse(mailbox.check_for_email())
+        mailbox.imap._mailer.uid.assert_called_once_with('STORE', '42', '-FLAGS', '(\\Seen)')
+
+    @staticmethod
+    def fail_delivery(payloads):
+        raise DeliveryFailed(payloads, 'refused by the web server')
+
+    def testConnectTimeout(self):
+        """connecting to a mail server that never answers gives up after the timeout"""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        start = time.time()
+        try:
+            with self.assertRaises(OSError):
+                TimedIMAP4_SSL('127.0.0.1', server.getsockname()[1], 0.2)
+        finally:
+            server.close()
+        self.assertLess(time.time() - start, 5)
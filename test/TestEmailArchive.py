@@ -0,0 +1,75 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestEmailArchive: unit tests for the raw email archive
+"""
+import os
+import tempfile
+import unittest
+from email.message import EmailMessage
+
+from EmailArchive import EmailArchive, decode_raw, encode_raw
+
+
+def make_email(message_id, date, body):
+    message = EmailMessage()
+    message['Subject'] = 'You have a package to pick up'
+    message['Message-ID'] = message_id
+    message['Date'] = date
+    message.set_content(body)
+    return message.as_bytes()
+
+
+class TestEmailArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive = EmailArchive(self.tmpdir.name)
+        self.raw1 = make_email('<1@mailroom>', 'Mon, 12 Oct 2026 09:30:00 -0700', 'Your pickup code is 1234')
+        self.raw2 = make_email('<2@mailroom>', 'Thu, 15 Oct 2026 17:05:00 +0000', 'Your code is nowhere to be seen')
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmpdir.cleanup()
+
+    def testAppendAndRead(self):
+        """archived emails are found by Message-ID, package id and date, and read back unchanged"""
+        self.archive.append(self.raw1, '<1@mailroom>', 'Mon, 12 Oct 2026 09:30:00 -0700', None, 'package', [7])
+        self.archive.append(self.raw2, '<2@mailroom>', 'Thu, 15 Oct 2026 17:05:00 +0000', 'maple_court', 'package')
+
+        entry, = self.archive.by_message_id('<1@mailroom>')
+        self.assertEqual(self.raw1, self.archive.read(entry))
+        self.assertEqual('2026-10-12T16:30:00', entry.date)
+        self.assertEqual([entry], self.archive.by_package(7))
+        self.assertIn('pickup code is 1234', self.archive.read_body(entry))
+
+        self.assertEqual(['<2@mailroom>'], [e.message_id for e in self.archive.between('2026-10-13')])
+        self.assertEqual(['<1@mailroom>'], [e.message_id for e in self.archive.between(None, '2026-10-13')])
+        self.assertEqual(['<2@mailroom>'], [e.message_id for e in self.archive.unparsed()])
+
+    def testReopen(self):
+        """a new archive on the same directory loads the index written by another one"""
+        self.archive.append(self.raw1, '<1@mailroom>', None, None, 'package', [7])
+        self.archive.close()
+
+        archive = EmailArchive(self.tmpdir.name)
+        self.archive.append(self.raw2, '<2@mailroom>', None, None, 'package', [8])
+        entries = archive.entries()
+        self.assertEqual(['<1@mailroom>', '<2@mailroom>'], [e.message_id for e in entries])
+        self.assertEqual(self.raw2, archive.read(entries[1]))
+        archive.close()
+
+    def testSegments(self):
+        """a new segment is started once the current one is full, and entries are compressed"""
+        archive = EmailArchive(self.tmpdir.name, max_segment_bytes=60)
+        body = ('Your pickup code is 1234. ' * 50).encode()
+        for i in range(3):
+            entry = archive.append(body, '<{}@mailroom>'.format(i), is_raw=False)
+            self.assertLess(entry.length, len(body))
+
+        self.assertEqual(3, len({e.segment for e in archive.entries()}))
+        self.assertEqual(3, len([f for f in os.listdir(self.tmpdir.name) if f.endswith('.seg')]))
+        self.assertTrue(all(archive.read_body(e) == body.decode() for e in archive.entries()))
+        archive.close()
+
+    def testEncodeRaw(self):
+        """raw emails survive the trip through json"""
+        self.assertEqual(self.raw1, decode_raw(encode_raw(self.raw1)))
@@ -0,0 +1,92 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestEmailParser: unit tests for the email parser
+"""
+import unittest
+
+from EmailParser import EmailParser, EmailTemplate, ParsedPackage
+
+
+class TestEmailParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = EmailParser()
+
+    def testPlainText(self):
+        """parse finds the pickup code in the original mailroom format"""
+        bodies = {
+            'New package pickup code\n1234': 1234,
+            'blah blah blah Pickup Code\r\n656558 lorem ipsum': 656558,
+            'blah blah blah Pickup Code    99999999': 99999999,
+            'Your pickup code is: 4321. It expires in 3 days.': 4321,
+        }
+        for body, code in bodies.items():
+            self.assertEqual([ParsedPackage(code, 'pickup_code')], self.parser.parse(body), body)
+
+    def testOtherTemplates(self):
+        """parse recognizes locker systems that do not use the words pickup code"""
+        self.assertEqual([ParsedPackage(889911, 'access_code')],
+                         self.parser.parse('Your package is in locker 12. Your access code is 889911.'))
+        self.assertEqual([ParsedPackage(5021, 'locker_code')],
+                         self.parser.parse('Locker Code: 5021'))
+        self.assertEqual([ParsedPackage(77310, 'release_code')],
+                         self.parser.parse('Enter retrieval code 77310 at the kiosk'))
+
+    def testMultiplePackages(self):
+        """parse returns every package in an email, once each, in order"""
+        body = 'Pickup Code 111\nPickup Code 222\nReminder: Pickup Code 111\nPickup Code 333'
+        codes = [p.code for p in self.parser.parse(body)]
+        self.assertEqual([111, 222, 333], codes)
+
+    def testHtml(self):
+        """parse strips html around the code and ignores markup outside the region"""
+        body = ('<html><head><style>td { color: #123456; }</style></head><body>' + '<p>filler</p>' * 500 +
+                '<table><tr><td>Pickup&nbsp;Code</td><td><b>2468</b></td></tr>'
+                '<tr><td>Pickup Code</td><td>1357</td></tr></table></body></html>')
+        codes = [p.code for p in self.parser.parse(body)]
+        self.assertEqual([2468, 1357], codes)
+
+    def testHtmlSplitMarker(self):
+        """parse finds markers split by tags or entities when no plain marker is nearby"""
+        filler = '<html><body>' + '<p>filler</p>' * 500
+        for markup in ['<table><tr><td>Pickup&nbsp;Code</td><td>2468</td></tr></table>', '<p>Pickup<br>Code 2468</p>',
+                       '<p><b>Pickup</b> <i>Code</i>: 2468</p>']:
+            body = filler + markup + '</body></html>'
+            self.assertEqual([2468], [p.code for p in self.parser.parse(body)], markup)
+
+    def testRecipients(self):
+        """parse picks up the names and units an email is addressed to, ignoring generic greetings"""
+        packages = self.parser.parse('Hello John Smith,\nYou have a package to pick up.\nUnit 4B\nPickup Code 1234')
+        self.assertEqual(['John Smith', 'Unit 4B'], packages[0].recipients)
+
+        packages = self.parser.parse('Hello Resident,\nRecipient: Jane Doe\nPickup Code 12\nPickup Code 13')
+        self.assertEqual([['Jane Doe'], ['Jane Doe']], [p.recipients for p in packages])
+
+        packages = self.parser.parse('<p>Dear Ann Lee,</p><p>Apt #12</p><p>Pickup Code: 77</p>')
+        self.assertEqual(['Ann Lee', 'Apt #12'], packages[0].recipients)
+
+        self.assertEqual([], self.parser.parse('Pickup Code 1234')[0].recipients)
+
+    def testNoCode(self):
+        """parse returns an empty list when no template matches"""
+        self.assertEqual([], self.parser.parse('blah blah blah no code'))
+        self.assertEqual([], self.parser.parse(''))
+        self.assertEqual([], self.parser.parse('Your pickup code will be sent shortly'))
+
+    def testRegister(self):
+        """templates registered first take priority over the defaults"""
+        self.parser.register(EmailTemplate('claim', 'claim\\s+number', 'claim\\s+number\\s*(?P<code>[0-9]+)'))
+        self.assertEqual([ParsedPackage(42, 'claim')], self.parser.parse('Claim number 42'))
+
+        self.parser.register(EmailTemplate('override', 'pickup\\s+code', 'pickup\\s+code\\s*(?P<code>[0-9]{2})'),
+                             first=True)
+        self.assertEqual([ParsedPackage(12, 'override')], self.parser.parse('Pickup Code 1234'))
+
+    def testKeyword(self):
+        """a template with a keyword only matches markers near it, and markers with capitals still ignore case"""
+        self.parser.register(EmailTemplate('claim', 'claim\\s+number', 'claim\\s+number\\s*(?P<code>[0-9]+)',
+                                           keyword='number'))
+        self.assertEqual([ParsedPackage(42, 'claim')], self.parser.parse('CLAIM Number 42'))
+        self.assertEqual([], self.parser.parse('claim no. 42'))
+
+        self.parser.register(EmailTemplate('ticket', 'Ticket\\s+ID', 'Ticket\\s+ID\\s*(?P<code>[0-9]+)'), first=True)
+        self.assertEqual([ParsedPackage(7, 'ticket')], self.parser.parse('ticket id 7'))
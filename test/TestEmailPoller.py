@@ -0,0 +1,95 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestEmailPoller: unit tests for the leader elected email poller
+"""
+import os
+import tempfile
+import unittest
+
+from EmailPoller import EmailPoller, FileLock
+
+
+class FakeMailbox():
+    """Stand in for check_email.Mailbox"""
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.checks = 0
+        self.closed = False
+
+    def check_for_email(self):
+        self.checks += 1
+        return self.ok
+
+    def close(self):
+        self.closed = True
+
+
+class TestEmailPoller(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.lock_path = os.path.join(self.tmpdir.name, 'poller.lock')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testFileLock(self):
+        """Only one FileLock on a path can be held at a time"""
+        lock1 = FileLock(self.lock_path)
+        lock2 = FileLock(self.lock_path)
+
+        self.assertTrue(lock1.acquire())
+        self.assertFalse(lock2.acquire(), "Lock was taken twice!")
+
+        lock1.release()
+        self.assertFalse(lock1.is_held())
+        self.assertTrue(lock2.acquire(), "Lock was not freed!")
+        lock2.release()
+
+    def testSingleLeader(self):
+        """Only the poller holding the lock checks the mailboxes"""
+        mailbox1, mailbox2 = FakeMailbox(), FakeMailbox()
+        poller1 = EmailPoller([mailbox1], FileLock(self.lock_path), poll_period=0)
+        poller2 = EmailPoller([mailbox2], FileLock(self.lock_path), poll_period=0)
+
+        for _ in range(3):
+            poller1._step()
+            poller2._step()
+
+        self.assertTrue(poller1.is_leader)
+        self.assertFalse(poller2.is_leader)
+        self.assertEqual(3, mailbox1.checks)
+        self.assertEqual(0, mailbox2.checks, "Follower polled the mailbox!")
+        self.assertIsNotNone(poller1.last_poll)
+
+        poller1._step_down()
+        poller2._step()
+        self.assertTrue(poller2.is_leader, "Follower did not take over!")
+        self.assertEqual(1, mailbox2.checks)
+        poller2._step_down()
+
+    def testHandOverOnFailure(self):
+        """A leader that keeps failing to read its mailboxes releases the lock"""
+        mailbox1, mailbox2 = FakeMailbox(ok=False), FakeMailbox()
+        poller1 = EmailPoller([mailbox1], FileLock(self.lock_path), poll_period=0, max_failures=3)
+        poller2 = EmailPoller([mailbox2], FileLock(self.lock_path), poll_period=0)
+
+        for _ in range(3):
+            poller1._step()
+            poller2._step()
+
+        self.assertFalse(poller1.is_leader, "Failing leader did not step down!")
+        self.assertTrue(poller2.is_leader, "Follower did not take over!")
+        self.assertEqual(1, mailbox2.checks)
+        poller2._step_down()
+
+    def testStop(self):
+        """stop ends the thread, releases the lock and closes the mailboxes"""
+        mailbox = FakeMailbox()
+        poller = EmailPoller([mailbox], FileLock(self.lock_path), poll_period=60)
+        poller.start()
+        poller.stop(5)
+
+        self.assertFalse(poller.is_running())
+        self.assertFalse(poller.is_leader)
+        self.assertTrue(mailbox.closed)
+        self.assertTrue(FileLock(self.lock_path).acquire(), "Lock was not released!")
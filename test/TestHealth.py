@@ -0,0 +1,105 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestHealth: unit tests for the liveness and readiness checks
+"""
+import unittest
+
+from Health import HealthCheck, RateWindow
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakePool():
+    in_use = 2
+    max_connections = 5
+
+    def saturation(self):
+        return self.in_use / self.max_connections
+
+
+class FakeDB():
+    def __init__(self, reachable=True):
+        self.pool = FakePool()
+        self.reachable = reachable
+
+    def ping(self, timeout):
+        return self.reachable
+
+
+class FakeThread():
+    def __init__(self, running=True):
+        self.running = running
+
+    def is_running(self):
+        return self.running
+
+
+class FakeTenants():
+    def __init__(self, reachable=True, listening=True):
+        self.db = FakeDB(reachable)
+        self.listener = FakeThread(listening)
+
+    def queue_depth(self):
+        return 3
+
+
+class FakePoller(FakeThread):
+    is_leader = True
+    last_poll = None
+    failures = 0
+
+
+class TestHealth(unittest.TestCase):
+    def testRateWindow(self):
+        """events older than the window are forgotten"""
+        clock = FakeClock()
+        window = RateWindow(span=10, clock=clock)
+        window.record()
+        window.record(error=True)
+        clock.now += 5
+        window.record()
+        window.record()
+        self.assertEqual((4, 1), window.counts())
+        self.assertEqual(0.25, window.error_rate())
+
+        clock.now += 6
+        self.assertEqual((2, 0), window.counts())
+        clock.now += 10
+        self.assertEqual(0.0, window.error_rate())
+
+    def testReady(self):
+        """a healthy worker is ready and reports pool, poller and queue state"""
+        ready, report = HealthCheck().readiness(FakeTenants(), FakePoller())
+        self.assertTrue(ready)
+        self.assertEqual('ok', report['status'])
+        self.assertEqual(0.4, report['db']['saturation'])
+        self.assertEqual(3, report['queue_depth'])
+        self.assertIsNone(report['poller']['last_poll_age'])
+
+    def testNotReady(self):
+        """an unreachable database or a dead background thread makes the worker unready"""
+        ready, report = HealthCheck().readiness(FakeTenants(reachable=False), FakePoller())
+        self.assertFalse(ready)
+        self.assertEqual(1, len(report['problems']))
+
+        ready, report = HealthCheck().readiness(FakeTenants(listening=False), FakePoller(running=False))
+        self.assertFalse(ready)
+        self.assertEqual(['change listener stopped', 'email poller stopped'], report['problems'])
+
+    def testErrorRate(self):
+        """the worker is unready when most recent requests failed, but not on the first few errors"""
+        health = HealthCheck(HealthCheck.Config(max_error_rate=0.5, min_events=4))
+        for _ in range(3):
+            health.requests.record(error=True)
+        self.assertTrue(health.readiness(FakeTenants(), FakePoller())[0])
+
+        health.requests.record(error=True)
+        ready, report = health.readiness(FakeTenants(), FakePoller())
+        self.assertFalse(ready)
+        self.assertEqual(1.0, report['requests']['error_rate'])
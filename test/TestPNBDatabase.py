@@ -2,12 +2,15 @@
     created by Jordan Gassaway, 9/23/2020
     TestPNBDatabase: unit tests for pnb database
 """
+import contextlib
 import datetime
 
 import psycopg2
+import threading
 import unittest
 
-from PNBDatabase import PNBDatabase, User, Package
+from PNBDatabase import PNBDatabase, User, Package, ChangeEvent, ChangeListener, ReplicaSet, ConnectionPool, \
+    PoolTimeout, connect_args
 
 
 class TestPNBDatabase(unittest.TestCase):
@@ -23,10 +26,12 @@ class TestPNBDatabase(unittest.TestCase):
 
     def setUp(self):
         # Drop and recreate tables
-        self.cur.execute('DROP TABLE IF EXISTS users, packages;')
+        self.cur.execute('DROP TABLE IF EXISTS aliases, reminders, users, packages;')
         self.cur.execute('CREATE TABLE users (pfid varchar(20) PRIMARY KEY, name varchar(40) NOT NULL, ugroup varchar(10) NOT NULL)')
         self.cur.execute('CREATE TABLE packages (id integer PRIMARY KEY, code integer NOT NULL, date_received date NOT NULL, collected bool)')
-        self.cur.execute('GRANT SELECT, INSERT, UPDATE, DELETE ON users, packages TO test_pnb')
+        self.cur.execute('CREATE TABLE aliases (alias varchar(40) NOT NULL, pfid varchar(20) NOT NULL REFERENCES users ON DELETE CASCADE, PRIMARY KEY (alias, pfid))')
+        self.cur.execute('CREATE TABLE reminders (package_id integer PRIMARY KEY REFERENCES packages ON DELETE CASCADE, sent smallint NOT NULL)')
+        self.cur.execute('GRANT SELECT, INSERT, UPDATE, DELETE ON users, packages, aliases, reminders TO test_pnb')
 
         # Prefill with some data
         self.test_user1 = User('100', 'Harold Jenkins', User.Group.USER)
@@ -128,6 +133,23 @@ class TestPNBDatabase(unittest.TestCase):
         self.assertEqual(self.test_user2.name, user.name, "Names are not equal!")
         self.assertEqual(self.test_user2.group, user.group, "Groups are not equal!")
 
+    def testAliases(self):
+        """aliases are normalized, looked up by any matching alias and removed with their user"""
+        self.db.addAlias(self.test_user1, 'Apt. 4B')
+        self.db.addAlias(self.test_user1, 'Harold Jenkins')
+        self.db.addAlias(self.test_user2, '4b')
+
+        self.assertEqual(['4b', 'harold jenkins'], self.db.getAliases(self.test_user1))
+        self.assertCountEqual([self.test_user1.PFID, self.test_user2.PFID], self.db.getPFIDsByAlias(['Unit 4B']))
+        self.assertEqual([self.test_user1.PFID], self.db.getPFIDsByAlias(['HAROLD  JENKINS', '9c']))
+        self.assertEqual([], self.db.getPFIDsByAlias([]))
+
+        self.db.removeAlias(self.test_user2, '4B')
+        self.assertEqual([self.test_user1.PFID], self.db.getPFIDsByAlias(['4b']))
+
+        self.db.removeUser(self.test_user1)
+        self.assertEqual([], self.db.getPFIDsByAlias(['4b']), "Aliases were not removed with the user!")
+
     def testGetAllUsers(self):
         """getAllUsers gets all the usersfrom the database"""
         users = self.db.getAllUsers()
@@ -136,6 +158,15 @@ class TestPNBDatabase(unittest.TestCase):
         self.assertIn(self.test_user1, users, 'Missing User 1!')
         self.assertIn(self.test_user2, users, 'Missing User 2!')
 
+    def testIterPFIDs(self):
+        """iterPFIDs streams the PFIDs of all users, or all admins, in chunks"""
+        self.db.addUser(User.newUser('102', 'Jim Croce'))
+        chunks = list(self.db.iterPFIDs(chunk_size=2))
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual({'100', '101', '102'}, {pfid for chunk in chunks for pfid in chunk})
+
+        self.assertEqual([[self.test_user2.PFID]], list(self.db.iterPFIDs(admins_only=True)))
+
     def testGetAllAdmins(self):
         """getAllAdmins gets all the admins in the database"""
         users = self.db.getAllAdmins()
@@ -201,6 +232,19 @@ class TestPNBDatabase(unittest.TestCase):
         self.assertEqual(self.test_package1.date_received, date_received, "Dates are not equal!")
         self.assertEqual(True, collected, "Collected Status not set to True!")
 
+    def testReminders(self):
+        """markReminded records each reminder once, and getPendingReminders returns it with the package"""
+        self.assertEqual([(self.test_package1, 0)], self.db.getPendingReminders())
+
+        self.assertTrue(self.db.markReminded(self.test_package1, 1))
+        self.assertFalse(self.db.markReminded(self.test_package1, 1), "Reminder recorded twice!")
+        self.assertTrue(self.db.markReminded(self.test_package1, 2))
+        self.assertFalse(self.db.markReminded(self.test_package2, 1), "Reminder recorded for collected package!")
+        self.assertEqual([(self.test_package1, 2)], self.db.getPendingReminders())
+
+        self.db.claimPackage(self.test_package1)
+        self.assertEqual([], self.db.getPendingReminders())
+
     def testNextPackageId(self):
         """Package.next_id is set to MAX(id) from the database on login and the next package has that id."""
         self.db.close()
@@ -212,3 +256,261 @@ class TestPNBDatabase(unittest.TestCase):
 
         package = Package.newPackage(1234, datetime.date.today())
         self.assertEqual(max_id + 1, package.id)
+
+    def testPackageIdTaken(self):
+        """a package whose id another worker took gets the next free id"""
+        Package.next_id = self.test_package1.id
+        package = Package.newPackage(4321, datetime.date.today())
+        self.db.addPackage(package)
+
+        self.assertEqual(self.test_package2.id + 1, package.id)
+        self.assertEqual(package, self.db.getPackage(package.id))
+        self.assertEqual(self.test_package1, self.db.getPackage(self.test_package1.id), "Package was overwritten!")
+
+    def testTenants(self):
+        """forTenant reads and writes the tenant's own tables and shares the connection pool"""
+        self.cur.execute('DROP SCHEMA IF EXISTS tenant_b CASCADE')
+        self.cur.execute('CREATE SCHEMA tenant_b')
+        self.cur.execute('CREATE TABLE tenant_b.users (pfid varchar(20) PRIMARY KEY, name varchar(40) NOT NULL, ugroup varchar(10) NOT NULL)')
+        self.cur.execute('CREATE TABLE tenant_b.packages (id integer PRIMARY KEY, code integer NOT NULL, date_received date NOT NULL, collected bool)')
+        self.cur.execute('CREATE TABLE tenant_b.aliases (alias varchar(40) NOT NULL, pfid varchar(20) NOT NULL REFERENCES tenant_b.users ON DELETE CASCADE, PRIMARY KEY (alias, pfid))')
+        self.cur.execute('CREATE TABLE tenant_b.reminders (package_id integer PRIMARY KEY REFERENCES tenant_b.packages ON DELETE CASCADE, sent smallint NOT NULL)')
+        self.cur.execute('GRANT USAGE ON SCHEMA tenant_b TO test_pnb')
+        self.cur.execute('GRANT SELECT, INSERT, UPDATE, DELETE ON tenant_b.users, tenant_b.packages, tenant_b.aliases, tenant_b.reminders TO test_pnb')
+        self.conn.commit()
+
+        tenant_db = self.db.forTenant('tenant_b')
+        tenant_db.login()
+        self.assertIs(self.db.pool, tenant_db.pool, "Tenant did not share the connection pool!")
+
+        user = User.newUser('300', 'Klaus Hargreaves')
+        tenant_db.addUser(user)
+
+        self.assertEqual(user, tenant_db.getUser(user.PFID), "User was not added to the tenant!")
+        self.assertIsNone(self.db.getUser(user.PFID), "User leaked into the default tables!")
+        self.assertIsNone(tenant_db.getUser(self.test_user1.PFID), "Default users leaked into the tenant!")
+
+        self.cur.execute('DROP SCHEMA tenant_b CASCADE')
+        self.conn.commit()
+
+    def testMissingTables(self):
+        """a role without CREATE can still log in, and the tables it could not create are reported"""
+        self.assertEqual([], self.db.missingTables())
+
+        self.cur.execute('DROP TABLE reminders')
+        self.conn.commit()
+        self.assertEqual(['reminders'], self.db.missingTables())
+        self.db.login()
+
+    def testPublishChanges(self):
+        """writes notify ChangeListeners when they commit"""
+        self.cur.execute('LISTEN {}'.format(ChangeListener.CHANNEL))
+        self.conn.commit()
+
+        user = User.newUser('102', 'Reginald Hargreaves')
+        self.db.addUser(user)
+        self.db.claimPackage(self.test_package1)
+
+        self.conn.poll()
+        events = [ChangeEvent.from_payload(n.payload) for n in self.conn.notifies]
+        self.conn.notifies.clear()
+        self.cur.execute('UNLISTEN *')
+        self.conn.commit()
+
+        self.assertEqual([ChangeEvent(None, 'users', 'insert', user.PFID),
+                          ChangeEvent(None, 'packages', 'claim', self.test_package1.id)], events)
+
+    def testUserCache(self):
+        """getUser is cached once a listener is attached and change events invalidate the cache"""
+        self.db.attachListener(ChangeListener(self.db_config))
+
+        self.assertEqual(self.test_user1, self.db.getUser(self.test_user1.PFID))
+
+        # change the user behind the cache's back
+        self.cur.execute('UPDATE users SET name=%s WHERE pfid=%s', ('Hank Jenkins', self.test_user1.PFID))
+        self.conn.commit()
+        self.assertEqual(self.test_user1, self.db.getUser(self.test_user1.PFID), "User was not cached!")
+
+        self.db.onChange(ChangeEvent(None, 'users', 'update', self.test_user1.PFID))
+        self.assertEqual('Hank Jenkins', self.db.getUser(self.test_user1.PFID).name, "Cache was not invalidated!")
+
+    def testReplicaReads(self):
+        """reads routed to a replica return the same data, and writes are still made on the primary"""
+        # the test database doubles as its own replica
+        db = PNBDatabase(self.db_config, replicas=ReplicaSet([self.db_config]))
+        db.login()
+        self.assertEqual([self.test_user1], [u for u in db.getAllUsers() if u.PFID == self.test_user1.PFID])
+        self.assertEqual(self.test_package1, db.getPackage(self.test_package1.id))
+
+        with db.actingAs('102'):
+            db.addUser(User.newUser('102', 'Jim Croce'))
+            self.assertIs(db.pool, db._readPool(), "Read after own write did not go to the primary!")
+        db.close()
+
+    def testNextIdChangeEvent(self):
+        """a package added by another worker moves Package.next_id past its id"""
+        Package.next_id = 0
+        self.db.onChange(ChangeEvent(None, 'packages', 'insert', 500))
+        self.assertEqual(501, Package.next_id)
+
+        # ids are unique across tenants
+        self.db.onChange(ChangeEvent('another_tenant', 'packages', 'insert', 900))
+        self.assertEqual(901, Package.next_id, "Event for another tenant was not applied!")
+
+        self.db.onChange(ChangeEvent(None, 'packages', 'insert', 20))
+        self.assertEqual(901, Package.next_id, "next_id moved backwards!")
+
+
+class TestUserCache(unittest.TestCase):
+    class FakeCursor():
+        def __init__(self, rows, during_query=None):
+            self.rows = rows
+            self.during_query = during_query
+
+        def execute(self, query, args):
+            self.pfid = args[0]
+            if self.during_query is not None:
+                self.during_query()
+
+        def fetchone(self):
+            return self.rows.get(self.pfid)
+
+    def setUp(self):
+        self.db = PNBDatabase(PNBDatabase.CredentialsConfig('pnb_test', 'test_pnb', 'secret_pwd'))
+        self.db.cache_users = True
+        self.rows = {'100': ('100', 'Hank Jenkins', 'user')}
+        self.during_query = None
+        self.queries = 0
+
+        @contextlib.contextmanager
+        def cursor(operation, replica=False, name=None):
+            self.queries += 1
+            yield self.FakeCursor(self.rows, self.during_query)
+        self.db._cursor = cursor
+
+    def testRacedInvalidation(self):
+        """a user read while a change event for them arrives is not cached"""
+        self.during_query = lambda: self.db.onChange(ChangeEvent(None, 'users', 'update', '100'))
+        self.assertEqual('Hank Jenkins', self.db.getUser('100').name)
+        self.assertIsNone(self.db.getCachedUser('100'), "Raced read was cached!")
+
+        self.during_query = None
+        self.db.getUser('100')
+        self.assertEqual('Hank Jenkins', self.db.getCachedUser('100').name)
+        self.db.getUser('100')
+        self.assertEqual(2, self.queries)
+
+    def testMissNotCached(self):
+        """users that do not exist are looked up again, so the cache only ever holds real users"""
+        self.assertIsNone(self.db.getUser('101'))
+        self.assertIsNone(self.db.getUser('101'))
+        self.assertEqual(2, self.queries)
+        self.assertNotIn('101', self.db._users)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.config = PNBDatabase.CredentialsConfig('pnb_test', 'test_pnb', 'secret_pwd')
+
+    def testConnectArgs(self):
+        """every connection gives up connecting and cancels slow statements"""
+        args, kwargs = connect_args(self.config, connect_timeout=3, statement_timeout=1.5)
+        self.assertEqual(self.config.get_connect_args()[0], args)
+        self.assertEqual(3, kwargs['connect_timeout'])
+        self.assertEqual('-c statement_timeout=1500', kwargs['options'])
+
+    def testPoolTimeoutIsNotFailure(self):
+        """a worker running out of connections does not open the breaker for everyone"""
+        pool = ConnectionPool(self.config, max_connections=1, name='test-pool-timeout')
+        pool._slots.acquire()
+        for _ in range(pool.breaker.failure_threshold):
+            with self.assertRaises(PoolTimeout):
+                with pool.breaker.guard(), pool.connection(timeout=0):
+                    pass
+        self.assertFalse(pool.breaker.is_open(), "Pool timeouts opened the breaker!")
+        pool._slots.release()
+
+
+class TestPackageIds(unittest.TestCase):
+    def testConcurrentIds(self):
+        """packages made on several threads at once get different ids"""
+        Package.next_id = 0
+        ids = []
+
+        def make_packages():
+            ids.extend(Package.newPackage(1234, datetime.date.today()).id for _ in range(1000))
+        threads = [threading.Thread(target=make_packages) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(list(range(8000)), sorted(ids))
+        self.assertEqual(8000, Package.next_id)
+
+    def testAdvanceNextId(self):
+        """next_id only moves forwards"""
+        Package.next_id = 10
+        Package.advance_next_id(5)
+        self.assertEqual(10, Package.next_id)
+        Package.advance_next_id(20)
+        self.assertEqual(20, Package.next_id)
+
+
+class TestReplicaSet(unittest.TestCase):
+    class FakeClock():
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    def setUp(self):
+        self.clock = self.FakeClock()
+        config = PNBDatabase.CredentialsConfig('pnb_test', 'test_pnb', 'secret_pwd')
+        self.replicas = ReplicaSet([config, config], sticky_window=5, clock=self.clock)
+        self.db = PNBDatabase(config, replicas=self.replicas)
+
+    def testRoundRobin(self):
+        """reads are spread over the replicas"""
+        self.assertEqual(self.replicas.pools, [self.db._readPool(), self.db._readPool()])
+        self.assertIs(self.replicas.pools[0], self.db._readPool())
+
+    def testStickyAfterWrite(self):
+        """a user reads from the primary for sticky_window seconds after their own write"""
+        self.replicas.noteWrite('100')
+        with PNBDatabase.actingAs('100'):
+            self.assertIs(self.db.pool, self.db._readPool())
+        with PNBDatabase.actingAs('101'):
+            self.assertIsNot(self.db.pool, self.db._readPool(), "Another user's write made reads sticky!")
+
+        self.clock.now += 5
+        with PNBDatabase.actingAs('100'):
+            self.assertIsNot(self.db.pool, self.db._readPool())
+
+    def testStickyForEveryone(self):
+        """a write made without a user, e.g. a new package, sends everyone's reads to the primary"""
+        self.replicas.noteWrite()
+        self.assertIs(self.db.pool, self.db._readPool())
+        with PNBDatabase.actingAs('101'):
+            self.assertIs(self.db.pool, self.db._readPool())
+
+    def testChangeEventsAreWrites(self):
+        """writes made by other workers also make reads sticky"""
+        self.db.onChange(ChangeEvent(None, 'users', 'insert', '103'))
+        with PNBDatabase.actingAs('103'):
+            self.assertIs(self.db.pool, self.db._readPool())
+        self.assertIsNot(self.db.pool, self.db._readPool())
+
+    def testSkipBrokenReplica(self):
+        """replicas whose circuit breaker is open are skipped, and the primary is used if none are left"""
+        for pool in self.replicas.pools:
+            pool.breaker.state = pool.breaker.OPEN
+            pool.breaker.opened_at = pool.breaker.clock()
+        self.assertIs(self.db.pool, self.db._readPool())
+
+        self.replicas.pools[1].breaker.state = self.replicas.pools[1].breaker.CLOSED
+        self.assertIs(self.replicas.pools[1], self.db._readPool())
+
+    def tearDown(self):
+        for pool in self.replicas.pools:
+            pool.breaker.state = pool.breaker.CLOSED
@@ -0,0 +1,69 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestPackageIndex: unit tests for the in memory index of uncollected packages
+"""
+import datetime
+import unittest
+
+from PackageIndex import PackageIndex
+from PNBDatabase import ChangeEvent, Package
+
+
+class FakeDB():
+    def __init__(self, packages):
+        self.packages = packages
+        self.loads = 0
+
+    def getUncollectedPackages(self):
+        self.loads += 1
+        return [p for p in self.packages if not p.collected]
+
+
+class TestPackageIndex(unittest.TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        yesterday = today - datetime.timedelta(days=1)
+        self.package1 = Package(1, 1234, today, False)
+        self.package2 = Package(2, 5678, yesterday, False)
+        self.package3 = Package(3, 9012, yesterday, True)
+        self.db = FakeDB([self.package1, self.package2, self.package3])
+        self.index = PackageIndex(self.db)
+
+    def testLoadOnce(self):
+        """the index is loaded on first use and then served from memory, oldest package first"""
+        self.assertEqual([self.package2, self.package1], self.index.uncollected())
+        self.assertEqual(self.package1, self.index.get(1))
+        self.assertIsNone(self.index.get(3), "Collected package was indexed!")
+        self.assertEqual(2, len(self.index))
+        self.assertEqual(1, self.db.loads)
+
+    def testAddRemove(self):
+        """add and remove keep a loaded index up to date without reloading it"""
+        self.index.uncollected()
+        package4 = Package(4, 3456, self.package2.date_received, False)
+        self.index.add(package4)
+        self.index.remove(2)
+
+        self.assertEqual([package4, self.package1], self.index.uncollected())
+        self.assertEqual(1, self.db.loads)
+
+    def testChangeEvents(self):
+        """claims by other workers are removed, their inserts and resets cause a reload"""
+        self.index.uncollected()
+        self.index.onChange(ChangeEvent(None, 'packages', 'claim', 1))
+        self.assertEqual([self.package2], self.index.uncollected())
+        self.assertEqual(1, self.db.loads)
+
+        # our own insert is already indexed
+        package4 = Package(4, 3456, self.package1.date_received, False)
+        self.index.add(package4)
+        self.index.onChange(ChangeEvent(None, 'packages', 'insert', 4))
+        self.assertEqual(1, self.db.loads)
+
+        self.index.onChange(ChangeEvent(None, 'packages', 'insert', 5))
+        self.index.uncollected()
+        self.assertEqual(2, self.db.loads)
+
+        self.index.onChange(ChangeEvent.reset())
+        self.index.uncollected()
+        self.assertEqual(3, self.db.loads)
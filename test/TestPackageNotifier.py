@@ -2,20 +2,29 @@
     created by Jordan Gassaway, 9/23/2020
     TestPackageNotifier: unit tests for package notifier class
 """
+import contextlib
 import datetime
+import json
 import re
 import unittest
 from unittest import mock
 
 import psycopg2
 
-from PNBDatabase import PNBDatabase, User, Package
+from PNBDatabase import ChangeEvent, PNBDatabase, User, Package
+from PreparedMessage import PreparedMessage
 
 
 class MockDB(mock.Mock):
     """Mock for PNBDatabase"""
     users = {}
     packages = {}
+    aliases = {}
+    reminded = {}
+
+    @contextlib.contextmanager
+    def actingAs(self, PFID):
+        yield
 
     def addUser(self, user:User):
         self.users[user.PFID] = user
@@ -35,6 +44,12 @@ class MockDB(mock.Mock):
         admins = filter(lambda u: u.group == User.Group.ADMIN, self.users.values())
         return list(admins)
 
+    def iterPFIDs(self, admins_only=False, chunk_size=2):
+        self._iterPFIDs(admins_only)
+        users = [u for u in self.users.values() if u.isAdmin() or not admins_only]
+        for i in range(0, len(users), chunk_size):
+            yield [u.PFID for u in users[i:i + chunk_size]]
+
     def getUserByName(self, name):
         self._getUserByName(name)
         users = filter(lambda u: u.name.lower() == name, self.users.values())
@@ -44,6 +59,25 @@ class MockDB(mock.Mock):
         self._removeUser(user)
         self.users.pop(user.PFID)
 
+    def addAlias(self, user:User, alias):
+        self._addAlias(user, alias)
+        self.aliases.setdefault(PNBDatabase.normalizeAlias(alias), set()).add(user.PFID)
+
+    def removeAlias(self, user:User, alias):
+        self._removeAlias(user, alias)
+        self.aliases.get(PNBDatabase.normalizeAlias(alias), set()).discard(user.PFID)
+
+    def getAliases(self, user:User):
+        self._getAliases(user)
+        return sorted([alias for alias, pfids in self.aliases.items() if user.PFID in pfids])
+
+    def getPFIDsByAlias(self, aliases):
+        self._getPFIDsByAlias(aliases)
+        pfids = set()
+        for alias in aliases:
+            pfids |= self.aliases.get(PNBDatabase.normalizeAlias(alias), set())
+        return list(pfids)
+
     def addPackage(self, package:Package):
         self._addPackage(package)
         self.packages[package.id] = package
@@ -61,10 +95,23 @@ class MockDB(mock.Mock):
         self._claimPackage(package)
         self.packages[package.id].collected = True
 
+    def getPendingReminders(self):
+        self._getPendingReminders()
+        return [(p, self.reminded.get(p.id, 0)) for p in self.packages.values() if not p.collected]
+
+    def markReminded(self, package:Package, sent):
+        self._markReminded(package, sent)
+        if self.reminded.get(package.id, 0) >= sent or self.packages[package.id].collected:
+            return False
+        self.reminded[package.id] = sent
+        return True
+
     def reset(self):
         self.reset_mock()
         self.users = {}
         self.packages = {}
+        self.aliases = {}
+        self.reminded = {}
 
     def load(self, users=None, packages=None):
         if users:
@@ -98,7 +145,7 @@ class MockRequestResult(mock.Mock):
         return {'first_name': 'Unknown', 'last_name': 'Unknown'}
 
 class MockRequestLib(mock.Mock):
-    def get(self, url):
+    def get(self, url, **kwargs):
         self._get(url)
         return MockRequestResult(url)
 
@@ -182,6 +229,16 @@ class TestPackageNotifier(unittest.TestCase):
         MOCK_DB.login.assert_called_once_with()
         MOCK_PYMESSENGER_LIB.assert_called_once_with(self.config.auth_token)
 
+    def testInitTenant(self):
+        """PackageNotifier uses its tenant's tables on a shared database instead of opening a new one"""
+        config = PackageNotifier.Config('test_auth_token', 'db_config', 'uS3R*_pwd', 'aDMin_&pwd', tenant='maple_court',
+                                        page_id='5550001')
+        pn = PackageNotifier(config, MOCK_DB)
+
+        MOCK_PNBDATABASE_LIB.assert_not_called()
+        MOCK_DB.forTenant.assert_called_once_with('maple_court')
+        pn.db.login.assert_called_once_with()
+
     def testAddUserCmd(self):
         """PackageNotifier successfully ads a new user or admin"""
         pn = PackageNotifier(self.config)
@@ -210,7 +267,8 @@ class TestPackageNotifier(unittest.TestCase):
         """Help command returns help text. Help text for users does not include admin commands."""
         pn = PackageNotifier(self.config)
 
-        user_cmds = ['list packages', 'claim package', 'unsubscribe', 'help']
+        user_cmds = ['list packages', 'claim package', 'unsubscribe', 'help', 'add alias', 'remove alias',
+                     'list aliases']
         admin_cmds = user_cmds + ['list users', 'remove user']
 
         # Query Help
@@ -260,6 +318,33 @@ class TestPackageNotifier(unittest.TestCase):
         MOCK_DB._claimPackage.assert_called_once_with(self.test_package1)
         self.assertTrue(self.test_package1.collected, "Package was not marked as collected")
 
+    def testClaimPackageBadId(self):
+        """claim package with an id that is not a number gets a reply instead of an error"""
+        pn = PackageNotifier(self.config)
+
+        for cmd in ['claim package abc', 'claim package']:
+            MOCK_BOT.reset_mock()
+            pn.handle_message(FakeMessage(self.test_user1, cmd))
+            self.assertIn('No package found', MOCK_BOT.send_text_message.call_args[0][1])
+        MOCK_DB._claimPackage.assert_not_called()
+
+    def testPackageIndex(self):
+        """uncollected packages are loaded once and kept up to date by new emails and claims"""
+        pn = PackageNotifier(self.config)
+
+        pn.handle_message(FakeMessage(self.test_user1, 'list packages'))
+        pn.handle_email(FakeEmail.from_package(self.test_package4))
+        pn.handle_message(FakeMessage(self.test_user1, 'claim package {:d}'.format(self.test_package1.id)))
+        MOCK_BOT.reset_mock()
+        pn.handle_message(FakeMessage(self.test_user1, 'list packages'))
+
+        MOCK_DB._getUncollectedPackages.assert_called_once_with()
+        MOCK_DB._getPackage.assert_not_called()
+        self.assertEqual(2, MOCK_BOT.send_text_message.call_count, "Incorrect number of packages returned!")
+        listed = [args[0][1] for args in MOCK_BOT.send_text_message.call_args_list]
+        self.assertNotIn(str(self.test_package1), listed, "Claimed package was listed!")
+        self.assertIn(str(self.test_package3), listed)
+
     def testUnsubscribeCmd(self):
         """unsubscribe removes the user from the system"""
         pn = PackageNotifier(self.config)
@@ -335,6 +420,149 @@ class TestPackageNotifier(unittest.TestCase):
         self.assertEqual(MOCK_BOT.send_text_message.call_count, 1, "Incorrect number of messages sent out!")
         self.assertIn("no pickup code", MOCK_BOT.send_text_message.call_args[0][1].lower(), "Message did not indicate an error")
 
+    def testHandleEmailMultiplePackages(self):
+        """handle_email adds every package listed in an email and sends each user one message about all of them."""
+        pn = PackageNotifier(self.config)
+
+        email = FakeEmail('Pickup Code 1111\nPickup Code 2222\n', '1111')
+        pn.handle_email(email)
+
+        codes = [p.code for p in MOCK_DB.packages.values()]
+        self.assertIn(1111, codes, "First package was not added!")
+        self.assertIn(2222, codes, "Second package was not added!")
+        self.assertEqual(MOCK_BOT.send_text_message.call_count, 3, "Incorrect number of messages sent out!")
+        self.assertIn('1111', MOCK_BOT.send_text_message.call_args[0][1], "Message did not contain first code!")
+        self.assertIn('2222', MOCK_BOT.send_text_message.call_args[0][1], "Message did not contain second code!")
+
+    def testCoalesceNotifications(self):
+        """packages from emails that arrive within the coalesce window are sent to each user as one digest"""
+        config = PackageNotifier.Config('test_auth_token', 'db_config', 'uS3R*_pwd', 'aDMin_&pwd', coalesce_window=60)
+        pn = PackageNotifier(config)
+
+        for code in ['1111', '2222', '3333']:
+            pn.handle_email(FakeEmail('Pickup Code {}'.format(code), code))
+
+        self.assertEqual(MOCK_BOT.send_text_message.call_count, 0, "Messages were sent before the window closed!")
+
+        pn.close()
+        self.assertEqual(MOCK_BOT.send_text_message.call_count, 3, "Incorrect number of messages sent out!")
+        pfids = [args[0][0] for args in MOCK_BOT.send_text_message.call_args_list]
+        self.assertCountEqual([self.test_user1.PFID, self.test_user2.PFID, self.test_user3.PFID], pfids)
+        for code in ['1111', '2222', '3333']:
+            self.assertIn(code, MOCK_BOT.send_text_message.call_args[0][1], "Digest is missing {}!".format(code))
+
+    def testAliasCmds(self):
+        """add alias, remove alias and list aliases manage the names and units a user is notified for"""
+        pn = PackageNotifier(self.config)
+
+        pn.handle_message(FakeMessage(self.test_user2, 'add alias Apt 4B'))
+        pn.handle_message(FakeMessage(self.test_user2, 'add alias Vanya Hargreaves'))
+        self.assertEqual(['4b', 'vanya hargreaves'], MOCK_DB.getAliases(self.test_user2))
+
+        MOCK_BOT.reset_mock()
+        pn.handle_message(FakeMessage(self.test_user2, 'list aliases'))
+        self.assertIn('4b', MOCK_BOT.send_text_message.call_args[0][1])
+
+        pn.handle_message(FakeMessage(self.test_user2, 'remove alias 4b'))
+        self.assertEqual(['vanya hargreaves'], MOCK_DB.getAliases(self.test_user2))
+
+    def testTargetedNotification(self):
+        """packages addressed to a registered alias only notify that user. Unmatched packages go to everyone."""
+        pn = PackageNotifier(self.config)
+        MOCK_DB.addAlias(self.test_user2, '4B')
+
+        pn.handle_email(FakeEmail('Hello Vanya,\nUnit 4B\nPickup Code 1111', '1111'))
+        MOCK_BOT.send_text_message.assert_called_once()
+        self.assertEqual(self.test_user2.PFID, MOCK_BOT.send_text_message.call_args[0][0], "Wrong user notified!")
+        self.assertIn('1111', MOCK_BOT.send_text_message.call_args[0][1])
+
+        MOCK_BOT.reset_mock()
+        pn.handle_email(FakeEmail('Hello Luther,\nUnit 9C\nPickup Code 2222', '2222'))
+        self.assertEqual(MOCK_BOT.send_text_message.call_count, 3, "Unmatched package was not broadcast!")
+
+    def testTargetedDigest(self):
+        """with coalescing each user's digest only lists the packages that were sent to them"""
+        config = PackageNotifier.Config('test_auth_token', 'db_config', 'uS3R*_pwd', 'aDMin_&pwd', coalesce_window=60)
+        pn = PackageNotifier(config)
+        MOCK_DB.addAlias(self.test_user2, '4B')
+
+        pn.handle_email(FakeEmail('Unit 4B\nPickup Code 1111', '1111'))
+        pn.handle_email(FakeEmail('Pickup Code 2222', '2222'))
+        pn.close()
+
+        messages = {args[0][0]: args[0][1] for args in MOCK_BOT.send_text_message.call_args_list}
+        self.assertEqual(3, len(messages))
+        self.assertIn('1111', messages[self.test_user2.PFID])
+        self.assertIn('2222', messages[self.test_user2.PFID])
+        self.assertNotIn('1111', messages[self.test_user3.PFID], "Targeted package was broadcast!")
+        self.assertIn('2222', messages[self.test_user3.PFID])
+
+    def testPreparedBroadcast(self):
+        """broadcasts are sent as prepared messages, which are posted as pre-serialized json"""
+        pn = PackageNotifier(self.config)
+        pn.handle_email(FakeEmail('Pickup Code 1111', '1111'))
+
+        broadcast = MOCK_BOT.send_text_message.call_args[0][1]
+        self.assertIsInstance(broadcast, PreparedMessage)
+        self.assertEqual(pn.new_packages_message(pn.packages.uncollected()[-1:]), broadcast)
+
+        session = MOCK_REQUESTS_LIB.Session.return_value
+        session.merge_environment_settings.return_value = {}
+        graph = mock.Mock(graph_url='https://graph.facebook.com/v2.6', auth_args={'access_token': 'test_auth_token'})
+        pn._send_raw(graph, {'recipient': {'id': self.test_user2.PFID}, 'message': {'text': broadcast}})
+        session.post.assert_not_called()
+        prepared = session.prepare_request.return_value.copy.return_value
+        session.send.assert_called_once_with(prepared, timeout=self.config.http_timeout)
+        body = prepared.prepare_body.call_args[0][0]
+        self.assertEqual({'recipient': {'id': self.test_user2.PFID}, 'message': {'text': str(broadcast)}},
+                         json.loads(body.decode('utf-8')))
+
+    def testReminders(self):
+        """reminders go to every user, the last one to the admins, and only once per package"""
+        config = PackageNotifier.Config('test_auth_token', 'db_config', 'uS3R*_pwd', 'aDMin_&pwd',
+                                        reminder_days=[2, 5])
+        pn = PackageNotifier(config)
+        pn.reminders.load()
+        self.assertEqual(2, len(pn.reminders))
+        pn.handle_email(FakeEmail('Pickup Code 1111', '1111'))
+        self.assertEqual(3, len(pn.reminders), "New package was not scheduled!")
+        MOCK_BOT.reset_mock()
+
+        pn.send_reminders(0, [self.test_package1, self.test_package3])
+        self.assertEqual(MOCK_BOT.send_text_message.call_count, 3, "Incorrect number of reminders sent out!")
+        msg = MOCK_BOT.send_text_message.call_args[0][1]
+        self.assertIn('2 days', msg)
+        self.assertIn(str(self.test_package1.code), msg)
+        self.assertIn(str(self.test_package3.code), msg)
+
+        # another worker sent it already
+        MOCK_BOT.reset_mock()
+        pn.send_reminders(0, [self.test_package1])
+        MOCK_BOT.send_text_message.assert_not_called()
+
+        pn.send_reminders(1, [self.test_package1])
+        MOCK_BOT.send_text_message.assert_called_once()
+        self.assertEqual(self.test_user1.PFID, MOCK_BOT.send_text_message.call_args[0][0], "Reminder not sent to admin!")
+        self.assertIn('5 days', MOCK_BOT.send_text_message.call_args[0][1])
+
+    def testUnverifiedSenders(self):
+        """senders who are not users are only looked up once, and ignored once they run out of guesses"""
+        config = PackageNotifier.Config('test_auth_token', 'db_config', 'uS3R*_pwd', 'aDMin_&pwd',
+                                        passphrase_attempts=3)
+        pn = PackageNotifier(config)
+        for guess in ['hello', 'password', 'letmein', 'hunter2', 'uS3R*_pwd']:
+            pn.handle_message(FakeMessage(self.test_user4, guess))
+
+        MOCK_DB._getUser.assert_called_once_with(self.test_user4.PFID)
+        self.assertEqual(3, MOCK_BOT.send_text_message.call_count, "Guesses past the limit were answered!")
+        MOCK_DB._addUser.assert_not_called()
+
+        # added by another worker
+        MOCK_DB.users[self.test_user4.PFID] = self.test_user4
+        pn.onChange(ChangeEvent(None, 'users', 'insert', self.test_user4.PFID))
+        pn.handle_message(FakeMessage(self.test_user4, 'help'))
+        self.assertEqual(pn.HELP_TEXT_ADMIN, MOCK_BOT.send_text_message.call_args[0][1])
+
     def testGetUserName(self):
         """when creating a new user, PackageNotifier correctly queries the Facebook API for the full name"""
         pn = PackageNotifier(self.config)
@@ -0,0 +1,31 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestPreparedMessage: unit tests for pre-serialized message payloads
+"""
+import json
+import unittest
+
+from PreparedMessage import PreparedMessage
+
+
+class TestPreparedMessage(unittest.TestCase):
+    def testIsText(self):
+        """a prepared message can be used anywhere its text is"""
+        msg = PreparedMessage('New package received (Package #7)')
+        self.assertEqual('New package received (Package #7)', msg)
+        self.assertIn('#7', msg)
+        self.assertEqual('new package received (package #7)', msg.lower())
+
+    def testPayload(self):
+        """the payload is the json pymessenger would post for the same recipient and text"""
+        text = 'Pickup code 1234 \n"claim package 7" — café \\ done'
+        msg = PreparedMessage(text)
+        for recipient in ['102', 'abc"def', 42]:
+            expected = {'recipient': {'id': recipient}, 'message': {'text': text}}
+            self.assertEqual(expected, json.loads(msg.payload(recipient).decode('utf-8')))
+
+    def testPayloadReused(self):
+        """only the recipient differs between payloads"""
+        msg = PreparedMessage('2 new packages received')
+        first, second = msg.payload('101'), msg.payload('102')
+        self.assertEqual(first.replace(b'"101"', b'"102"'), second)
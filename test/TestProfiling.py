@@ -0,0 +1,86 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestProfiling: unit tests for the sampling profiler and call counts
+"""
+import threading
+import time
+import unittest
+
+from Profiling import SamplingProfiler
+from Tracing import Tracer
+
+
+def busy_handler(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def idle_handler(stop):
+    stop.wait(2)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer(log=lambda line: None)
+        self.profiler = SamplingProfiler(interval=0.001, tracer=self.tracer)
+
+    def tearDown(self):
+        self.profiler.stop()
+
+    def testTimedSession(self):
+        """a timed session samples every thread and ends by itself"""
+        self.assertTrue(self.profiler.start(duration=0.2))
+        self.assertFalse(self.profiler.start(duration=0.2), "Second session was started!")
+        busy_handler(0.1)
+        self.profiler._thread.join(1)
+
+        self.assertFalse(self.profiler.active)
+        self.assertGreater(self.profiler.samples, 0)
+        lines = self.profiler.collapsed().splitlines()
+        self.assertTrue(any('TestProfiling:busy_handler' in line for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertEqual(stack.split(';')[-1], stack.split(';')[-1].strip())
+
+    def testSampledRequests(self):
+        """with a request rate only threads handling a picked request are sampled"""
+        stop = threading.Event()
+        idle = threading.Thread(target=idle_handler, args=(stop, ))
+        idle.start()
+
+        self.profiler.start(duration=5, request_rate=1.0)
+        with self.profiler.sample_request():
+            busy_handler(0.1)
+        self.profiler.stop()
+        stop.set()
+        idle.join()
+
+        collapsed = self.profiler.collapsed()
+        self.assertIn('busy_handler', collapsed)
+        self.assertNotIn('idle_handler', collapsed, "Thread outside of a request was sampled!")
+
+    def testCallCounts(self):
+        """spans finished during a session are counted per call"""
+        self.profiler.start(duration=5)
+        with self.tracer.trace('receive_message'):
+            for _ in range(3):
+                with self.tracer.span('db', 'getUser'):
+                    pass
+            with self.tracer.span('http', 'messenger.send_text_message'):
+                pass
+        self.profiler.stop()
+
+        report = self.profiler.calls.report()
+        self.assertEqual(3, report['db.getUser']['calls'])
+        self.assertEqual(1, report['http.messenger.send_text_message']['calls'])
+        self.assertEqual(1, report['request.receive_message']['calls'])
+        self.assertIsNone(self.tracer.observer, "Profiler still observing after the session!")
+
+    def testOffByDefault(self):
+        """nothing is recorded while no session is running"""
+        with self.profiler.sample_request():
+            with self.tracer.span('db', 'getUser'):
+                pass
+        self.assertEqual('', self.profiler.collapsed())
+        self.assertEqual({}, self.profiler.calls.report())
@@ -0,0 +1,59 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestRecipientStream: unit tests for streaming notification recipients
+"""
+import threading
+import unittest
+
+from RecipientStream import RecipientStream
+
+
+class TestRecipientStream(unittest.TestCase):
+    def testStream(self):
+        """every PFID of every chunk is yielded in order"""
+        chunks = [['101', '102'], ['103'], [], ['104']]
+        self.assertEqual(['101', '102', '103', '104'], list(RecipientStream(iter(chunks))))
+
+    def testBounded(self):
+        """the producer never gets more than depth chunks ahead of the consumer"""
+        produced = []
+
+        def chunks():
+            for i in range(20):
+                produced.append(i)
+                yield [str(i)]
+
+        stream = iter(RecipientStream(chunks(), depth=2))
+        self.assertEqual('0', next(stream))
+        threading.Event().wait(0.3)
+        # one chunk being consumed, two queued and one waiting for room
+        self.assertLessEqual(len(produced), 4)
+        self.assertEqual([str(i) for i in range(1, 20)], list(stream))
+
+    def testStopEarly(self):
+        """stopping early closes the producer's generator so its connection is returned"""
+        closed = threading.Event()
+
+        def chunks():
+            try:
+                for i in range(100):
+                    yield [str(i)]
+            finally:
+                closed.set()
+
+        for pfid in RecipientStream(chunks(), depth=1):
+            if pfid == '3':
+                break
+        self.assertTrue(closed.wait(1), "Producer was not closed!")
+
+    def testProducerError(self):
+        """an error while fetching recipients is raised to the consumer"""
+        def chunks():
+            yield ['101']
+            raise RuntimeError('connection lost')
+
+        received = []
+        with self.assertRaises(RuntimeError):
+            for pfid in RecipientStream(chunks()):
+                received.append(pfid)
+        self.assertEqual(['101'], received)
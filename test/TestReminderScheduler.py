@@ -0,0 +1,144 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestReminderScheduler: unit tests for the uncollected package reminder scheduler
+"""
+import datetime
+import time
+import unittest
+
+from PNBDatabase import ChangeEvent, Package
+from ReminderScheduler import ReminderScheduler
+
+
+class FakeDB:
+    def __init__(self, pending=(), packages=()):
+        self.pending = list(pending)
+        self.packages = {p.id: p for p in packages}
+        self.loads = 0
+
+    def getPendingReminders(self):
+        self.loads += 1
+        return list(self.pending)
+
+    def getPackage(self, id):
+        return self.packages.get(id)
+
+
+class FakeClock:
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestReminderScheduler(unittest.TestCase):
+    def setUp(self):
+        self.received = datetime.date(2026, 10, 1)
+        self.package1 = Package(1, 1111, self.received, False)
+        self.package2 = Package(2, 2222, self.received, False)
+        self.package3 = Package(3, 3333, self.received + datetime.timedelta(days=1), False)
+        self.sent = []
+        self.clock = FakeClock()
+        self.db = FakeDB([(self.package1, 0), (self.package2, 0), (self.package3, 0)])
+        self.scheduler = ReminderScheduler(self.db, [2, 5, 10], self.remind, clock=self.clock)
+        self.scheduler.load()
+
+    def remind(self, stage, packages):
+        self.sent.append((stage, sorted(p.id for p in packages)))
+
+    def at(self, date, hour=9):
+        self.clock.now = time.mktime(datetime.datetime(date.year, date.month, date.day, hour).timetuple())
+
+    def days_after(self, days, hour=9):
+        self.at(self.received + datetime.timedelta(days=days), hour)
+
+    def testSchedule(self):
+        """each reminder is sent once it is due, every package due at once in one call, until the last one"""
+        self.days_after(2, hour=8)
+        self.assertEqual(0, self.scheduler.run_due(), "Reminder sent early!")
+
+        self.days_after(2)
+        self.assertEqual(2, self.scheduler.run_due())
+        self.days_after(3)
+        self.scheduler.run_due()
+        self.days_after(5)
+        self.scheduler.run_due()
+        self.days_after(11)
+        self.scheduler.run_due()
+        self.assertEqual([(0, [1, 2]), (0, [3]), (1, [1, 2]), (2, [1, 2, 3])], self.sent)
+
+        self.sent = []
+        self.days_after(30)
+        self.assertEqual(0, self.scheduler.run_due())
+        self.assertEqual(0, len(self.scheduler), "Packages still scheduled after the last reminder!")
+
+    def testRemove(self):
+        """claimed packages are not reminded about"""
+        self.scheduler.remove(self.package1.id)
+        self.scheduler.onChange(ChangeEvent(None, 'packages', 'claim', self.package2.id))
+        self.days_after(30)
+        self.scheduler.run_due()
+        self.assertEqual([(2, [3])], self.sent)
+
+    def testCatchUp(self):
+        """only the latest due reminder is sent about packages that are far overdue, and none already sent again"""
+        self.db.pending = [(self.package1, 0), (self.package2, 1), (self.package3, 3)]
+        self.scheduler.load()
+        self.days_after(7)
+        self.scheduler.run_due()
+        self.assertEqual([(1, [1, 2])], self.sent)
+
+    def testAdd(self):
+        """new packages are scheduled from the day they were received, also when added by other workers"""
+        package4 = Package(4, 4444, self.received + datetime.timedelta(days=4), False)
+        package5 = Package(5, 5555, self.received + datetime.timedelta(days=4), False)
+        self.db.packages[package5.id] = package5
+        self.scheduler.add(package4)
+        self.scheduler.add(package4)
+        self.scheduler.onChange(ChangeEvent(None, 'packages', 'insert', package5.id))
+        self.scheduler.onChange(ChangeEvent(None, 'packages', 'insert', self.package1.id))
+
+        self.days_after(5)
+        self.scheduler.run_due()
+        self.days_after(6)
+        self.scheduler.run_due()
+        self.assertEqual([(0, [3]), (1, [1, 2]), (0, [4, 5]), (1, [3])], self.sent)
+
+    def testRetry(self):
+        """reminders are tried again after retry_delay if sending fails"""
+        def fail(stage, packages):
+            raise ConnectionError('graph api is down')
+        self.scheduler.remind_fn = fail
+        self.days_after(2)
+        self.assertEqual(0, self.scheduler.run_due())
+
+        self.scheduler.remind_fn = self.remind
+        self.clock.now += self.scheduler.retry_delay - 1
+        self.scheduler.run_due()
+        self.assertEqual([], self.sent, "Retried too soon!")
+        self.clock.now += 1
+        self.scheduler.run_due()
+        self.assertEqual([(0, [1, 2])], self.sent)
+
+    def testReset(self):
+        """missed change events make the scheduler load the packages again"""
+        self.scheduler.onChange(ChangeEvent.reset())
+        self.assertEqual(0, len(self.scheduler))
+        self.scheduler.start()
+        deadline = time.monotonic() + 5
+        while len(self.scheduler) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.scheduler.stop(5)
+        self.assertEqual(2, self.db.loads)
+        self.assertEqual(3, len(self.scheduler))
+
+    def testThread(self):
+        """the scheduler thread sends reminders that are due without being asked"""
+        self.days_after(2)
+        self.scheduler.start()
+        deadline = time.monotonic() + 5
+        while not self.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.scheduler.stop(5)
+        self.assertEqual([(0, [1, 2])], self.sent)
@@ -0,0 +1,93 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestResilience: unit tests for circuit breakers
+"""
+import unittest
+
+from Resilience import CircuitBreaker, CircuitOpen, GuardedProxy
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Flaky():
+    def __init__(self):
+        self.up = True
+        self.calls = 0
+
+    def send(self, value):
+        self.calls += 1
+        if not self.up:
+            raise ConnectionError('down')
+        return value
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=10, failures=(ConnectionError,),
+                                      clock=self.clock)
+        self.dependency = Flaky()
+        self.client = GuardedProxy(self.dependency, self.breaker)
+
+    def testOpensAfterFailures(self):
+        """the breaker opens after failure_threshold failures in a row and then fails fast"""
+        self.dependency.up = False
+        for _ in range(3):
+            self.assertRaises(ConnectionError, self.client.send, 1)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+        self.assertRaises(CircuitOpen, self.client.send, 1)
+        self.assertEqual(3, self.dependency.calls, "Open breaker still called the dependency!")
+
+    def testSuccessResetsCount(self):
+        """failures only open the breaker if they are consecutive"""
+        self.dependency.up = False
+        for _ in range(2):
+            self.assertRaises(ConnectionError, self.client.send, 1)
+        self.dependency.up = True
+        self.assertEqual(1, self.client.send(1))
+        self.dependency.up = False
+        for _ in range(2):
+            self.assertRaises(ConnectionError, self.client.send, 1)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def testOtherErrorsAreNotFailures(self):
+        """exceptions not listed in failures mean the dependency answered"""
+        for _ in range(5):
+            with self.assertRaises(KeyError):
+                with self.breaker.guard():
+                    raise KeyError('duplicate')
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def testHalfOpenProbe(self):
+        """after reset_timeout one probe is let through; success closes the breaker, failure reopens it"""
+        self.dependency.up = False
+        for _ in range(3):
+            self.assertRaises(ConnectionError, self.client.send, 1)
+
+        self.clock.now += 10
+        self.assertRaises(ConnectionError, self.client.send, 1)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        self.assertRaises(CircuitOpen, self.client.send, 1)
+
+        self.clock.now += 10
+        self.dependency.up = True
+        self.assertEqual(2, self.client.send(2))
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+
+    def testSingleProbe(self):
+        """while a probe is in flight other callers keep failing fast"""
+        self.dependency.up = False
+        for _ in range(3):
+            self.assertRaises(ConnectionError, self.client.send, 1)
+        self.clock.now += 10
+
+        with self.breaker.guard():
+            self.assertRaises(CircuitOpen, self.client.send, 1)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
@@ -0,0 +1,89 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestThrottle: unit tests for per sender token buckets and the negative cache
+"""
+import os
+import tempfile
+import unittest
+
+from Throttle import FileBucketStore, MemoryBucketStore, NegativeCache, SenderThrottle
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestThrottle(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def checkBucket(self, throttle):
+        for _ in range(3):
+            self.assertTrue(throttle.allow('101'))
+        self.assertFalse(throttle.allow('101'), "Burst was exceeded!")
+        self.assertTrue(throttle.allow('102'), "Other sender was throttled!")
+
+        self.clock.now += 1
+        self.assertFalse(throttle.allow('101'), "Refilled too fast!")
+        self.clock.now += 1
+        self.assertTrue(throttle.allow('101'))
+        self.assertFalse(throttle.allow('101'))
+
+        self.clock.now += 60
+        for _ in range(3):
+            self.assertTrue(throttle.allow('101'))
+        self.assertFalse(throttle.allow('101'), "Refilled past the burst!")
+
+    def testMemoryBuckets(self):
+        """each sender gets burst messages, then rate a second"""
+        throttle = SenderThrottle(0.5, 3, clock=self.clock)
+        self.checkBucket(throttle)
+        self.assertEqual(4, throttle.dropped)
+
+    def testForgetIdle(self):
+        """the least recently seen senders are forgotten beyond max_keys"""
+        store = MemoryBucketStore(max_keys=2)
+        throttle = SenderThrottle(0.5, 1, store, clock=self.clock)
+        self.assertTrue(throttle.allow('101'))
+        self.assertFalse(throttle.allow('101'))
+        throttle.allow('102')
+        throttle.allow('103')
+        self.assertTrue(throttle.allow('101'))
+
+    def testFileBuckets(self):
+        """file buckets behave the same and are shared by every store on the same file"""
+        path = os.path.join(self.tmp.name, 'buckets')
+        store = FileBucketStore(path, slots=64)
+        self.checkBucket(SenderThrottle(0.5, 3, store, clock=self.clock))
+
+        other = FileBucketStore(path, slots=64)
+        worker1 = SenderThrottle(0, 4, store, clock=self.clock)
+        worker2 = SenderThrottle(0, 4, other, clock=self.clock)
+        allowed = [worker1.allow('103'), worker2.allow('103'), worker1.allow('103'), worker2.allow('103'),
+                   worker1.allow('103'), worker2.allow('103')]
+        self.assertEqual([True] * 4 + [False] * 2, allowed)
+        store.close()
+        other.close()
+
+    def testNegativeCache(self):
+        """keys are remembered for ttl seconds"""
+        cache = NegativeCache(ttl=10, max_size=2, clock=self.clock)
+        cache.add('101')
+        self.assertIn('101', cache)
+        self.clock.now += 10
+        self.assertNotIn('101', cache)
+
+        for pfid in ['101', '102', '103']:
+            cache.add(pfid)
+        self.assertNotIn('101', cache, "Cache grew past max_size!")
+        cache.discard('102')
+        self.assertNotIn('102', cache)
+        self.assertIn('103', cache)
@@ -0,0 +1,102 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestTracing: unit tests for request tracing and the slow operation log
+"""
+import json
+import time
+import unittest
+
+from Tracing import Tracer, TracedProxy
+
+
+class FakeExporter():
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(spans)
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.logged = []
+        self.exporter = FakeExporter()
+        self.tracer = Tracer(thresholds={'request': 0.05, 'db': 0.01, 'http': 10}, exporter=self.exporter,
+                             log=self.logged.append)
+
+    def testSpansShareTraceId(self):
+        """spans started inside a trace are nested under it and exported with it"""
+        with self.tracer.trace('receive_message') as trace_id:
+            self.assertEqual(trace_id, self.tracer.current_trace_id())
+            with self.tracer.span('db', 'getUser', tenant=None):
+                pass
+            with self.tracer.span('http', 'send_text_message'):
+                pass
+
+        self.assertIsNone(self.tracer.current_trace_id())
+        self.assertEqual(1, len(self.exporter.traces))
+        root, db, http = self.exporter.traces[0]
+        self.assertEqual(['request', 'db', 'http'], [root.kind, db.kind, http.kind])
+        self.assertTrue(all(span.trace_id == trace_id for span in [root, db, http]))
+        self.assertEqual(root.span_id, db.parent_id)
+        self.assertEqual(root.span_id, http.parent_id)
+
+    def testContinueTrace(self):
+        """a trace id passed in by the caller is kept"""
+        with self.tracer.trace('receive_email', trace_id='abc123') as trace_id:
+            self.assertEqual('abc123', trace_id)
+
+    def testSlowLog(self):
+        """operations over their kind's threshold are logged, with a span breakdown for slow requests"""
+        with self.tracer.trace('receive_email'):
+            with self.tracer.span('db', 'addPackage'):
+                time.sleep(0.06)
+            with self.tracer.span('http', 'send_text_message'):
+                pass
+
+        self.assertEqual(2, len(self.logged))
+        slow_db, slow_request = [json.loads(line) for line in self.logged]
+        self.assertEqual('addPackage', slow_db['slow_op'])
+        self.assertEqual('db', slow_db['kind'])
+        self.assertEqual('receive_email', slow_request['slow_op'])
+        self.assertEqual(['db', 'http'], [s[0] for s in slow_request['spans']])
+
+    def testSpanWithoutTrace(self):
+        """spans outside of a trace are still timed and logged but not exported"""
+        with self.tracer.span('db', 'getAllUsers') as span:
+            time.sleep(0.02)
+
+        self.assertIsNone(span.trace_id)
+        self.assertEqual(1, len(self.logged))
+        self.assertEqual([], self.exporter.traces)
+
+    def testZipkinFormat(self):
+        """exported spans follow the Zipkin v2 json format"""
+        with self.tracer.trace('receive_message'):
+            with self.tracer.span('db', 'getUser', tenant='maple_court'):
+                pass
+
+        root, db = [span.to_zipkin('pnb') for span in self.exporter.traces[0]]
+        self.assertEqual('SERVER', root['kind'])
+        self.assertNotIn('parentId', root)
+        self.assertEqual('CLIENT', db['kind'])
+        self.assertEqual(root['id'], db['parentId'])
+        self.assertEqual(32, len(db['traceId']))
+        self.assertEqual(16, len(db['id']))
+        self.assertEqual({'tenant': 'maple_court'}, db['tags'])
+        self.assertEqual('db.getUser', db['name'])
+
+    def testTracedProxy(self):
+        """TracedProxy records a span for every method call and passes the result through"""
+        class Client():
+            url = 'https://graph.facebook.com'
+
+            def send_text_message(self, recipient, text):
+                return recipient + text
+
+        client = TracedProxy(Client(), 'http', 'messenger.', self.tracer)
+        with self.tracer.trace('receive_message'):
+            self.assertEqual('1hi', client.send_text_message('1', 'hi'))
+        self.assertEqual('https://graph.facebook.com', client.url)
+
+        self.assertEqual('messenger.send_text_message', self.exporter.traces[0][1].name)
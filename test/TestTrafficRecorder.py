@@ -0,0 +1,69 @@
+"""
+    created by Jordan Gassaway, 10/19/2026
+    TestTrafficRecorder: unit tests for recording webhook traffic
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from TrafficRecorder import TrafficRecorder
+from replay_traffic import load_requests
+
+
+def webhook(pfid, text, page_id='5550001'):
+    return {'object': 'page', 'entry': [{'id': page_id, 'messaging': [
+        {'sender': {'id': pfid}, 'recipient': {'id': page_id}, 'message': {'text': text}}]}]}
+
+
+class TestTrafficRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'capture.jsonl.gz')
+        self.recorder = TrafficRecorder(self.path, {'USER_PASSPHRASE': 'uS3R*_pwd'})
+
+    def tearDown(self):
+        self.recorder.close()
+        self.tmpdir.cleanup()
+
+    def testAnonymize(self):
+        """PFIDs get stable pseudonyms, passphrases become placeholders and the page id is kept"""
+        first = self.recorder.anonymize(webhook('101', 'uS3R*_pwd'))['entry'][0]
+        second = self.recorder.anonymize(webhook('101', 'list packages'))['entry'][0]
+        other = self.recorder.anonymize(webhook('102', 'help'))['entry'][0]
+
+        sender = first['messaging'][0]['sender']['id']
+        self.assertNotEqual('101', sender, "PFID was not anonymized!")
+        self.assertEqual(sender, second['messaging'][0]['sender']['id'], "Pseudonym is not stable!")
+        self.assertNotEqual(sender, other['messaging'][0]['sender']['id'])
+        self.assertEqual('<USER_PASSPHRASE>', first['messaging'][0]['message']['text'])
+        self.assertEqual('list packages', second['messaging'][0]['message']['text'])
+        self.assertEqual('5550001', first['id'])
+        self.assertEqual('5550001', first['messaging'][0]['recipient']['id'])
+
+    def testRecordAndLoad(self):
+        """recorded requests are loaded back in order with their route and offset"""
+        self.recorder.record('/', webhook('101', 'help'))
+        self.recorder.record('/email', {'title': 'package to pick up', 'body': 'Pickup Code 1234'})
+        self.recorder.close()
+
+        recorded = list(TrafficRecorder.load(self.path))
+        self.assertEqual(['/', '/email'], [route for t, route, body in recorded])
+        self.assertTrue(all(t >= 0 for t, route, body in recorded))
+        self.assertEqual('Pickup Code 1234', recorded[1][2]['body'])
+        self.assertNotEqual('101', recorded[0][2]['entry'][0]['messaging'][0]['sender']['id'])
+
+    def testDropRawEmail(self):
+        """raw emails are not recorded, only the parsed title and body"""
+        email = {'title': 'package to pick up', 'body': 'Pickup Code 1234', 'raw': 'To: 101 Main St'}
+        self.assertEqual({'title': 'package to pick up', 'body': 'Pickup Code 1234'}, self.recorder.anonymize(email))
+        self.assertIn('raw', email, "Original email was modified!")
+
+    def testReplaySecrets(self):
+        """placeholders are filled in with secrets that need escaping in json"""
+        self.recorder.record('/', webhook('101', 'uS3R*_pwd'))
+        self.recorder.close()
+
+        secret = 'say "hi" \\o/'
+        t, route, body = load_requests([self.path], {'USER_PASSPHRASE': secret})[0]
+        self.assertEqual(secret, json.loads(body.decode())['entry'][0]['messaging'][0]['message']['text'])